@@ -2,10 +2,16 @@ from flask import Flask, abort
 from flask_restful import Resource, Api, reqparse
 from flask_cors import CORS
 from dotenv import load_dotenv, find_dotenv
+import os
 
 from utils.sistemConfig import getMissingEnvironmentVar
-from utils.dbUtils import dbCheckCreateMySqlSchemaTables
+from utils.dbUtils import dbCheckCreateMySqlSchemaTables, registerDbRequestLifecycle, dbJsonDefault
+from utils.dbMigrations import dbRunMigrations
+from utils.jsonUtils import registerJsonRepresentation
+from utils.compression import registerResponseCompression
+from utils.etag import registerETag
 from utils.cryptoFunctions import loadGenerateKeys
+from utils.referenceData import loadReferenceData
 
 from services.authentication import AuthWithLoginApi, AuthWithTokenApi
 from services.user import UserApi, UserPendingApi, UsersApi, UsersPendingApi
@@ -28,8 +34,13 @@ if getMissingEnvironmentVar():
 
 # starts database
 dbCheckCreateMySqlSchemaTables()
+# applies pending migrations from sql/migrations, can also be done with appMigrations.py
+if os.getenv('SQL_MIGRATE_ON_STARTUP', 'true').lower() in ['true', '1']:
+  dbRunMigrations()
 # load/generate security keys
 loadGenerateKeys()
+# payment methods, product lookups and event names used by the validations
+loadReferenceData()
 
 # loads flask API
 app = Flask(__name__)
@@ -37,7 +48,20 @@ CORS(app, origins='*',
   headers=['Content-Type', 'Authorization', 'Content-Disposition'],
   expose_headers=['Authorization', 'Content-Disposition'])
 
+# after request functions run in reverse order, compression is registered first to run over the final response
+registerResponseCompression(app)
+
+# etags are computed over the uncompressed body, so they run before compression
+registerETag(app)
+
+# one database connection per request, released on teardown
+registerDbRequestLifecycle(app)
+
+# compact database rows, dates and decimals are converted only when serialized
+app.config['RESTFUL_JSON'] = { 'default': dbJsonDefault }
+
 api = Api(app)
+registerJsonRepresentation(api)
 api.add_resource(AuthWithLoginApi, '/auth-with-login')
 api.add_resource(AuthWithTokenApi, '/auth-with-token')
 
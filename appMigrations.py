@@ -0,0 +1,23 @@
+import sys
+from dotenv import load_dotenv, find_dotenv
+from utils.dbMigrations import dbRunMigrations, dbGetMigrationsStatus
+from utils.sistemConfig import getMissingEnvironmentVar
+
+# Usage: python appMigrations.py to apply pending migrations, python appMigrations.py status to list them
+
+# Env vars
+print('# Checking env vars')
+if getMissingEnvironmentVar():
+  print('# Loading and checking environment from .env')
+  load_dotenv(find_dotenv())
+  missingVar = getMissingEnvironmentVar()
+  if missingVar:
+    print('# Error - Missing ' + str(missingVar) + ' environment variable')
+    exit()
+
+if len(sys.argv) > 1 and sys.argv[1] == 'status':
+  for version, name, applied in dbGetMigrationsStatus():
+    print(f"\t{version} {name} {'applied' if applied else 'pending'}")
+else:
+  if not dbRunMigrations():
+    exit(1)
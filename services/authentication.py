@@ -1,11 +1,96 @@
-from flask import Flask, abort, request
+from flask import Flask, abort, request, g, has_request_context
 from flask_restful import Resource, Api, reqparse
+from flask_restful import abort as restfulAbort
+from functools import wraps
+from threading import Lock
+from time import perf_counter
+from math import ceil
 from datetime import datetime
 from base64 import b64decode
+from hashlib import sha256
 import jwt
+import os
 
-from utils.cryptoFunctions import getPrivateK,  getPublicK
+from utils.cryptoFunctions import getPrivateKObj, getPublicKObj
+from utils.cacheUtils import ttlLruCache, cacheMiss
+from utils.sessionStore import getSessionStore
+from utils.rateLimit import createTokenBucketLimiter
 from utils.dbUtils import *
+from utils.requestSchema import requestSchema, requestArgument
+
+globalAuthTokenCache = None
+globalVerifiedJwtCache = None
+globalLoginLimiters = None
+
+authorizationHelp = 'Bearer with jwt given by server in user autentication, required'
+
+globalAuthStatsLock = Lock()
+globalAuthStats = {
+  'authenticated': 0,
+  'rejected': 0,
+  'missing': 0,
+  'anonymous': 0,
+  'throttled': 0,
+  'auth_time_ms': 0.0
+}
+
+# tokens already validated, keyed by (token_user_id, token_date_time)
+# AUTH_TOKEN_CACHE_TTL is the max time a logout or new login done in another worker takes to reach this one
+def getAuthTokenCache():
+
+  global globalAuthTokenCache
+
+  if globalAuthTokenCache == None:
+    globalAuthTokenCache = ttlLruCache(int(os.getenv('AUTH_TOKEN_CACHE_SIZE', '1000')), float(os.getenv('AUTH_TOKEN_CACHE_TTL', '30')))
+  return globalAuthTokenCache
+
+def getAuthTokenCacheStats():
+  return getAuthTokenCache().getStats()
+
+# payloads of token strings with the signature already verified, keyed by the token sha256
+# the token is still checked against the session store, this only skips the RSA verify
+def getVerifiedJwtCache():
+
+  global globalVerifiedJwtCache
+
+  if globalVerifiedJwtCache == None:
+    globalVerifiedJwtCache = ttlLruCache(int(os.getenv('AUTH_JWT_CACHE_SIZE', '1000')), float(os.getenv('AUTH_JWT_CACHE_TTL', '300')))
+  return globalVerifiedJwtCache
+
+def getVerifiedJwtCacheStats():
+  return getVerifiedJwtCache().getStats()
+
+# login attempts allowed per minute by ip and by user mail, 0 disables the limit
+# LOGIN_RATE_LIMIT_BACKEND memory keeps a limit per worker, shared keeps it across the workers of the node
+def getLoginLimiters():
+
+  global globalLoginLimiters
+
+  if globalLoginLimiters == None:
+    backend = os.getenv('LOGIN_RATE_LIMIT_BACKEND', 'memory').lower()
+    ipPerMinute = float(os.getenv('LOGIN_RATE_LIMIT_IP', '30'))
+    mailPerMinute = float(os.getenv('LOGIN_RATE_LIMIT_MAIL', '5'))
+    globalLoginLimiters = {
+      'ip': createTokenBucketLimiter(backend, 'login_ip', ipPerMinute, ipPerMinute / 60),
+      'mail': createTokenBucketLimiter(backend, 'login_mail', mailPerMinute, mailPerMinute / 60)
+    }
+  return globalLoginLimiters
+
+# behind a proxy(like render.com) remote_addr is the proxy, LOGIN_RATE_LIMIT_FORWARDED_FOR uses the client in X-Forwarded-For
+def getLoginClientIp():
+
+  if os.getenv('LOGIN_RATE_LIMIT_FORWARDED_FOR', '').lower() in ['true', '1'] and request.access_route:
+    return request.access_route[0]
+  return request.remote_addr or ''
+
+def loginThrottledResponse(retryAfter):
+
+  countAuthStat('throttled')
+  retryAfter = str(max(ceil(retryAfter), 1))
+  return { 'message': 'Muitas tentativas de login, tente novamente em ' + retryAfter + ' segundos!' }, 429, { 'Retry-After': retryAfter }
+
+def invalidateUserAuthTokens(tokenUserId):
+  getAuthTokenCache().deleteWhere(lambda tokenKey: tokenKey[0] == tokenUserId)
 
 def createAuthToken(tokenUserId):
 
@@ -22,46 +107,133 @@ def createAuthToken(tokenUserId):
 
 def jwtEncode(tokenUserId, tokenDateTime):
 
-  tokenJwt = jwt.encode({'token_user_id': tokenUserId, 'token_date_time': tokenDateTime}, getPrivateK(), algorithm="RS256")
+  tokenJwt = jwt.encode({'token_user_id': tokenUserId, 'token_date_time': tokenDateTime}, getPrivateKObj(), algorithm="RS256")
   return tokenJwt
 
 def jwtDecode(tokenJwt):
 
-  tokenData = jwt.decode(tokenJwt, getPublicK(), algorithms=["RS256"])
+  tokenHash = sha256(tokenJwt.encode()).digest()
+  tokenData = getVerifiedJwtCache().get(tokenHash)
+  if tokenData is not cacheMiss:
+    return dict(tokenData)
+
+  tokenData = jwt.decode(tokenJwt, getPublicKObj(), algorithms=["RS256"])
+  getVerifiedJwtCache().set(tokenHash, dict(tokenData))
   return tokenData
     
 def isAuthTokenValid(args):
+  return isAuthTokenJwtValid(args['Authorization'].replace('Bearer ', ''))
+
+# validates the token and stores its data on flask.g as the authenticated user of the request
+def isAuthTokenJwtValid(tokenJwt):
 
-  tokenJwt = args['Authorization'].replace('Bearer ', '')
-  tokenData = jwtDecode(tokenJwt)
+  try:
+    tokenData = jwtDecode(tokenJwt)
+  except jwt.InvalidTokenError:
+    return (False, 'Token inválido!')
     
   if not tokenData:
     return (False, 'Token inválido!')
+  
+  tokenKey = (tokenData['token_user_id'], tokenData['token_date_time'])
+  if getAuthTokenCache().get(tokenKey) is cacheMiss:
     
-  authTokenQuery = dbGetSingle('SELECT token_user_id, token_date_time FROM tbl_auth_token WHERE token_user_id = %s; ', [(tokenData['token_user_id'])])
-  if not authTokenQuery:
-    return (False, 'Não foi encontrado o token no banco de dados!')
+    tokenDateTimeF = getSessionStore().getToken(tokenData['token_user_id'])
+    if tokenDateTimeF == None:
+      return (False, 'Não foi encontrado o token no banco de dados!')
         
-  tokenDateTimeF = authTokenQuery['token_date_time'].strftime("%Y-%m-%d %H:%M:%S")
-  if tokenDateTimeF != tokenData['token_date_time']:
-    return (False, 'Token expirado!')
-    
+    if tokenDateTimeF != tokenData['token_date_time']:
+      return (False, 'Token expirado!')
+  
+    getAuthTokenCache().set(tokenKey, True)
+
+  if has_request_context():
+    g.authTokenData = tokenData
+    g.authUserId = tokenData['token_user_id']
+  setDbRequestUser(tokenData['token_user_id'])
   return (True, '')
+
+def countAuthStat(name, authStart=None):
+  with globalAuthStatsLock:
+    globalAuthStats[name] += 1
+    if authStart != None:
+      globalAuthStats['auth_time_ms'] += (perf_counter() - authStart) * 1000
+
+def getAuthStats():
+  with globalAuthStatsLock:
+    stats = dict(globalAuthStats)
+  stats['token_cache'] = getAuthTokenCacheStats()
+  stats['jwt_cache'] = getVerifiedJwtCacheStats()
+  return stats
+
+# authenticates the bearer token once per request, aborting with 401 when it is not valid
+def authenticateRequest():
+
+  authStart = perf_counter()
+  isValid, returnMessage = isAuthTokenJwtValid(request.headers['Authorization'].replace('Bearer ', ''))
+  if not isValid:
+    countAuthStat('rejected', authStart)
+    abort(401, 'Autenticação com o token falhou: ' + returnMessage)
+  countAuthStat('authenticated', authStart)
+
+# resource method decorator, the authenticated user is in g.authUserId and the token payload in g.authTokenData
+def authRequired(resourceMethod):
+
+  @wraps(resourceMethod)
+  def authRequiredWrapper(*args, **kwargs):
+
+    if not request.headers.get('Authorization'):
+      countAuthStat('missing')
+      # same response given by reqparse to a missing required header
+      restfulAbort(400, message={'Authorization': authorizationHelp})
+
+    authenticateRequest()
+    return resourceMethod(*args, **kwargs)
+
+  return authRequiredWrapper
+
+# as authRequired but requests without the Authorization header are accepted, with g.authUserId None
+def authOptional(resourceMethod):
+
+  @wraps(resourceMethod)
+  def authOptionalWrapper(*args, **kwargs):
+
+    g.authUserId = None
+    g.authTokenData = None
+    if request.headers.get('Authorization'):
+      authenticateRequest()
+    else:
+      countAuthStat('anonymous')
+    return resourceMethod(*args, **kwargs)
+
+  return authOptionalWrapper
     
 def updateUserToken(tokenUserId, tokenDateTime):
   
-  dbExecute('DELETE FROM tbl_auth_token WHERE token_user_id = %s; ',[(tokenUserId)])
-  dbExecute('INSERT INTO tbl_auth_token (token_user_id, token_date_time) VALUES (%s, %s); ', [tokenUserId, tokenDateTime])
+  getSessionStore().setToken(tokenUserId, tokenDateTime)
+  # the previous token of the user stops being accepted by this worker
+  invalidateUserAuthTokens(tokenUserId)
   
+authWithLoginPostSchema = requestSchema([
+  requestArgument('Authorization', location='headers', type=str, help='Email and hash password of the user, used to authentication, required', required=True)
+])
+
 class AuthWithLoginApi(Resource):
     
   def post(self):
     
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Email and hash password of the user, used to authentication, required', required=True)
-    args = argsParser.parse_args()
+    args = authWithLoginPostSchema.parse()
+
+    # attempts over the limit are rejected before any database access
+    isAllowed, retryAfter = getLoginLimiters()['ip'].consume(getLoginClientIp())
+    if not isAllowed:
+      return loginThrottledResponse(retryAfter)
 
     userMail, userHashPassword = b64decode(args['Authorization'].replace('Basic ', '')).decode('utf-8').split(':', 1)
+
+    isAllowed, retryAfter = getLoginLimiters()['mail'].consume(userMail.strip().lower())
+    if not isAllowed:
+      return loginThrottledResponse(retryAfter)
       
     userQuery = dbGetSingle('SELECT user_id, user_hash_password, user_entry_allowed FROM tbl_user WHERE user_mail = %s; ', [(userMail)])
       
@@ -81,37 +253,18 @@ class AuthWithLoginApi(Resource):
     
 class AuthWithTokenApi(Resource):
     
+  @authRequired
   def post(self):
         
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    args = argsParser.parse_args()
-        
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
-            
-    tokenJwt = args['Authorization'].replace('Bearer ', '')
-        
-    oldTokenData = jwtDecode(tokenJwt)
-    newToken = createAuthToken(oldTokenData['token_user_id'])
+    newToken = createAuthToken(g.authUserId)
     updateUserToken(newToken['token_user_id'], newToken['token_date_time'])
         
     return { 'token_jwt': newToken['token_jwt'] }, 200
     
+  @authRequired
   def delete(self):
 
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    args = argsParser.parse_args()
-        
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
-            
-    tokenJwt = args['Authorization'].replace('Bearer ', '')
-        
-    oldTokenData = jwtDecode(tokenJwt)
-    dbExecute('DELETE FROM tbl_auth_token WHERE token_user_id = %s', [(oldTokenData['token_user_id'])])
+    getSessionStore().deleteToken(g.authUserId)
+    invalidateUserAuthTokens(g.authUserId)
         
-    return {}, 204 
\ No newline at end of file
+    return {}, 204
\ No newline at end of file
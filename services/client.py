@@ -5,8 +5,11 @@ from flask import Flask, abort, request, send_file
 from flask_restful import Resource, Api, reqparse
 
 from utils.dbUtils import *
+from utils.requestSchema import requestSchema, requestArgument, requestListSchema, requestItemField, requestInt
+from utils.referenceData import referenceIdValidator
 from utils.generatePDFReport import createClientsReport, delayedRemoveReport
-from services.authentication import isAuthTokenValid
+from services.authentication import authRequired
+from utils.etag import versionETag
 
 def formatGroupedClientContacts(contactIds, contactTypes, contactValues):
 
@@ -98,34 +101,180 @@ def getClientFromDB(clientId):
 
   return clientQuery
 
+@retryTransaction()
+def createClientInDB(args):
+
+  # inserts person
+  dbExecute(
+    ' INSERT INTO tbl_person (person_name, person_cpf, person_birth_date, person_gender) VALUES ' \
+    ' (%s, %s, %s, %s); ',
+    [args['client_name'], args['client_cpf'], args['client_birth_date'], args['client_gender']])
+    
+  personIdQuery = dbGetSingle(' SELECT person_id AS client_id FROM tbl_person WHERE person_name = %s; ', [(args['client_name'])])
+
+  if not personIdQuery:
+    raise Exception('Empty select personIdQuery after insert from tbl_person put')
+
+  # inserts client
+  dbExecute(
+    ' INSERT INTO tbl_client (client_id, client_cep, client_adress, client_city, ' 
+    ' client_neighborhood, client_state, client_number, client_complement, client_classification, client_observations) VALUES '
+    ' (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s); ',
+    [personIdQuery['client_id'], args['client_cep'], args['client_adress'], args['client_city'], 
+    args['client_neighborhood'], args['client_state'], args['client_number'], args['client_complement'], 
+    args['client_classification'], args['client_observations']])
+  
+  # inserts client contacts
+  if args.get('client_contacts'):
+    for contact in args['client_contacts']:
+      dbExecute( 
+        'INSERT INTO tbl_client_contact (contact_client_id, contact_type, contact_value) VALUES '
+        ' (%s, %s, %s); ',
+        [personIdQuery['client_id'], contact['contact_type'], contact['contact_value']])
+  
+  # inserts client children
+  if args.get('client_children'):
+    for children in args['client_children']:
+      dbExecute(
+        ' INSERT INTO tbl_client_children (children_client_id, children_name, children_birth_date, children_product_size_id) VALUES '
+        ' (%s, %s, %s, %s); ',
+        [
+          personIdQuery['client_id'], 
+          children['children_name'], 
+          children.get('children_birth_date') if children.get('children_birth_date') else None, 
+          children['children_product_size_id']
+        ])
+
+@retryTransaction()
+def updateClientInDB(args, client):
+
+  # person
+  dbExecute(
+    ' UPDATE tbl_person SET '
+    '   person_name = %s, '
+    '   person_birth_date = %s, '
+    '   person_cpf = %s, '
+    '   person_gender = %s '
+    '   WHERE person_id = %s; ', 
+    [
+      client['client_name'] if not args.get('client_name') else args['client_name'],
+      client['client_birth_date'] if not args.get('client_birth_date') else args['client_birth_date'],
+      client['client_cpf'] if not args.get('client_cpf') else args['client_cpf'],
+      client['client_gender'] if not args.get('client_gender') else args['client_gender'],
+      client['client_id']
+    ])
+
+  # client    
+  dbExecute(
+    ' UPDATE tbl_client SET '
+    '   client_cep = %s, '
+    '   client_adress = %s, '
+    '   client_city = %s, '
+    '   client_neighborhood = %s, '
+    '   client_state = %s, '
+    '   client_number = %s, '
+    '   client_complement = %s, '
+    '   client_classification = %s, '
+    '   client_observations = %s '
+    '   WHERE client_id = %s; ',
+    [
+      client['client_cep'] if not args.get('client_cep') else args['client_cep'],
+      client['client_adress'] if not args.get('client_adress') else args['client_adress'],
+      client['client_city'] if not args.get('client_city') else args['client_city'],
+      client['client_neighborhood'] if not args.get('client_neighborhood') else args['client_neighborhood'],
+      client['client_state'] if not args.get('client_state') else args['client_state'],
+      client['client_number'] if not args.get('client_number') else args['client_number'],
+      client['client_complement'] if not args.get('client_complement') else args['client_complement'],
+      client['client_classification'] if not args.get('client_classification') else args['client_classification'],
+      client['client_observations'] if not args.get('client_observations') else args['client_observations'],
+      client['client_id']
+    ])
+
+  # client contacts
+  if args.get('client_contacts'):
+    dbExecute(' DELETE FROM tbl_client_contact WHERE contact_client_id = %s; ', [(client['client_id'])])
+    for contact in args['client_contacts']:
+      dbExecute(
+        ' INSERT INTO tbl_client_contact (contact_client_id, contact_type, contact_value) VALUES '
+        ' (%s, %s, %s); ',
+        [client['client_id'], contact['contact_type'], contact['contact_value']])
+
+  # client children
+  if args.get('client_children'):
+    dbExecute(' DELETE FROM tbl_client_children WHERE children_client_id = %s; ', [(client['client_id'])])
+    for children in args['client_children']:
+      dbExecute(
+        ' INSERT INTO tbl_client_children (children_client_id, children_name, children_birth_date, children_product_size_id) VALUES '
+        ' (%s, %s, %s, %s); ',
+        [
+          client['client_id'],
+          children['children_name'],
+          children.get('children_birth_date') if children.get('children_birth_date') else None,
+          children['children_product_size_id']
+        ])
+
+clientContactsSchema = requestListSchema([
+  requestItemField('contact_type', message='Um dos contatos associados não possui o tipo'),
+  requestItemField('contact_value', message='Um dos contatos associados está sem o valor')
+], 'Um dos contatos associados está com formato inválido')
+
+clientChildrenSchema = requestListSchema([
+  requestItemField('children_name', message='Uma das crianças associadas não possui o nome'),
+  requestItemField('children_product_size_id', type=requestInt, check=referenceIdValidator('sizes'), message='Uma das crianças associadas não possui o tamanho de produtos',
+    checkMessage='O tamanho de produtos de uma das crianças associadas não existe no sistema')
+], 'Uma das crianças associadas está com formato inválido')
+
+clientPutSchema = requestSchema([
+  requestArgument('client_name', location='json', type=str, help='Client name, required', required=True),
+  requestArgument('client_cpf', location='json', type=str, help='Client cpf'),
+  requestArgument('client_gender', location='json', type=str, help='Client gender, required', required=True),
+  requestArgument('client_birth_date', location='json', type=str, help='Client birth date'),
+  requestArgument('client_cep', location='json', type=str, help='Client cep'),
+  requestArgument('client_adress', location='json', type=str, help='Client adress'),
+  requestArgument('client_city', location='json', type=str, help='Client city'),
+  requestArgument('client_neighborhood', location='json', type=str, help='Client neighborhood'),
+  requestArgument('client_state', location='json', type=str, help='Client state'),
+  requestArgument('client_number', location='json', type=str, help='Client number'),
+  requestArgument('client_complement', location='json', type=str, help='Client complement'),
+  requestArgument('client_contacts', location='json', type=list, help='Client contacts json structure', items=clientContactsSchema),
+  requestArgument('client_children', location='json', type=list, help='Client children json structure', items=clientChildrenSchema),
+  requestArgument('client_classification', location='json', type=str, help='Client classification enum'),
+  requestArgument('client_observations', location='json', type=str, help='Client observations')
+])
+
+clientGetSchema = requestSchema([
+  requestArgument('client_id', location='args', type=int, help='client id, required', required=True)
+])
+
+clientPatchSchema = requestSchema([
+  requestArgument('client_id', location='json', type=str, help='Client id, required', required=True),
+  requestArgument('client_name', location='json', type=str, help='Client name'),
+  requestArgument('client_cpf', location='json', type=str, help='Client cpf'),
+  requestArgument('client_gender', location='json', type=str, help='Client gender'),
+  requestArgument('client_birth_date', location='json', type=str, help='Client birth date'),
+  requestArgument('client_cep', location='json', type=str, help='Client cep'),
+  requestArgument('client_adress', location='json', type=str, help='Client adress'),
+  requestArgument('client_city', location='json', type=str, help='Client city'),
+  requestArgument('client_neighborhood', location='json', type=str, help='Client neighborhood'),
+  requestArgument('client_state', location='json', type=str, help='Client state'),
+  requestArgument('client_number', location='json', type=str, help='Client number'),
+  requestArgument('client_complement', location='json', type=str, help='Client complement'),
+  requestArgument('client_contacts', location='json', type=list, help='Client contacts json structure', items=clientContactsSchema),
+  requestArgument('client_children', location='json', type=list, help='Client children json structure', items=clientChildrenSchema),
+  requestArgument('client_classification', location='json', type=str, help='Client classification enum'),
+  requestArgument('client_observations', location='json', type=str, help='Client observations')
+])
+
 class ClientApi(Resource):
 
+  @authRequired
   def put(self):
         
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('client_name', location='json', type=str, help='Client name, required', required=True)
-    argsParser.add_argument('client_cpf', location='json', type=str, help='Client cpf')
-    argsParser.add_argument('client_gender', location='json', type=str, help='Client gender, required', required=True)
-    argsParser.add_argument('client_birth_date', location='json', type=str, help='Client birth date')
-    argsParser.add_argument('client_cep', location='json', type=str, help='Client cep')
-    argsParser.add_argument('client_adress', location='json', type=str, help='Client adress')
-    argsParser.add_argument('client_city', location='json', type=str, help='Client city')
-    argsParser.add_argument('client_neighborhood', location='json', type=str, help='Client neighborhood')
-    argsParser.add_argument('client_state', location='json', type=str, help='Client state')
-    argsParser.add_argument('client_number', location='json', type=str, help='Client number')
-    argsParser.add_argument('client_complement', location='json', type=str, help='Client complement')
-    argsParser.add_argument('client_contacts', location='json',  type=list, help='Client contacts json structure')
-    argsParser.add_argument('client_children', location='json', type=list, help='Client children json structure')
-    argsParser.add_argument('client_classification', location='json', type=str, help='Client classification enum')
-    argsParser.add_argument('client_observations', location='json', type=str, help='Client observations')
-    args = argsParser.parse_args()
+    args = clientPutSchema.parse()
+    invalidMessage = clientPutSchema.getInvalidMessage(args)
+    if invalidMessage:
+      return invalidMessage, 422
     
-    if(args['Authorization']):
-      isValid, returnMessage = isAuthTokenValid(args)
-      if not isValid:
-        abort(401, 'Autenticação com o token falhou: ' + returnMessage)
-
     sqlQuery = dbGetSingle(' SELECT * FROM tbl_person WHERE person_name = %s; ', [(args['client_name'])])
     if sqlQuery != None:
       return 'Nome já utilizado!', 409
@@ -135,87 +284,22 @@ class ClientApi(Resource):
       if sqlQuery != None:
         return 'Cpf já utilizado!', 409
     
-    # verify contacts
-    if args.get('client_contacts'):
-      for contact in args['client_contacts']:
-        if not contact.get('contact_type'):
-          return 'Um dos contatos associados não possui o tipo', 422
-        if not contact.get('contact_value'):
-          return 'Um dos contatos associados está sem o valor', 422
-    
-    # verify children
-    if args.get('client_children'):
-      for children in args['client_children']:
-        if not children.get('children_name'):
-          return 'Uma das crianças associadas não possui o nome', 422
-        if not children.get('children_product_size_id'):
-          return 'Uma das crianças associadas não possui o tamanho de produtos', 422
-    
     # verify classification
     if args.get('client_classification') and args['client_classification'] not in ['Ruim', 'Boa', 'Excelente']:
       return 'Classificação inválida', 422
 
-    dbObjectIns = startGetDbObject()
     try:
-      # inserts person
-      dbExecute(
-        ' INSERT INTO tbl_person (person_name, person_cpf, person_birth_date, person_gender) VALUES ' \
-        ' (%s, %s, %s, %s); ',
-        [args['client_name'], args['client_cpf'], args['client_birth_date'], args['client_gender']], True, dbObjectIns)
-        
-      personIdQuery = dbGetSingle(' SELECT person_id AS client_id FROM tbl_person WHERE person_name = %s; ', [(args['client_name'])], True, dbObjectIns)
-
-      if not personIdQuery:
-        raise Exception('Empty select personIdQuery after insert from tbl_person put')
-
-      # inserts client
-      dbExecute(
-        ' INSERT INTO tbl_client (client_id, client_cep, client_adress, client_city, ' 
-        ' client_neighborhood, client_state, client_number, client_complement, client_classification, client_observations) VALUES '
-        ' (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s); ',
-        [personIdQuery['client_id'], args['client_cep'], args['client_adress'], args['client_city'], 
-        args['client_neighborhood'], args['client_state'], args['client_number'], args['client_complement'], 
-        args['client_classification'], args['client_observations']], True, dbObjectIns)
-      
-      # inserts client contacts
-      if args.get('client_contacts'):
-        for contact in args['client_contacts']:
-          dbExecute( 
-            'INSERT INTO tbl_client_contact (contact_client_id, contact_type, contact_value) VALUES '
-            ' (%s, %s, %s); ',
-            [personIdQuery['client_id'], contact['contact_type'], contact['contact_value']], True, dbObjectIns)
-      
-      # inserts client children
-      if args.get('client_children'):
-        for children in args['client_children']:
-          dbExecute(
-            ' INSERT INTO tbl_client_children (children_client_id, children_name, children_birth_date, children_product_size_id) VALUES '
-            ' (%s, %s, %s, %s); ',
-            [
-              personIdQuery['client_id'], 
-              children['children_name'], 
-              children.get('children_birth_date') if children.get('children_birth_date') else None, 
-              children['children_product_size_id']
-            ], True, dbObjectIns)
-
+      createClientInDB(args)
     except Exception as e:
-      dbRollback(dbObjectIns)
       traceback.print_exc()
       return 'Erro ao criar cliente ' + str(e), 500
-    dbCommit(dbObjectIns)
     
     return {}, 201
   
+  @authRequired
   def get(self):
         
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('client_id', location='args', type=int, help='client id, required', required=True)
-    args = argsParser.parse_args()
-    
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
+    args = clientGetSchema.parse()
     
     client = getClientFromDB(args['client_id'])
     if not client:
@@ -223,32 +307,14 @@ class ClientApi(Resource):
 
     return client, 200
   
+  @authRequired
   def patch(self):
       
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('client_id', location='json', type=str, help='Client id, required', required=True)
-    argsParser.add_argument('client_name', location='json', type=str, help='Client name')
-    argsParser.add_argument('client_cpf', location='json', type=str, help='Client cpf')
-    argsParser.add_argument('client_gender', location='json', type=str, help='Client gender')
-    argsParser.add_argument('client_birth_date', location='json', type=str, help='Client birth date')
-    argsParser.add_argument('client_cep', location='json', type=str, help='Client cep')
-    argsParser.add_argument('client_adress', location='json', type=str, help='Client adress')
-    argsParser.add_argument('client_city', location='json', type=str, help='Client city')
-    argsParser.add_argument('client_neighborhood', location='json', type=str, help='Client neighborhood')
-    argsParser.add_argument('client_state', location='json', type=str, help='Client state')
-    argsParser.add_argument('client_number', location='json', type=str, help='Client number')
-    argsParser.add_argument('client_complement', location='json', type=str, help='Client complement')
-    argsParser.add_argument('client_contacts', location='json', type=list, help='Client contacts json structure')
-    argsParser.add_argument('client_children', location='json', type=list, help='Client children json structure')
-    argsParser.add_argument('client_classification', location='json', type=str, help='Client classification enum')
-    argsParser.add_argument('client_observations', location='json', type=str, help='Client observations')
-    args = argsParser.parse_args()
-
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
-    
+    args = clientPatchSchema.parse()
+    invalidMessage = clientPatchSchema.getInvalidMessage(args)
+    if invalidMessage:
+      return invalidMessage, 422
+
     client = getClientFromDB(args['client_id'])
     if not client:
       abort(404, 'Cliente não econtrado!')
@@ -263,127 +329,43 @@ class ClientApi(Resource):
       if sqlQuery != None:
         return 'Cpf já utilizado!', 409
     
-    # verify contacts
-    if args.get('client_contacts'):
-      for contact in args['client_contacts']:
-        if not contact.get('contact_type'):
-          return 'Um dos contatos associados não possui o tipo', 422
-        if not contact.get('contact_value'):
-          return 'Um dos contatos associados está sem o valor', 422
-    
-    # verify children
-    if args.get('client_children'):
-      for children in args['client_children']:
-        if not children.get('children_name'):
-          return 'Uma das crianças associadas não possui o nome', 422
-        if not children.get('children_product_size_id'):
-          return 'Uma das crianças associadas não possui o tamanho de produtos', 422
-    
     # verify classification
     if args.get('client_classification') and args['client_classification'] not in ['Ruim', 'Boa', 'Excelente']:
       return 'Classificação inválida', 422
 
-    dbObjectIns = startGetDbObject()
     try:
-      # person
-      dbExecute(
-        ' UPDATE tbl_person SET '
-        '   person_name = %s, '
-        '   person_birth_date = %s, '
-        '   person_cpf = %s, '
-        '   person_gender = %s '
-        '   WHERE person_id = %s; ', 
-        [
-          client['client_name'] if not args.get('client_name') else args['client_name'],
-          client['client_birth_date'] if not args.get('client_birth_date') else args['client_birth_date'],
-          client['client_cpf'] if not args.get('client_cpf') else args['client_cpf'],
-          client['client_gender'] if not args.get('client_gender') else args['client_gender'],
-          client['client_id']
-        ], True, dbObjectIns)
-
-      # client    
-      dbExecute(
-        ' UPDATE tbl_client SET '
-        '   client_cep = %s, '
-        '   client_adress = %s, '
-        '   client_city = %s, '
-        '   client_neighborhood = %s, '
-        '   client_state = %s, '
-        '   client_number = %s, '
-        '   client_complement = %s, '
-        '   client_classification = %s, '
-        '   client_observations = %s '
-        '   WHERE client_id = %s; ',
-        [
-          client['client_cep'] if not args.get('client_cep') else args['client_cep'],
-          client['client_adress'] if not args.get('client_adress') else args['client_adress'],
-          client['client_city'] if not args.get('client_city') else args['client_city'],
-          client['client_neighborhood'] if not args.get('client_neighborhood') else args['client_neighborhood'],
-          client['client_state'] if not args.get('client_state') else args['client_state'],
-          client['client_number'] if not args.get('client_number') else args['client_number'],
-          client['client_complement'] if not args.get('client_complement') else args['client_complement'],
-          client['client_classification'] if not args.get('client_classification') else args['client_classification'],
-          client['client_observations'] if not args.get('client_observations') else args['client_observations'],
-          client['client_id']
-        ], True, dbObjectIns)
-
-      # client contacts
-      if args.get('client_contacts'):
-        dbExecute(' DELETE FROM tbl_client_contact WHERE contact_client_id = %s; ', [(client['client_id'])], True, dbObjectIns)
-        for contact in args['client_contacts']:
-          dbExecute(
-            ' INSERT INTO tbl_client_contact (contact_client_id, contact_type, contact_value) VALUES '
-            ' (%s, %s, %s); ',
-            [client['client_id'], contact['contact_type'], contact['contact_value']], True, dbObjectIns)
-
-      # client children
-      if args.get('client_children'):
-        dbExecute(' DELETE FROM tbl_client_children WHERE children_client_id = %s; ', [(client['client_id'])], True, dbObjectIns)
-        for children in args['client_children']:
-          dbExecute(
-            ' INSERT INTO tbl_client_children (children_client_id, children_name, children_birth_date, children_product_size_id) VALUES '
-            ' (%s, %s, %s, %s); ',
-            [
-              client['client_id'],
-              children['children_name'],
-              children.get('children_birth_date') if children.get('children_birth_date') else None,
-              children['children_product_size_id']
-            ], True, dbObjectIns)
-      
+      updateClientInDB(args, client)
     except Exception as e:
-      dbRollback(dbObjectIns)
       traceback.print_exc()
       return 'Erro ao atualizar o cliente ' + str(e)
-    dbCommit(dbObjectIns)
 
     return {}, 204
 
+clientsGetSchema = requestSchema([
+  requestArgument('only_client_names_cpfs', location='args', type=str),
+  requestArgument('limit', location='args', type=int, help='number of rows returned'),
+  requestArgument('offset', location='args', type=int, help='start row from db'),
+  requestArgument('order_by', location='args', type=str, help='query orderby'),
+  requestArgument('order_by_asc', location='args', type=str, help='query orderby ascendant'),
+  requestArgument('client_name', location='args', type=str, help='client name'),
+  requestArgument('client_whatsapp', location='args', type=str, help='client whatsapp'),
+  requestArgument('client_classification', location='args', type=str, help='Client classification enum'),
+  requestArgument('children_name', location='args', type=str, help='client children name'),
+  requestArgument('children_birth_month_day_start', location='args', type=str, help='start client children birth day and month'),
+  requestArgument('children_birth_month_day_end', location='args', type=str, help='end client children birth day and month'),
+  requestArgument('last_sale_date_start', location='args', type=str, help='start for last sale date'),
+  requestArgument('last_sale_date_end', location='args', type=str, help='end for last sale date'),
+  requestArgument('generate_pdf', location='args', type=str, help='if the expected return is a file')
+])
+
 class ClientsApi(Resource):
     
+  @authRequired
+  @versionETag(['tbl_client', 'tbl_client_children', 'tbl_client_contact', 'tbl_person', 'tbl_product_size', 'tbl_sale'])
   def get(self):
       
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('only_client_names_cpfs', location='args', type=str)
-    argsParser.add_argument('limit', location='args', type=int, help='number of rows returned')
-    argsParser.add_argument('offset', location='args', type=int, help='start row from db')
-    argsParser.add_argument('order_by', location='args', type=str, help='query orderby')
-    argsParser.add_argument('order_by_asc', location='args', type=str, help='query orderby ascendant')
-    argsParser.add_argument('client_name', location='args', type=str, help='client name')
-    argsParser.add_argument('client_whatsapp', location='args', type=str, help='client whatsapp')
-    argsParser.add_argument('client_classification', location='args', type=str, help='Client classification enum')
-    argsParser.add_argument('children_name', location='args', type=str, help='client children name')
-    argsParser.add_argument('children_birth_month_day_start', location='args', type=str, help='start client children birth day and month')
-    argsParser.add_argument('children_birth_month_day_end', location='args', type=str, help='end client children birth day and month')
-    argsParser.add_argument('last_sale_date_start', location='args', type=str, help='start for last sale date')
-    argsParser.add_argument('last_sale_date_end', location='args', type=str, help='end for last sale date')
-    argsParser.add_argument('generate_pdf', location='args', type=str, help='if the expected return is a file')
-    args = argsParser.parse_args()
+    args = clientsGetSchema.parse()
     
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
-
     if args.get('only_client_names_cpfs') and args['only_client_names_cpfs'].lower() in ['true', '1']:
       clientQuery = dbGetAll(
         ' SELECT c.client_id, p.person_name AS client_name, p.person_cpf AS client_cpf '
@@ -508,7 +490,6 @@ class ClientsApi(Resource):
       '   ) AS csale ON c.client_id = csale.sale_client_id '
       + geralFilterScryptNoLimit)
 
-    clientQuery = dbGetAll(geralSqlScrypt, contactFilterArgs + childrenFilterArgs + geralFilterArgs)
     countQuery = dbGetSingle(countSqlScrypt, contactFilterArgs + childrenFilterArgs + geralFilterArgsNoLimit)
 
      # pdf creation
@@ -559,12 +540,14 @@ class ClientsApi(Resource):
       filters.append(appliedOrderStr)
 
       # create and remove the pdf file after(1 minute)
-      pdfPath, pdfName = createClientsReport(filters, clientQuery)
+      pdfPath, pdfName = createClientsReport(filters, dbIterate(geralSqlScrypt, contactFilterArgs + childrenFilterArgs + geralFilterArgs, rowMode='slots'))
       delayedRemoveReport(pdfPath)
 
       # sends
       return send_file(pdfPath, as_attachment=True, download_name=pdfName)
 
+    clientQuery = dbGetAll(geralSqlScrypt, contactFilterArgs + childrenFilterArgs + geralFilterArgs)
+
     if not clientQuery or not countQuery:
       return { 'count_clients': 0, 'clients': [] }, 200
     
@@ -4,24 +4,109 @@ import datetime
 import traceback
 
 from utils.dbUtils import *
+from utils.requestSchema import requestSchema, requestArgument, requestListSchema, requestItemField, requestInt, isPositive
 from utils.generatePDFReport import createConditionalReport, createConditionalsReport, delayedRemoveReport
-from services.authentication import isAuthTokenValid
+from services.authentication import authRequired
+from utils.etag import versionETag
+
+@retryTransaction()
+def createConditionalInDB(args):
+
+  # inserts conditional and gets its id
+  dbExecute(
+    ' INSERT INTO tbl_conditional (conditional_client_id, conditional_employee_id) VALUES '
+    '   (%s, %s) ',
+    [args['conditional_client_id'], args['conditional_employee_id']])
+  
+  conditionalIdQuery = dbGetSingle(' SELECT LAST_INSERT_ID() AS conditional_id; ')
+  
+  if not conditionalIdQuery:
+    raise Exception('Exception empty select conditionalIdQuery after insert from tbl_conditional put')
+  
+  for product in args['conditional_has_products']:
+    # set product immutable
+    dbExecute(
+      ' UPDATE tbl_product '
+      '   SET is_product_immutable = TRUE '
+      '   WHERE product_id = %s; ', [(product['product_id'])])
+    
+    for customizedProduct in product['customized_products']:
+      # set customized product immutable and adjusts its quantity
+      # relative to the current row, a retried transaction does not write back a quantity read before a concurrent sale
+      dbExecute(
+        ' UPDATE tbl_customized_product '
+        '   SET is_customized_product_immutable = TRUE, '
+        '   customized_product_quantity = GREATEST(customized_product_quantity - %s, 0) '
+        '   WHERE customized_product_id = %s; ',
+        [
+          customizedProduct['customized_product_conditional_quantity'],
+          customizedProduct['customized_product_id']
+        ])
+      
+      # inserts conditional has product
+      dbExecute(
+        ' INSERT INTO tbl_conditional_has_product (conditional_id, product_id, customized_product_id, conditional_has_product_quantity) VALUES '
+        '   (%s, %s, %s, %s); ', 
+        [conditionalIdQuery['conditional_id'], product['product_id'], customizedProduct['customized_product_id'], customizedProduct['customized_product_conditional_quantity']])
+
+@retryTransaction()
+def updateConditionalStatusInDB(conditionalId, conditionalStatus, customConditionalProducts):
+
+  for customProduct in customConditionalProducts:
+    customDbProduct = dbGetSingle(
+      ' SELECT * '
+      '   FROM tbl_customized_product cp ' 
+      '   WHERE cp.customized_product_id = %s; ',
+      (customProduct['customized_product_id'],))
+    if not customDbProduct:
+      raise Exception('Customized product not found while adding quantity to change conditional status')
+    
+    dbExecute(
+      ' UPDATE tbl_customized_product SET '
+      '   customized_product_quantity = customized_product_quantity + %s '
+      '   WHERE customized_product_id = %s; ',
+      [ customProduct['conditional_has_product_quantity'], customProduct['customized_product_id']])
+
+  dbExecute(' UPDATE tbl_conditional SET conditional_status = %s WHERE conditional_id = %s; ', 
+    [conditionalStatus, conditionalId])
+
+conditionalCustomizedProductsSchema = requestListSchema([
+  requestItemField('customized_product_id', type=requestInt, check=isPositive, message='Um dos produtos customizaveis associados foi enviado sem o campo customized_product_id'),
+  requestItemField('customized_product_conditional_quantity', type=requestInt, message='Um dos produtos customizaveis associados foi enviado sem o campo customized_product_conditional_quantity',
+    check=isPositive, checkMessage='Um dos produtos associados possui quantidade de produtos 0 ou menor')
+], 'Um dos produtos customizaveis associados está com formato inválido', 'Um dos produtos associados foi enviado sem produtos customizados')
+
+conditionalHasProductsSchema = requestListSchema([
+  requestItemField('product_id', type=requestInt, check=isPositive, message='Um dos produtos associados foi enviado sem o product_id'),
+  requestItemField('customized_products', type=list, items=conditionalCustomizedProductsSchema, message='Um dos produtos associados foi enviado sem produtos customizados')
+], 'Um dos produtos associados está com formato inválido', 'A condicional deve possuir pelo menos um produto associado')
+
+conditionalPutSchema = requestSchema([
+  requestArgument('conditional_client_id', location='json', type=int, help='conditional client id, required', required=True),
+  requestArgument('conditional_employee_id', location='json', type=int, help='conditional employee id, required', required=True),
+  requestArgument('conditional_has_products', location='json', type=list, help='products and its variations list, required', required=True, items=conditionalHasProductsSchema),
+  requestArgument('force_product_addition', location='json', type=str, help='if will add missing products in conditional creation, required', required=True)
+])
+
+conditionalGetSchema = requestSchema([
+  requestArgument('conditional_id', location='args', type=int, help='conditional id, required', required=True),
+  requestArgument('generate_pdf', location='args', type=str, help='if the expected return is a file')
+])
+
+conditionalPatchSchema = requestSchema([
+  requestArgument('conditional_id', location='json', type=int, help='conditional id, required', required=True),
+  requestArgument('conditional_status', location='json', type=str, help='conditional status, required', required=True)
+])
 
 class ConditionalApi(Resource):
 
+  @authRequired
   def put(self):
       
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('conditional_client_id', location='json', type=int, help='conditional client id, required', required=True)
-    argsParser.add_argument('conditional_employee_id', location='json', type=int, help='conditional employee id, required', required=True)
-    argsParser.add_argument('conditional_has_products', location='json', type=list, help='products and its variations list, required', required=True)
-    argsParser.add_argument('force_product_addition', location='json', type=str, help='if will add missing products in conditional creation, required', required=True)
-    args = argsParser.parse_args()
-
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
+    args = conditionalPutSchema.parse()
+    invalidMessage = conditionalPutSchema.getInvalidMessage(args)
+    if invalidMessage:
+      return invalidMessage, 422
 
     forceProductAddition = args['force_product_addition'].lower() in ['true', '1']
 
@@ -46,13 +131,7 @@ class ConditionalApi(Resource):
       return 'O funcionario associado à condicional não esta habilitado no sistema', 422
 
     # test conditional products
-    if len(args['conditional_has_products']) == 0:
-      return 'A condicional deve possuir pelo menos um produto associado', 422
-
     for product in args['conditional_has_products']:
-      if not product.get('product_id'):
-        return 'Um dos produtos associados foi enviado sem o product_id', 422
-      
       productQuery = dbGetSingle(
         ' SELECT p.product_id, p.is_product_active '
         '   FROM tbl_product p '
@@ -63,18 +142,8 @@ class ConditionalApi(Resource):
       if not productQuery['is_product_active']:
         return 'Um dos produtos associados está inativo', 422
       
-      if not product.get('customized_products') or len(product['customized_products']) == 0:
-        return 'Um dos produtos associados foi enviado sem produtos customizados', 422
-      
       # test customized products
       for customizedProduct in product['customized_products']:
-        if not customizedProduct.get('customized_product_id'):
-          return 'Um dos produtos customizaveis associados foi enviado sem o campo customized_product_id', 422
-        if not customizedProduct.get('customized_product_conditional_quantity'):
-          return 'Um dos produtos customizaveis associados foi enviado sem o campo customized_product_conditional_quantity', 422
-        if customizedProduct['customized_product_conditional_quantity'] <= 0:
-          return 'Um dos produtos associados possui quantidade de produtos 0 ou menor', 422
-
         customProductQuery = dbGetSingle(
           ' SELECT cp.is_customized_product_active, cp.customized_product_quantity '
           '   FROM tbl_product p '
@@ -92,66 +161,19 @@ class ConditionalApi(Resource):
         # associates product quantity in args to use later
         customizedProduct['customized_product_quantity'] = customProductQuery['customized_product_quantity']
 
-    dbObjectIns = startGetDbObject()
     try:
-      # inserts conditional and gets its id
-      dbExecute(
-        ' INSERT INTO tbl_conditional (conditional_client_id, conditional_employee_id) VALUES '
-        '   (%s, %s) ',
-        [args['conditional_client_id'], args['conditional_employee_id']], True, dbObjectIns)
-      
-      conditionalIdQuery = dbGetSingle(' SELECT LAST_INSERT_ID() AS conditional_id; ', None, True, dbObjectIns)
-      
-      if not conditionalIdQuery:
-        raise Exception('Exception empty select conditionalIdQuery after insert from tbl_conditional put')
-      
-      for product in args['conditional_has_products']:
-        # set product immutable
-        dbExecute(
-          ' UPDATE tbl_product '
-          '   SET is_product_immutable = TRUE '
-          '   WHERE product_id = %s; ', [(product['product_id'])], True, dbObjectIns)
-        
-        for customizedProduct in product['customized_products']:
-          # set customized product immutable and adjusts its quantity
-          dbExecute(
-            ' UPDATE tbl_customized_product '
-            '   SET is_customized_product_immutable = TRUE, '
-            '   customized_product_quantity = %s '
-            '   WHERE customized_product_id = %s; ',
-            [
-              max(customizedProduct['customized_product_quantity'] - customizedProduct['customized_product_conditional_quantity'], 0),
-              customizedProduct['customized_product_id']
-            ], 
-            True, dbObjectIns)
-          
-          # inserts conditional has product
-          dbExecute(
-            ' INSERT INTO tbl_conditional_has_product (conditional_id, product_id, customized_product_id, conditional_has_product_quantity) VALUES '
-            '   (%s, %s, %s, %s); ', 
-            [conditionalIdQuery['conditional_id'], product['product_id'], customizedProduct['customized_product_id'], customizedProduct['customized_product_conditional_quantity']],
-            True, dbObjectIns)
-      
+      createConditionalInDB(args)
     except Exception as e:
-      dbRollback(dbObjectIns)
       traceback.print_exc()
       return 'Erro ao criar a condicional ' + str(e), 500
-    dbCommit(dbObjectIns)
     
     return {}, 201
     
+  @authRequired
   def get(self):
       
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('conditional_id', location='args', type=int, help='conditional id, required', required=True)
-    argsParser.add_argument('generate_pdf', location='args', type=str, help='if the expected return is a file')
-    args = argsParser.parse_args()
+    args = conditionalGetSchema.parse()
     
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
-
     # conditional
     conditionalQuery = dbGetSingle(
       ' SELECT * '
@@ -161,7 +183,6 @@ class ConditionalApi(Resource):
     
     if not conditionalQuery:
       return 'Condicional não encontrada', 404
-    conditionalQuery['conditional_creation_date_time'] = str(conditionalQuery['conditional_creation_date_time'])
     
     # client
     conditionalQuery['conditional_client'] = dbGetSingle(
@@ -204,17 +225,10 @@ class ConditionalApi(Resource):
     return conditionalQuery, 200
   
   # patch to change conditional status
+  @authRequired
   def patch(self):
 
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('conditional_id', location='json', type=int, help='conditional id, required', required=True)
-    argsParser.add_argument('conditional_status', location='json', type=str, help='conditional status, required', required=True)
-    args = argsParser.parse_args()
-
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
+    args = conditionalPatchSchema.parse()
 
     if args['conditional_status'] not in ['Pendente', 'Devolvido', 'Cancelado']:
       return 'Status inválido', 422
@@ -241,60 +255,34 @@ class ConditionalApi(Resource):
       '   WHERE c.conditional_id = %s; ',
       [(args['conditional_id'])])
     
-    dbObjectIns = startGetDbObject()
     try:
-      for customProduct in customConditionalProducts:
-        customDbProduct = dbGetSingle(
-          ' SELECT * '
-          '   FROM tbl_customized_product cp ' 
-          '   WHERE cp.customized_product_id = %s; ',
-          (customProduct['customized_product_id'],),True, dbObjectIns
-        )
-        if not customDbProduct:
-          raise Exception('Customized product not found while adding quantity to change conditional status')
-        print(customProduct)
-        print(customDbProduct)
-        print(customDbProduct['customized_product_quantity'] + customProduct['conditional_has_product_quantity'])
-        
-        dbExecute(
-          ' UPDATE tbl_customized_product SET '
-          '   customized_product_quantity = %s '
-          '   WHERE customized_product_id = %s; ',
-          [ customDbProduct['customized_product_quantity'] + customProduct['conditional_has_product_quantity'], customProduct['customized_product_id']]
-          , True, dbObjectIns)
-
-      dbExecute(' UPDATE tbl_conditional SET conditional_status = %s WHERE conditional_id = %s; ', 
-        [args['conditional_status'], args['conditional_id']], True, dbObjectIns)
-
+      updateConditionalStatusInDB(args['conditional_id'], args['conditional_status'], customConditionalProducts)
     except Exception as e:
-      dbRollback(dbObjectIns)
       traceback.print_exc()
       return 'Erro ao cancelar a condicional ' + str(e), 500
-    dbCommit(dbObjectIns)
     
     return {}, 204
 
+conditionalsGetSchema = requestSchema([
+  requestArgument('limit', location='args', type=int, help='query limit'),
+  requestArgument('offset', location='args', type=int, help='query offset'),
+  requestArgument('order_by', location='args', type=str, help='query orderby', required=True),
+  requestArgument('order_by_asc', location='args', type=str, help='query orderby ascendant', required=True),
+  requestArgument('conditional_id', location='args', type=int, help='conditional id'),
+  requestArgument('conditional_client_name', location='args', type=str, help='conditional client name'),
+  requestArgument('conditional_status', location='args', type=str, help='conditional status'),
+  requestArgument('conditional_creation_date_time_start', location='args', type=str, help='start of conditional creation interval'),
+  requestArgument('conditional_creation_date_time_end', location='args', type=str, help='end of conditional creation interval'),
+  requestArgument('generate_pdf', location='args', type=str, help='if the expected return is a file')
+])
+
 class ConditionalsApi(Resource):
     
+  @authRequired
+  @versionETag(['tbl_conditional', 'tbl_client', 'tbl_employee', 'tbl_person'])
   def get(self):
       
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('limit', location='args', type=int, help='query limit')
-    argsParser.add_argument('offset', location='args', type=int, help='query offset')
-    argsParser.add_argument('order_by', location='args', type=str, help='query orderby', required=True)
-    argsParser.add_argument('order_by_asc', location='args', type=str, help='query orderby ascendant', required=True)
-    argsParser.add_argument('conditional_id', location='args', type=int, help='conditional id')
-    argsParser.add_argument('conditional_client_name', location='args', type=str, help='conditional client name')
-    argsParser.add_argument('conditional_status', location='args', type=str, help='conditional status')
-    argsParser.add_argument('conditional_creation_date_time_start', location='args', type=str, help='start of conditional creation interval')
-    argsParser.add_argument('conditional_creation_date_time_end', location='args', type=str, help='end of conditional creation interval')
-    argsParser.add_argument('generate_pdf', location='args', type=str, help='if the expected return is a file')
-    args = argsParser.parse_args()
-    
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
+    args = conditionalsGetSchema.parse()
     
     orderByAsc = (args['order_by_asc'] == '1' or args['order_by_asc'].lower() == 'true')
     
@@ -344,7 +332,6 @@ class ConditionalsApi(Resource):
       + geralFilterScryptNoLimit)
     
     conditionalsSummary = dbGetSingle(sqlScryptNoCount, geralFilterArgsNoLimit)
-    conditionalsQuery = dbGetAll(sqlScrypt, geralFilterArgs)
     
     # pdf creation
     if args.get('generate_pdf') == 'true' or args.get('generate_pdf') == True:
@@ -381,32 +368,25 @@ class ConditionalsApi(Resource):
       filters.append(appliedOrderStr)
 
       # create and remove the pdf file after(1 minute)
-      pdfPath, pdfName = createConditionalsReport(filters, conditionalsSummary, conditionalsQuery)
+      pdfPath, pdfName = createConditionalsReport(filters, conditionalsSummary, dbIterate(sqlScrypt, geralFilterArgs, rowMode='slots'))
       delayedRemoveReport(pdfPath)
 
       # sends
       return send_file(pdfPath, as_attachment=True, download_name=pdfName)
 
+    conditionalsQuery = dbGetAll(sqlScrypt, geralFilterArgs)
+
     if not conditionalsSummary or not conditionalsQuery:
       return { 'total_quantity': 0, 'conditionals': [] }, 200
 
-    for conditionalRow in conditionalsQuery:
-      conditionalRow['conditional_creation_date_time'] = str(conditionalRow['conditional_creation_date_time'])
-    
     return { 'total_quantity': conditionalsSummary['total_quantity'], 'conditionals': conditionalsQuery, 'summary': conditionalsSummary }, 200
 
 class ConditionalInfoApi(Resource):
     
+  @authRequired
+  @versionETag(['tbl_conditional'])
   def get(self):
       
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    args = argsParser.parse_args()
-    
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
-    
     query = dbGetSingle(
       ' SELECT AUTO_INCREMENT AS next_conditional_id FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s; ',
       [os.getenv('SQL_SCHEMA'), 'tbl_conditional'])
@@ -2,25 +2,26 @@ from flask import Flask, abort
 from flask_restful import Resource, Api, reqparse
 
 from utils.dbUtils import *
-from services.authentication import isAuthTokenValid
+from utils.requestSchema import requestSchema, requestArgument
+from services.authentication import authRequired
+from utils.etag import versionETag
+
+employeeSalesGetSchema = requestSchema([
+  requestArgument('limit', location='args', type=int, help='number of rows returned, required', required=True),
+  requestArgument('offset', location='args', type=int, help='start row from db, required', required=True),
+  requestArgument('employee_id', location='args', type=str, help='event user id, required', required=True),
+  requestArgument('start_date', location='args', type=str, help='start event date filter'),
+  requestArgument('end_date', location='args', type=str, help='end event date filter')
+])
 
 class EmployeeSalesApi(Resource):
     
+  @authRequired
+  @versionETag(['tbl_sale', 'tbl_sale_has_payment_method_installment', 'tbl_payment_method', 'tbl_payment_method_installment', 'tbl_client', 'tbl_employee', 'tbl_person'])
   def get(self):
 
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('limit', location='args', type=int, help='number of rows returned, required', required=True)
-    argsParser.add_argument('offset', location='args', type=int, help='start row from db, required', required=True)
-    argsParser.add_argument('employee_id', location='args', type=str, help='event user id, required', required=True)
-    argsParser.add_argument('start_date', location='args', type=str, help='start event date filter')
-    argsParser.add_argument('end_date', location='args', type=str, help='end event date filter')
-    args = argsParser.parse_args()
+    args = employeeSalesGetSchema.parse()
     
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
-
     geralFilterScrypt, geralFilterScryptNoLimit, geralFilterArgs, geralFilterArgsNoLimit =  dbGetSqlFilterScrypt(
       [
         {'filterCollum':'e.employee_id', 'filterOperator':'=', 'filterValue':args.get('employee_id')},
@@ -71,26 +72,24 @@ class EmployeeSalesApi(Resource):
       return { 'count_sales': 0, 'sales': [] }, 200
     
     for saleRow in salesQuery:
-      saleRow['sale_creation_date_time'] = str(saleRow['sale_creation_date_time'])
       saleRow['sale_employee_comission'] = saleRow['sale_total_value'] * saleRow['employee_comission']
 
     return { 'count_sales': countQuery['countemps'], 'sales': salesQuery }, 200
 
+employeeSalesSummaryGetSchema = requestSchema([
+  requestArgument('employee_id', location='args', type=int, help='event user id, required', required=True),
+  requestArgument('start_date', location='args', type=str, help='start event date filter'),
+  requestArgument('end_date', location='args', type=str, help='end event date filter')
+])
+
 class EmployeeSalesSummaryApi(Resource):
 
+  @authRequired
+  @versionETag(['tbl_sale', 'tbl_sale_has_payment_method_installment', 'tbl_payment_method', 'tbl_payment_method_installment', 'tbl_employee'])
   def get(self):
 
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('employee_id', location='args', type=int, help='event user id, required', required=True)
-    argsParser.add_argument('start_date', location='args', type=str, help='start event date filter')
-    argsParser.add_argument('end_date', location='args', type=str, help='end event date filter')
-    args = argsParser.parse_args()
+    args = employeeSalesSummaryGetSchema.parse()
     
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
-
     employeeQuery = dbGetSingle(
       ' SELECT * FROM tbl_employee e WHERE e.employee_id = %s; ', [(args['employee_id'])])
     
@@ -2,37 +2,36 @@ from flask import Flask, abort
 from flask_restful import Resource, Api, reqparse
 
 from utils.dbUtils import *
-from services.authentication import isAuthTokenValid
-
-# when tbl_event_name changes please restart backend
-globalEventNames = None
+from utils.requestSchema import requestSchema, requestArgument
+from utils.referenceData import getReferenceRows
+from services.authentication import authRequired
+from utils.etag import versionETag
+
+def getEventNames():
+
+  eventNames = getReferenceRows('event_names')
+  if not eventNames:
+    raise Exception('Error trying to get global event names')
+  return eventNames
+
+eventsGetSchema = requestSchema([
+  requestArgument('limit', location='args', type=int, help='number of rows returned, required', required=True),
+  requestArgument('offset', location='args', type=int, help='start row from db, required', required=True),
+  requestArgument('event_user_id', location='args', type=str, help='event user id'),
+  requestArgument('event_name_id', location='args', type=str, help='event name id'),
+  requestArgument('event_start_date_time', location='args', type=str, help='start event date filter'),
+  requestArgument('event_end_date_time', location='args', type=str, help='end event date filter')
+])
 
 class EventsApi(Resource):
     
+  @authRequired
+  @versionETag(['tbl_event', 'tbl_event_name', 'tbl_person'])
   def get(self):
 
-    global globalEventNames
+    args = eventsGetSchema.parse()
     
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('limit', location='args', type=int, help='number of rows returned, required', required=True)
-    argsParser.add_argument('offset', location='args', type=int, help='start row from db, required', required=True)
-    argsParser.add_argument('event_user_id', location='args', type=str, help='event user id')
-    argsParser.add_argument('event_name_id', location='args', type=str, help='event name id')
-    argsParser.add_argument('event_start_date_time', location='args', type=str, help='start event date filter')
-    argsParser.add_argument('event_end_date_time', location='args', type=str, help='end event date filter')
-    args = argsParser.parse_args()
-    
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
-
-    # get event names and stores in a global variable to not perform a select again
-    if globalEventNames == None:
-
-      globalEventNames = dbGetAll(' SELECT event_name_id, event_name FROM tbl_event_name; ')
-      if not globalEventNames:
-        raise Exception('Error trying to get global event names')
+    eventNames = getEventNames()
     
     # get events with filters
     filterScrypt, filterScryptNoLimit, filterArgs, filterArgsNoLimit = dbGetSqlFilterScrypt(
@@ -59,9 +58,6 @@ class EventsApi(Resource):
       + filterScryptNoLimit, filterArgsNoLimit)
     
     if not eventsQuery or not countEventsQuery:
-      return { 'count_events' : 0, 'events' : [], 'event_names' : globalEventNames }, 200
+      return { 'count_events' : 0, 'events' : [], 'event_names' : eventNames }, 200
     
-    for eventRow in eventsQuery:
-      eventRow['event_date_time'] = str(eventRow['event_date_time'])
-
-    return { 'count_events' : countEventsQuery['count_events'], 'events' : eventsQuery, 'event_names' : globalEventNames }, 200
\ No newline at end of file
+    return { 'count_events' : countEventsQuery['count_events'], 'events' : eventsQuery, 'event_names' : eventNames }, 200
\ No newline at end of file
@@ -3,39 +3,414 @@ from flask_restful import Resource, Api, reqparse
 import traceback
 
 from utils.dbUtils import *
+from utils.requestSchema import requestSchema, requestArgument, requestListSchema, requestItemField, requestInt, requestFloat, isPositive, isNotNegative
+from utils.referenceData import registerReferenceList, isReferenceId, referenceIdValidator
 from utils.generatePDFReport import createProductsReport, delayedRemoveReport
 from utils.utils import toBRCurrency
-from services.authentication import isAuthTokenValid
+from services.authentication import authRequired
+from utils.etag import versionETag
+from utils.singleFlight import singleFlight
 
+# tables read by getProductInfo, any write to them reloads it
+productInfoTables = ['tbl_product', 'tbl_product_collection', 'tbl_product_type', 'tbl_product_color', 'tbl_product_other', 'tbl_product_size']
+
+# lookup lists of getProductInfo and the id and name columns of their index
+productInfoNameColumns = {
+  'collections': ('product_collection_id', 'product_collection_name'),
+  'types': ('product_type_id', 'product_type_name'),
+  'colors': ('product_color_id', 'product_color_name'),
+  'others': ('product_other_id', 'product_other_name'),
+  'sizes': ('product_size_id', 'product_size_name')
+}
+
+# (table versions, product info, names by id of each lookup list), shared by the requests of the worker
+globalProductInfo = None
+
+def loadProductInfo():
+
+  global globalProductInfo
+
+  # the versions are read before the lists, a write done in between only makes the next request reload them
+  tableVersions = getTableVersions(productInfoTables)
+  if globalProductInfo == None or globalProductInfo[0] != tableVersions:
+
+    # a lagging replica would keep old lists with the new versions until the next write, they are read from the primary
+    query = {}
+    query['products'] = dbGetAll(' SELECT product_id, product_name, product_code FROM tbl_product p WHERE p.is_product_active = TRUE; ', useReplica=False)
+    query['collections'] = dbGetAll(' SELECT * FROM tbl_product_collection ORDER BY product_collection_pos; ', useReplica=False)
+    query['types'] = dbGetAll(' SELECT * FROM tbl_product_type ORDER BY product_type_pos; ', useReplica=False)
+    query['colors'] = dbGetAll(' SELECT * FROM tbl_product_color ORDER BY product_color_pos; ', useReplica=False)
+    query['others'] = dbGetAll(' SELECT * FROM tbl_product_other ORDER BY product_other_pos; ', useReplica=False)
+    query['sizes'] = dbGetAll(' SELECT * FROM tbl_product_size ORDER BY product_size_pos; ', useReplica=False)
+
+    infoNames = {}
+    for listName, (idColumn, nameColumn) in productInfoNameColumns.items():
+      infoNames[listName] = dict([(infoRow[idColumn], infoRow[nameColumn]) for infoRow in (query[listName] or [])])
+
+    globalProductInfo = (tableVersions, query, infoNames)
+
+  return globalProductInfo
+
+# the cached lists are shared, callers must not change them
 def getProductInfo():
+  return loadProductInfo()[1]
+
+# name of a collection, type, color, other or size by its id, the id itself when it does not exist
+def getProductInfoName(listName, infoId):
+  return loadProductInfo()[2][listName].get(infoId, infoId)
+
+# collections, types, colors, others and sizes of the reference data registry, served by loadProductInfo
+class productInfoReference():
+  def __init__(self, listName):
+    self.listName = listName
+
+  def load(self):
+    return loadProductInfo()
+
+  def getRows(self):
+    return loadProductInfo()[1][self.listName] or []
+
+  def hasId(self, infoId):
+    try:
+      infoId = int(infoId)
+    except (TypeError, ValueError):
+      return False
+    return infoId in loadProductInfo()[2][self.listName]
+
+  def getName(self, infoId):
+    return getProductInfoName(self.listName, infoId)
+
+for productInfoListName in productInfoNameColumns:
+  registerReferenceList(productInfoListName, productInfoReference(productInfoListName))
+
+@retryTransaction()
+def createProductInDB(args):
+
+  # inserts product
+  dbExecute(
+    ' INSERT INTO tbl_product (product_code, product_name, product_observations) VALUES (%s, %s, %s) ',
+    [args['product_code'], args['product_name'], args['product_observations']])
+  
+  productQuery = dbGetSingle(
+    " SELECT product_id FROM tbl_product WHERE product_code = %s AND is_product_active = TRUE; ",
+    [(args['product_code'])])
+  
+  if not productQuery:
+    raise Exception('Exception empty select after insert from tbl_product put')
+  
+  productId = productQuery['product_id']
+  
+  # inserts has collections
+  if args.get('product_collection_ids') is not None:
+    for collectionId in args['product_collection_ids']:
+      dbExecute(
+        ' INSERT INTO tbl_product_has_collection (product_id, product_collection_id) VALUES (%s, %s) ',
+        [productId, collectionId])
+  
+  # inserts has types
+  if args.get('product_type_ids') is not None:
+    for typeId in args['product_type_ids']:
+      dbExecute(
+        ' INSERT INTO tbl_product_has_type (product_id, product_type_id) VALUES (%s, %s) ',
+        [productId, typeId])
+  
+  # inserts customized products to finish
+  for customizedProduct in args['customized_products']:
+    dbExecute(
+      ' INSERT INTO tbl_customized_product (product_id, product_color_id, product_other_id, product_size_id, '
+      ' customized_product_price, customized_product_quantity) '
+      '   VALUES (%s, %s, %s, %s, %s, %s) ',
+      [
+        productId,
+        customizedProduct['product_color_id'] if customizedProduct.get('product_color_id') else None,
+        customizedProduct['product_other_id'] if customizedProduct.get('product_other_id') else None,
+        customizedProduct['product_size_id'],
+        customizedProduct['product_price'],
+        customizedProduct['product_quantity']
+      ])
+
+@retryTransaction()
+def updateProductInDB(args, productQuery, customizedProductQuery):
+
+  productId = productQuery['product_id']
+
+  # resets the update marks, the function runs again when its transaction is retried
+  for argsCustomizedProduct in args['customized_products']:
+    argsCustomizedProduct['updated'] = False
+  
+  ### Product ###
+
+  # if product is immutable (a sale/conditional is associated with it) and its data has changed(code or name), disables it and makes a new one
+  if (
+    productQuery['is_product_immutable'] and (
+    productQuery['product_code'] != args['product_code'] or 
+    productQuery['product_name'] != args['product_name'])):
+      
+    # disables immutable old product
+    dbExecute(
+      ' UPDATE tbl_product SET '
+      '   is_product_active = FALSE '
+      '   WHERE product_id = %s; ',
+      [(productId)])
+    
+    # removes its not immutable custom products, and sets customizedProductQuery to [] to avoid incorrect reuse later
+    for customProduct in customizedProductQuery:
+      if not customProduct['is_customized_product_immutable']:
+        dbExecute(
+          ' DELETE FROM tbl_customized_product WHERE customized_product_id = %s; ',
+          [(customProduct['customized_product_id'])])
+    customizedProductQuery = []
+
+    # removes its collections
+    dbExecute(
+      ' DELETE FROM tbl_product_has_collection WHERE product_id = %s; ',
+      (productId,))
+
+    # removes its types
+    dbExecute(
+      ' DELETE FROM tbl_product_has_type WHERE product_id = %s; ',
+      (productId,))
+
+    # inserts new product and get the new product id to use in customized products updates later
+    dbExecute(
+      ' INSERT INTO tbl_product (product_code, product_name, product_observations) VALUES (%s, %s, %s) ',
+      [args['product_code'], args['product_name'], args['product_observations']])
+    
+    productIdQuery = dbGetSingle(
+      " SELECT product_id FROM tbl_product WHERE product_code = %s AND product_name = %s AND is_product_active = TRUE; ",
+      [args['product_code'], args['product_name']])
+  
+    if not productIdQuery:
+      raise Exception('Exception empty select after update and insert from tbl_product patch')
+    
+    productId = productIdQuery['product_id']
+
+    # inserts has collections
+    if args.get('product_collection_ids') is not None:
+      for collectionId in args['product_collection_ids']:
+        dbExecute(
+          ' INSERT INTO tbl_product_has_collection (product_id, product_collection_id) VALUES (%s, %s); ',
+          [productId, collectionId])
+    
+    # inserts has types
+    if args.get('product_type_ids') is not None:
+      for typeId in args['product_type_ids']:
+        dbExecute(
+          ' INSERT INTO tbl_product_has_type (product_id, product_type_id) VALUES (%s, %s) ',
+          [productId, typeId])
+    
+  # else removes or updates its collections or types if necessary
+  else:
 
-  query = {}
-  query['products'] = dbGetAll(' SELECT product_id, product_name, product_code FROM tbl_product p WHERE p.is_product_active = TRUE; ')
-  query['collections'] = dbGetAll(' SELECT * FROM tbl_product_collection ORDER BY product_collection_pos; ')
-  query['types'] = dbGetAll(' SELECT * FROM tbl_product_type ORDER BY product_type_pos; ')
-  query['colors'] = dbGetAll(' SELECT * FROM tbl_product_color ORDER BY product_color_pos; ')
-  query['others'] = dbGetAll(' SELECT * FROM tbl_product_other ORDER BY product_other_pos; ')
-  query['sizes'] = dbGetAll(' SELECT * FROM tbl_product_size ORDER BY product_size_pos; ')
+    # code or name - in this case, product is not immutable
+    if (productQuery['product_code'] != args['product_code'] or 
+      productQuery['product_name'] != args['product_name'] or
+      productQuery['product_observations'] != args['product_observations']):
 
-  return query
+      dbExecute(
+        ' UPDATE tbl_product SET '
+        '   product_code = %s, '
+        '   product_name = %s, '
+        '   product_observations = %s '
+        '   WHERE product_id = %s; ',
+        [args['product_code'], args['product_name'], args['product_observations'], productId])
+
+    # product collections
+    if (args.get('product_collection_ids') is not None):
+
+      for dbProductCollectionId in productQuery['product_collection_ids']:
+        if dbProductCollectionId not in args['product_collection_ids']:
+          dbExecute(
+            ' DELETE FROM tbl_product_has_collection WHERE product_id = %s AND product_collection_id = %s; ',
+            [productId, dbProductCollectionId])
+      
+      for argsProductCollectionId in args['product_collection_ids']:
+        if argsProductCollectionId not in productQuery['product_collection_ids']:
+          dbExecute(
+            ' INSERT INTO tbl_product_has_collection (product_id, product_collection_id) VALUES (%s, %s) ',
+            [productId, argsProductCollectionId])
+    
+    # product types
+    if (args.get('product_type_ids') is not None):
+
+      for dbProductTypesId in productQuery['product_type_ids']:
+        if dbProductTypesId not in args['product_type_ids']:
+          dbExecute(
+            ' DELETE FROM tbl_product_has_type WHERE product_id = %s AND product_type_id = %s; ',
+            [productId, dbProductTypesId])
+      
+      for argsProductTypeId in args['product_type_ids']:
+        if argsProductTypeId not in productQuery['product_type_ids']:
+          dbExecute(
+            ' INSERT INTO tbl_product_has_type (product_id, product_type_id) VALUES (%s, %s) ',
+            [productId, argsProductTypeId])
+
+  ### Customized Products ###
+  for dbCustomizedProduct in customizedProductQuery:
+    productFound = False
+
+    for argsCustomizedProduct in args['customized_products']:
+
+      if (dbCustomizedProduct.get('product_color_id') == argsCustomizedProduct.get('product_color_id') and
+        dbCustomizedProduct.get('product_other_id') == argsCustomizedProduct.get('product_other_id') and
+        dbCustomizedProduct.get('product_size_id') == argsCustomizedProduct.get('product_size_id')):
+        productFound = True
+        break
+
+    # if dbCustomizedProduct is in args - only updates it because its data is equal except its price and quantity
+    if productFound:
+      dbExecute(
+        ' UPDATE tbl_customized_product SET '
+        '   product_id = %s, '
+        '   customized_product_price = %s, '
+        '   customized_product_quantity = %s, '
+        '   is_customized_product_active = TRUE '
+        '   WHERE customized_product_id = %s; ',
+        [ productId,
+          argsCustomizedProduct['product_price'],
+          argsCustomizedProduct['product_quantity'],
+          dbCustomizedProduct['customized_product_id']
+        ])
+      
+      # set updated = True for those customized products to avoid reupdating later
+      argsCustomizedProduct['updated'] = True
+
+    # if dbCustomizedProduct not found in args - remove db product by deleting or disabling it
+    else:
+      # disable if is immutable
+      if dbCustomizedProduct['is_customized_product_immutable']:
+        dbExecute(
+          ' UPDATE tbl_customized_product SET '
+          '   is_customized_product_active = FALSE '
+          '   WHERE customized_product_id = %s; ',
+          [(dbCustomizedProduct['customized_product_id'])])
+      # delete if not
+      else:
+        dbExecute(
+          ' DELETE FROM tbl_customized_product WHERE customized_product_id = %s; ',
+          [(dbCustomizedProduct['customized_product_id'])])
+
+  # for the rest of not updated customized products, inserts in db    
+  for argsCustomizedProduct in args['customized_products']:
+    if not argsCustomizedProduct['updated']:
+      dbExecute(
+        ' INSERT INTO tbl_customized_product (product_id, product_color_id, product_other_id, product_size_id, '
+        ' customized_product_price, customized_product_quantity) '
+        '   VALUES (%s, %s, %s, %s, %s, %s) ',
+        [
+          productId,
+          argsCustomizedProduct['product_color_id'] if argsCustomizedProduct.get('product_color_id') else None,
+          argsCustomizedProduct['product_other_id'] if argsCustomizedProduct.get('product_other_id') else None,
+          argsCustomizedProduct['product_size_id'],
+          argsCustomizedProduct['product_price'],
+          argsCustomizedProduct['product_quantity']
+        ])
+
+@retryTransaction()
+def deleteProductFromDB(productId, productQuery, customizedProductQuery):
+
+  hasImmutableRows = False
+
+  # customized products
+  for customizedProduct in customizedProductQuery:
+
+    if customizedProduct['is_customized_product_immutable']:
+      hasImmutableRows = True
+
+      if customizedProduct['is_customized_product_active']:
+        dbExecute(
+          ' UPDATE tbl_customized_product SET '
+          '   is_customized_product_active = FALSE '
+          '   WHERE customized_product_id = %s; ',
+          [(customizedProduct['customized_product_id'])])
+      
+    else:
+      dbExecute(
+        ' DELETE FROM tbl_customized_product WHERE customized_product_id = %s; ',
+        [(customizedProduct['customized_product_id'])])
+
+  # types
+  for hasTypesId in productQuery['product_has_type_ids']:
+    dbExecute(
+      ' DELETE FROM tbl_product_has_type WHERE product_has_type_id = %s; ',
+      [(hasTypesId)])
+
+  # collections
+  for hasCollectionId in productQuery['product_has_collection_ids']:
+    dbExecute(
+      ' DELETE FROM tbl_product_has_collection WHERE product_has_collection_id = %s; ',
+      [(hasCollectionId)])
+
+  # product
+  if productQuery['is_product_immutable'] or hasImmutableRows:
+    dbExecute(
+      ' UPDATE tbl_product SET '
+      '   is_product_active = FALSE '
+      '   WHERE product_id = %s; ',
+      [(productId)])
+    
+  else:
+    dbExecute(
+      ' DELETE FROM tbl_product WHERE product_id = %s; ',
+      [(productId)])
+
+productCustomizedProductsSchema = requestListSchema([
+  requestItemField('product_price', type=requestFloat, falsyMissing=False, check=isPositive, message='Preço do produto inválido para uma das variações'),
+  requestItemField('product_quantity', type=requestInt, falsyMissing=False, check=isNotNegative, message='Quantidade do produto inválida para uma das variações'),
+  requestItemField('product_size_id', type=requestInt, falsyMissing=False, check=referenceIdValidator('sizes'), message='Tamanho do produto inválido para uma das variações'),
+  requestItemField('product_color_id', type=requestInt, required=False, falsyMissing=False, check=referenceIdValidator('colors'), message='Cor do produto inválida para uma das variações'),
+  requestItemField('product_other_id', type=requestInt, required=False, falsyMissing=False, check=referenceIdValidator('others'), message='Outro do produto inválido para uma das variações')
+], 'Produtos customizaveis inválidos', 'Produtos customizaveis inválidos')
+
+# message of the first collection or type that does not exist, None when every one exists
+def getInvalidProductReferenceMessage(args):
+
+  for collectionId in args.get('product_collection_ids') or []:
+    if not isReferenceId('collections', collectionId):
+      return 'Uma das coleções do produto não existe no sistema'
+
+  for typeId in args.get('product_type_ids') or []:
+    if not isReferenceId('types', typeId):
+      return 'Um dos tipos do produto não existe no sistema'
+
+  return None
+
+productPutSchema = requestSchema([
+  requestArgument('product_code', location='json', type=str, help='product code, required', required=True),
+  requestArgument('product_name', location='json', type=str, help='product name, required', required=True),
+  requestArgument('product_collection_ids', location='json', type=list, help='product list of assigned collections ids'),
+  requestArgument('product_type_ids', location='json', type=list, help='product list of assigned types'),
+  requestArgument('customized_products', location='json', type=list, help='product variations list, required', required=True, items=productCustomizedProductsSchema),
+  requestArgument('product_observations', location='json', type=str, help='product observations')
+])
+
+productGetSchema = requestSchema([
+  requestArgument('product_code', location='args', type=str, help='product code, required', required=True)
+])
+
+productPatchSchema = requestSchema([
+  requestArgument('product_id', location='json', type=int, help='product id, required', required=True),
+  requestArgument('product_code', location='json', type=str, help='product code, required', required=True),
+  requestArgument('product_name', location='json', type=str, help='product name, required', required=True),
+  requestArgument('product_collection_ids', location='json', type=list, help='product list of assigned collections ids'),
+  requestArgument('product_type_ids', location='json', type=list, help='product list of assigned types'),
+  requestArgument('customized_products', location='json', type=list, help='product variations list, required', required=True, items=productCustomizedProductsSchema),
+  requestArgument('product_observations', location='json', type=str, help='product observations')
+])
+
+productDeleteSchema = requestSchema([
+  requestArgument('product_id', location='json', type=int, help='product id, required', required=True)
+])
 
 class ProductApi(Resource):
 
+  @authRequired
   def put(self):
       
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('product_code', location='json', type=str, help='product code, required', required=True)
-    argsParser.add_argument('product_name', location='json', type=str, help='product name, required', required=True)
-    argsParser.add_argument('product_collection_ids', location='json', type=list, help='product list of assigned collections ids')
-    argsParser.add_argument('product_type_ids', location='json', type=list, help='product list of assigned types')
-    argsParser.add_argument('customized_products', location='json', type=list, help='product variations list, required', required=True)
-    argsParser.add_argument('product_observations', location='json', type=str, help='product observations')
-    args = argsParser.parse_args()
-
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
+    args = productPutSchema.parse()
+    invalidMessage = productPutSchema.getInvalidMessage(args) or getInvalidProductReferenceMessage(args)
+    if invalidMessage:
+      return invalidMessage, 422
 
     # test product
     productQuery = dbGetSingle("SELECT * FROM tbl_product WHERE product_code = %s AND is_product_active = TRUE; ",[(args['product_code'])])
@@ -46,9 +421,6 @@ class ProductApi(Resource):
     if productQuery != None:
       return 'Existe um produto ativo com o mesmo nome, escolha um novo nome ou desative o outro produto', 409
 
-    if args.get('customized_products') is None or len(args['customized_products']) == 0:
-      return 'Produtos customizaveis inválidos', 422
-
     # customized products
     for pos in range(len(args['customized_products'])):
       customizedProduct = args['customized_products'][pos]
@@ -62,83 +434,20 @@ class ProductApi(Resource):
           customizedProduct.get('product_size_id') == sndCustomizedProduct.get('product_size_id')):
           
           return 'Existe duplicatas nos produtos', 422
-
-      # price
-      if customizedProduct.get('product_price') is None or customizedProduct['product_price'] <= 0:
-        return 'Preço do produto inválido para uma das variações', 422
-      
-      # quantity
-      if customizedProduct.get('product_quantity') is None or customizedProduct['product_quantity'] < 0:
-        return 'Quantidade do produto inválida para uma das variações', 422
-      
-      # size
-      if customizedProduct.get('product_size_id') is None:
-        return 'Tamanho do produto inválido para uma das variações', 422
     
-    dbObjectIns = startGetDbObject()
     try:
-      # inserts product
-      dbExecute(
-        ' INSERT INTO tbl_product (product_code, product_name, product_observations) VALUES (%s, %s, %s) ',
-        [args['product_code'], args['product_name'], args['product_observations']], True, dbObjectIns)
-      
-      productQuery = dbGetSingle(
-        " SELECT product_id FROM tbl_product WHERE product_code = %s AND is_product_active = TRUE; ",
-        [(args['product_code'])], True, dbObjectIns)
-      
-      if not productQuery:
-        raise Exception('Exception empty select after insert from tbl_product put')
-      
-      productId = productQuery['product_id']
-      
-      # inserts has collections
-      if args.get('product_collection_ids') is not None:
-        for collectionId in args['product_collection_ids']:
-          dbExecute(
-            ' INSERT INTO tbl_product_has_collection (product_id, product_collection_id) VALUES (%s, %s) ',
-            [productId, collectionId], True, dbObjectIns)
-      
-      # inserts has types
-      if args.get('product_type_ids') is not None:
-        for typeId in args['product_type_ids']:
-          dbExecute(
-            ' INSERT INTO tbl_product_has_type (product_id, product_type_id) VALUES (%s, %s) ',
-            [productId, typeId], True, dbObjectIns)
-      
-      # inserts customized products to finish
-      for customizedProduct in args['customized_products']:
-        dbExecute(
-          ' INSERT INTO tbl_customized_product (product_id, product_color_id, product_other_id, product_size_id, '
-          ' customized_product_price, customized_product_quantity) '
-          '   VALUES (%s, %s, %s, %s, %s, %s) ',
-          [
-            productId,
-            customizedProduct['product_color_id'] if customizedProduct.get('product_color_id') else None,
-            customizedProduct['product_other_id'] if customizedProduct.get('product_other_id') else None,
-            customizedProduct['product_size_id'],
-            customizedProduct['product_price'],
-            customizedProduct['product_quantity']
-          ], True, dbObjectIns)
-      
+      createProductInDB(args)
     except Exception as e:
-      dbRollback(dbObjectIns)
       traceback.print_exc()
       return 'Erro ao criar o usuario ' + str(e), 500
-    dbCommit(dbObjectIns)
     
     return {}, 201
     
+  @authRequired
   def get(self):
       
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('product_code', location='args', type=str, help='product code, required', required=True)
-    args = argsParser.parse_args()
+    args = productGetSchema.parse()
     
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
-
     # product
     productQuery = dbGetSingle(
       ' SELECT product_id, product_code, product_name, product_observations, is_product_immutable, is_product_active, product_creation_date_time '
@@ -149,8 +458,6 @@ class ProductApi(Resource):
     if not productQuery:
       return 'Produto não encontrado', 404
 
-    productQuery['product_creation_date_time'] = str(productQuery['product_creation_date_time'])
-
     # collections
     rawCollections = dbGetAll(
       ' SELECT product_collection_name '
@@ -191,22 +498,13 @@ class ProductApi(Resource):
     return productQuery, 200
 
   # patch to update products and customized products - maybe the most complex request code
+  @authRequired
   def patch(self):
       
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('product_id', location='json', type=int, help='product id, required', required=True)
-    argsParser.add_argument('product_code', location='json', type=str, help='product code, required', required=True)
-    argsParser.add_argument('product_name', location='json', type=str, help='product name, required', required=True)
-    argsParser.add_argument('product_collection_ids', location='json', type=list, help='product list of assigned collections ids')
-    argsParser.add_argument('product_type_ids', location='json', type=list, help='product list of assigned types')
-    argsParser.add_argument('customized_products', location='json', type=list, help='product variations list, required', required=True)
-    argsParser.add_argument('product_observations', location='json', type=str, help='product observations')
-    args = argsParser.parse_args()
-
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
+    args = productPatchSchema.parse()
+    invalidMessage = productPatchSchema.getInvalidMessage(args) or getInvalidProductReferenceMessage(args)
+    if invalidMessage:
+      return invalidMessage, 422
 
     # get and test product
     productQuery = dbGetSingle(
@@ -261,9 +559,6 @@ class ProductApi(Resource):
       return 'Produtos customizados inexistentes', 422
 
     # test request customized products
-    if args.get('customized_products') is None or len(args['customized_products']) == 0:
-      return 'Produtos customizaveis inválidos', 422
-    
     for pos in range(len(args['customized_products'])):
       customizedProduct = args['customized_products'][pos]
 
@@ -279,209 +574,19 @@ class ProductApi(Resource):
           customizedProduct.get('product_size_id') == sndCustomizedProduct.get('product_size_id')):
 
           return 'Existe duplicatas nos produtos', 422
-
-      # checks price
-      if customizedProduct.get('product_price') is None or customizedProduct['product_price'] <= 0:
-        return 'Preço do produto inválido para uma das variações', 422
-      
-      # checks quantity
-      if customizedProduct.get('product_quantity') is None or customizedProduct['product_quantity'] < 0:
-        return 'Quantidade do produto inválida para uma das variações', 422
-      
-      # checks size
-      if customizedProduct.get('product_size_id') is None:
-        return 'Tamanho do produto inválido para uma das variações', 422
     
-    dbObjectIns = startGetDbObject()
     try:
-      productId = productQuery['product_id']
-      
-      ### Product ###
-
-      # if product is immutable (a sale/conditional is associated with it) and its data has changed(code or name), disables it and makes a new one
-      if (
-        productQuery['is_product_immutable'] and (
-        productQuery['product_code'] != args['product_code'] or 
-        productQuery['product_name'] != args['product_name'])):
-          
-        # disables immutable old product
-        dbExecute(
-          ' UPDATE tbl_product SET '
-          '   is_product_active = FALSE '
-          '   WHERE product_id = %s; ',
-          [(productId)], True, dbObjectIns)
-        
-        # removes its not immutable custom products, and sets customizedProductQuery to [] to avoid incorrect reuse later
-        for customProduct in customizedProductQuery:
-          if not customProduct['is_customized_product_immutable']:
-            dbExecute(
-              ' DELETE FROM tbl_customized_product WHERE customized_product_id = %s; ',
-              [(customProduct['customized_product_id'])], True, dbObjectIns)
-        customizedProductQuery = []
-
-        # removes its collections
-        dbExecute(
-          ' DELETE FROM tbl_product_has_collection WHERE product_id = %s; ',
-          (productId,), True, dbObjectIns)
-
-        # removes its types
-        dbExecute(
-          ' DELETE FROM tbl_product_has_type WHERE product_id = %s; ',
-          (productId,), True, dbObjectIns)
-
-        # inserts new product and get the new product id to use in customized products updates later
-        dbExecute(
-          ' INSERT INTO tbl_product (product_code, product_name, product_observations) VALUES (%s, %s, %s) ',
-          [args['product_code'], args['product_name'], args['product_observations']], True, dbObjectIns)
-        
-        productIdQuery = dbGetSingle(
-          " SELECT product_id FROM tbl_product WHERE product_code = %s AND product_name = %s AND is_product_active = TRUE; ",
-          [args['product_code'], args['product_name']], True, dbObjectIns)
-      
-        if not productIdQuery:
-          raise Exception('Exception empty select after update and insert from tbl_product patch')
-        
-        productId = productIdQuery['product_id']
-
-        # inserts has collections
-        if args.get('product_collection_ids') is not None:
-          for collectionId in args['product_collection_ids']:
-            dbExecute(
-              ' INSERT INTO tbl_product_has_collection (product_id, product_collection_id) VALUES (%s, %s); ',
-              [productId, collectionId], True, dbObjectIns)
-        
-        # inserts has types
-        if args.get('product_type_ids') is not None:
-          for typeId in args['product_type_ids']:
-            dbExecute(
-              ' INSERT INTO tbl_product_has_type (product_id, product_type_id) VALUES (%s, %s) ',
-              [productId, typeId], True, dbObjectIns)
-        
-      # else removes or updates its collections or types if necessary
-      else:
-
-        # code or name - in this case, product is not immutable
-        if (productQuery['product_code'] != args['product_code'] or 
-          productQuery['product_name'] != args['product_name'] or
-          productQuery['product_observations'] != args['product_observations']):
-
-          dbExecute(
-            ' UPDATE tbl_product SET '
-            '   product_code = %s, '
-            '   product_name = %s, '
-            '   product_observations = %s '
-            '   WHERE product_id = %s; ',
-            [args['product_code'], args['product_name'], args['product_observations'], productId], True, dbObjectIns)
-
-        # product collections
-        if (args.get('product_collection_ids') is not None):
-
-          for dbProductCollectionId in productQuery['product_collection_ids']:
-            if dbProductCollectionId not in args['product_collection_ids']:
-              dbExecute(
-                ' DELETE FROM tbl_product_has_collection WHERE product_id = %s AND product_collection_id = %s; ',
-                [productId, dbProductCollectionId], True, dbObjectIns)
-          
-          for argsProductCollectionId in args['product_collection_ids']:
-            if argsProductCollectionId not in productQuery['product_collection_ids']:
-              dbExecute(
-                ' INSERT INTO tbl_product_has_collection (product_id, product_collection_id) VALUES (%s, %s) ',
-                [productId, argsProductCollectionId], True, dbObjectIns)
-        
-        # product types
-        if (args.get('product_type_ids') is not None):
-
-          for dbProductTypesId in productQuery['product_type_ids']:
-            if dbProductTypesId not in args['product_type_ids']:
-              dbExecute(
-                ' DELETE FROM tbl_product_has_type WHERE product_id = %s AND product_type_id = %s; ',
-                [productId, dbProductTypesId], True, dbObjectIns)
-          
-          for argsProductTypeId in args['product_type_ids']:
-            if argsProductTypeId not in productQuery['product_type_ids']:
-              dbExecute(
-                ' INSERT INTO tbl_product_has_type (product_id, product_type_id) VALUES (%s, %s) ',
-                [productId, argsProductTypeId], True, dbObjectIns)
-
-      ### Customized Products ###
-      for dbCustomizedProduct in customizedProductQuery:
-        productFound = False
-
-        for argsCustomizedProduct in args['customized_products']:
-
-          if (dbCustomizedProduct.get('product_color_id') == argsCustomizedProduct.get('product_color_id') and
-            dbCustomizedProduct.get('product_other_id') == argsCustomizedProduct.get('product_other_id') and
-            dbCustomizedProduct.get('product_size_id') == argsCustomizedProduct.get('product_size_id')):
-            productFound = True
-            break
-
-        # if dbCustomizedProduct is in args - only updates it because its data is equal except its price and quantity
-        if productFound:
-          dbExecute(
-            ' UPDATE tbl_customized_product SET '
-            '   product_id = %s, '
-            '   customized_product_price = %s, '
-            '   customized_product_quantity = %s, '
-            '   is_customized_product_active = TRUE '
-            '   WHERE customized_product_id = %s; ',
-            [ productId,
-              argsCustomizedProduct['product_price'],
-              argsCustomizedProduct['product_quantity'],
-              dbCustomizedProduct['customized_product_id']
-            ], True, dbObjectIns)
-          
-          # set updated = True for those customized products to avoid reupdating later
-          argsCustomizedProduct['updated'] = True
-
-        # if dbCustomizedProduct not found in args - remove db product by deleting or disabling it
-        else:
-          # disable if is immutable
-          if dbCustomizedProduct['is_customized_product_immutable']:
-            dbExecute(
-              ' UPDATE tbl_customized_product SET '
-              '   is_customized_product_active = FALSE '
-              '   WHERE customized_product_id = %s; ',
-              [(dbCustomizedProduct['customized_product_id'])], True, dbObjectIns)
-          # delete if not
-          else:
-            dbExecute(
-              ' DELETE FROM tbl_customized_product WHERE customized_product_id = %s; ',
-              [(dbCustomizedProduct['customized_product_id'])], True, dbObjectIns)
-
-      # for the rest of not updated customized products, inserts in db    
-      for argsCustomizedProduct in args['customized_products']:
-        if not argsCustomizedProduct['updated']:
-          dbExecute(
-            ' INSERT INTO tbl_customized_product (product_id, product_color_id, product_other_id, product_size_id, '
-            ' customized_product_price, customized_product_quantity) '
-            '   VALUES (%s, %s, %s, %s, %s, %s) ',
-            [
-              productId,
-              argsCustomizedProduct['product_color_id'] if argsCustomizedProduct.get('product_color_id') else None,
-              argsCustomizedProduct['product_other_id'] if argsCustomizedProduct.get('product_other_id') else None,
-              argsCustomizedProduct['product_size_id'],
-              argsCustomizedProduct['product_price'],
-              argsCustomizedProduct['product_quantity']
-            ], True, dbObjectIns)
-      
+      updateProductInDB(args, productQuery, customizedProductQuery)
     except Exception as e:
-      dbRollback(dbObjectIns)
       traceback.print_exc()
       return 'Erro ao atualizar o produto ' + str(e), 500
-    dbCommit(dbObjectIns)
 
     return {}, 204
   
+  @authRequired
   def delete(self):
 
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('product_id', location='json', type=int, help='product id, required', required=True)
-    args = argsParser.parse_args()
-
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
+    args = productDeleteSchema.parse()
 
     # get and test product
     productQuery = dbGetSingle(
@@ -521,88 +626,44 @@ class ProductApi(Resource):
     if customizedProductQuery == None:
       return 'Produtos customizados inexistentes', 422
     
-    dbObjectIns = startGetDbObject()
     try:
-      hasImmutableRows = False
-
-      # customized products
-      for customizedProduct in customizedProductQuery:
-
-        if customizedProduct['is_customized_product_immutable']:
-          hasImmutableRows = True
-
-          if customizedProduct['is_customized_product_active']:
-            dbExecute(
-              ' UPDATE tbl_customized_product SET '
-              '   is_customized_product_active = FALSE '
-              '   WHERE customized_product_id = %s; ',
-              [(customizedProduct['customized_product_id'])], True, dbObjectIns)
-          
-        else:
-          dbExecute(
-            ' DELETE FROM tbl_customized_product WHERE customized_product_id = %s; ',
-            [(customizedProduct['customized_product_id'])], True, dbObjectIns)
-
-      # types
-      for hasTypesId in productQuery['product_has_type_ids']:
-        dbExecute(
-          ' DELETE FROM tbl_product_has_type WHERE product_has_type_id = %s; ',
-          [(hasTypesId)], True, dbObjectIns)
-
-      # collections
-      for hasCollectionId in productQuery['product_has_collection_ids']:
-        dbExecute(
-          ' DELETE FROM tbl_product_has_collection WHERE product_has_collection_id = %s; ',
-          [(hasCollectionId)], True, dbObjectIns)
-
-      # product
-      if productQuery['is_product_immutable'] or hasImmutableRows:
-        dbExecute(
-          ' UPDATE tbl_product SET '
-          '   is_product_active = FALSE '
-          '   WHERE product_id = %s; ',
-          [(args['product_id'])], True, dbObjectIns)
-        
-      else:
-        dbExecute(
-          ' DELETE FROM tbl_product WHERE product_id = %s; ',
-          [(args['product_id'])], True, dbObjectIns)
-      
+      deleteProductFromDB(args['product_id'], productQuery, customizedProductQuery)
     except Exception as e:
-      dbRollback(dbObjectIns)
       traceback.print_exc()
       return 'Erro ao criar o usuario ' + str(e), 500
-    dbCommit(dbObjectIns)
     
     return {}, 204
 
+productsGetSchema = requestSchema([
+  requestArgument('limit', location='args', type=int, help='query limit'),
+  requestArgument('offset', location='args', type=int, help='query offset'),
+  requestArgument('order_by', location='args', type=str, help='query orderby', required=True),
+  requestArgument('order_by_asc', location='args', type=str, help='query orderby ascendant', required=True),
+  requestArgument('product_code', location='args', type=str, help='product code'),
+  requestArgument('product_name', location='args', type=str, help='product name'),
+  requestArgument('product_color_id', location='args', type=int, help='product color id'),
+  requestArgument('product_other_id', location='args', type=int, help='product other id'),
+  requestArgument('product_size_id', location='args', type=int, help='product size id'),
+  requestArgument('product_collection_id', location='args', type=int, help='product list of assigned collections ids'),
+  requestArgument('product_type_id', location='args', type=int, help='product list of assigned types'),
+  requestArgument('product_quantity_initial', location='args', type=int, help='initial product quantity'),
+  requestArgument('product_quantity_final', location='args', type=int, help='final product quantity'),
+  requestArgument('product_price_initial', location='args', type=float, help='initial product price'),
+  requestArgument('product_price_final', location='args', type=float, help='final product price'),
+  requestArgument('generate_pdf', location='args', type=str, help='if the expected return is a file')
+])
+
+# tables read by the products list
+productsTables = ['tbl_product', 'tbl_customized_product', 'tbl_product_collection', 'tbl_product_color', 'tbl_product_has_collection', 'tbl_product_has_type', 'tbl_product_other', 'tbl_product_size', 'tbl_product_type']
+
 class ProductsApi(Resource):
     
+  @authRequired
+  @versionETag(productsTables)
+  @singleFlight
   def get(self):
       
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('limit', location='args', type=int, help='query limit')
-    argsParser.add_argument('offset', location='args', type=int, help='query offset')
-    argsParser.add_argument('order_by', location='args', type=str, help='query orderby', required=True)
-    argsParser.add_argument('order_by_asc', location='args', type=str, help='query orderby ascendant', required=True)
-    argsParser.add_argument('product_code', location='args', type=str, help='product code')
-    argsParser.add_argument('product_name', location='args', type=str, help='product name')
-    argsParser.add_argument('product_color_id', location='args', type=int, help='product color id')
-    argsParser.add_argument('product_other_id', location='args', type=int, help='product other id')
-    argsParser.add_argument('product_size_id', location='args', type=int, help='product size id')
-    argsParser.add_argument('product_collection_id', location='args', type=int, help='product list of assigned collections ids')
-    argsParser.add_argument('product_type_id', location='args', type=int, help='product list of assigned types')
-    argsParser.add_argument('product_quantity_initial', location='args', type=int, help='initial product quantity')
-    argsParser.add_argument('product_quantity_final', location='args', type=int, help='final product quantity')
-    argsParser.add_argument('product_price_initial', location='args', type=float, help='initial product price')
-    argsParser.add_argument('product_price_final', location='args', type=float, help='final product price')
-    argsParser.add_argument('generate_pdf', location='args', type=str, help='if the expected return is a file')
-    args = argsParser.parse_args()
-    
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
+    args = productsGetSchema.parse()
     
     orderByAsc = (args['order_by_asc'] == '1' or args['order_by_asc'].lower() == 'true')
     
@@ -693,15 +754,13 @@ class ProductsApi(Resource):
       + geralFilterScrypt
     )
 
-    countProducts = dbGetSingle(countScrypt, allFilterArgsNoLimit)
-    productsQuery = dbGetAll(geralScrypt, allFilterArgs)
+    countProducts = dbGetSingle(countScrypt, allFilterArgsNoLimit, cacheTables=productsTables)
 
     # pdf creation
     if args.get('generate_pdf') == 'true' or args.get('generate_pdf') == True:
 
       # filters
       filters = []
-      productInfo = getProductInfo()
 
       if args.get('product_code'):
         filters.append(f"Código: {args.get('product_code')}")
@@ -710,24 +769,19 @@ class ProductsApi(Resource):
         filters.append(f"Nome: {args.get('product_name')}")
 
       if args.get('product_color_id'):
-        color = next(filter(lambda x: x['product_color_id'] == args.get('product_color_id'), productInfo['colors']))
-        filters.append(f"Cor: {color['product_color_name']}")
+        filters.append(f"Cor: {getProductInfoName('colors', args.get('product_color_id'))}")
 
       if args.get('product_other_id'):
-        other = next(filter(lambda x: x['product_other_id'] == args.get('product_other_id'), productInfo['others']))
-        filters.append(f"Outro: {other['product_other_name']}")
+        filters.append(f"Outro: {getProductInfoName('others', args.get('product_other_id'))}")
 
       if args.get('product_size_id'):
-        size = next(filter(lambda x: x['product_size_id'] == args.get('product_size_id'), productInfo['sizes']))
-        filters.append(f"Tamanho: {size['product_size_name']}")
+        filters.append(f"Tamanho: {getProductInfoName('sizes', args.get('product_size_id'))}")
 
       if args.get('product_collection_id'):
-        collection = next(filter(lambda x: x['product_collection_id'] == args.get('product_collection_id'), productInfo['collections']))
-        filters.append(f"Coleção: {collection['product_collection_name']}")
+        filters.append(f"Coleção: {getProductInfoName('collections', args.get('product_collection_id'))}")
 
       if args.get('product_type_id'):
-        type = next(filter(lambda x: x['product_type_id'] == args.get('product_type_id'), productInfo['types']))
-        filters.append(f"Tipo: {type['product_type_name']}")
+        filters.append(f"Tipo: {getProductInfoName('types', args.get('product_type_id'))}")
 
       if args.get('product_quantity_initial'):
         filters.append(f"Quantidade, de: {args.get('product_quantity_initial')}")
@@ -751,30 +805,23 @@ class ProductsApi(Resource):
       filters.append(appliedOrderStr)
 
       # create and remove the pdf file after(1 minute)
-      pdfPath, pdfName = createProductsReport(filters, productsQuery)
+      pdfPath, pdfName = createProductsReport(filters, dbIterate(geralScrypt, allFilterArgs, rowMode='slots'))
       delayedRemoveReport(pdfPath)
 
       # sends
       return send_file(pdfPath, as_attachment=True, download_name=pdfName)
 
+    productsQuery = dbGetAll(geralScrypt, allFilterArgs, cacheTables=productsTables)
+
     if not countProducts or not productsQuery:
       return { 'count': 0, 'products': [] }, 200
 
-    for productRow in productsQuery:
-      productRow['product_creation_date_time'] = str(productRow['product_creation_date_time'])
-    
     return { 'count': countProducts['countp'], 'products': productsQuery }, 200
   
 class ProductInfoApi(Resource):
     
+  @authRequired
+  @versionETag(productInfoTables)
   def get(self):
       
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    args = argsParser.parse_args()
-    
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
-
     return getProductInfo(), 200
\ No newline at end of file
@@ -5,28 +5,125 @@ import traceback
 import os
 
 from utils.dbUtils import *
+from utils.requestSchema import requestSchema, requestArgument, requestListSchema, requestItemField, requestInt, requestFloat, isPositive
+from utils.referenceData import getReferenceRows, referenceIdValidator
 from utils.utils import toBRCurrency
 from utils.generatePDFReport import createSaleReport, createSalesReport, delayedRemoveReport
-from services.authentication import isAuthTokenValid
+from services.authentication import authRequired
+from utils.etag import versionETag
+from utils.singleFlight import singleFlight
+
+@retryTransaction()
+def createSaleInDB(args):
+
+  # inserts sale and gets sale id
+  dbExecute(
+    ' INSERT INTO tbl_sale (sale_client_id, sale_employee_id, sale_total_discount_percentage, sale_total_value) VALUES '
+    '   (%s, %s, %s, %s) ',
+    [args['sale_client_id'], args['sale_employee_id'], args['sale_total_discount_percentage'], args['sale_total_value']])
+  
+  saleIdQuery = dbGetSingle(' SELECT LAST_INSERT_ID() AS sale_id; ')
+  
+  if not saleIdQuery:
+    raise Exception('Exception empty select saleIdQuery after insert from tbl_sale put')
+  
+  # set installments
+  for salePaymentMethodInstallment in args['sale_payment_method_installments']:
+    dbExecute(
+      ' INSERT INTO tbl_sale_has_payment_method_installment (sale_id, payment_method_installment_id, payment_method_value) VALUES (%s, %s, %s); ', 
+      [saleIdQuery['sale_id'], salePaymentMethodInstallment['id'], salePaymentMethodInstallment['value']])
+  
+  for product in args['sale_has_products']:
+    # set product immutable
+    dbExecute(
+      ' UPDATE tbl_product '
+      '   SET is_product_immutable = TRUE '
+      '   WHERE product_id = %s; ', [(product['product_id'])])
+    
+    for customizedProduct in product['customized_products']:
+      # set customized product immutable and adjusts its quantity
+      # relative to the current row, a retried transaction does not write back a quantity read before a concurrent sale
+      dbExecute(
+        ' UPDATE tbl_customized_product '
+        '   SET is_customized_product_immutable = TRUE, '
+        '   customized_product_quantity = GREATEST(customized_product_quantity - %s, 0) '
+        '   WHERE customized_product_id = %s; ',
+        [
+          customizedProduct['customized_product_sale_quantity'], 
+          customizedProduct['customized_product_id']
+        ])
+      
+      # inserts sale has product
+      dbExecute(
+        ' INSERT INTO tbl_sale_has_product (sale_id, product_id, customized_product_id, sale_has_product_price, sale_has_product_quantity) VALUES '
+        '   (%s, %s, %s, %s, %s); ', 
+        [saleIdQuery['sale_id'], product['product_id'], customizedProduct['customized_product_id'], customizedProduct['customized_product_price'], customizedProduct['customized_product_sale_quantity']])
+
+@retryTransaction()
+def cancelSaleInDB(saleId, customSaleProducts):
+
+  for customProduct in customSaleProducts:
+    customDbProduct = dbGetSingle(
+      ' SELECT * '
+      '   FROM tbl_customized_product cp ' 
+      '   WHERE cp.customized_product_id = %s; ',
+      (customProduct['customized_product_id'],))
+    if not customDbProduct:
+      raise Exception('Customized product not found while adding quantity to cancel sale')
+    
+    dbExecute(
+      ' UPDATE tbl_customized_product SET '
+      '   customized_product_quantity = customized_product_quantity + %s '
+      '   WHERE customized_product_id = %s; ',
+      [ customProduct['sale_has_product_quantity'], customProduct['customized_product_id']])
+
+  dbExecute(' UPDATE tbl_sale SET sale_status = \'Cancelado\' WHERE sale_id = %s; ', [(saleId)])
+
+salePaymentMethodInstallmentsSchema = requestListSchema([
+  requestItemField('id', type=requestInt, check=referenceIdValidator('payment_method_installments'), message='A forma de pagamento associado à venda está com formato inválido',
+    checkMessage='A forma de pagamento associado à venda não existe no sistema'),
+  requestItemField('value', type=requestFloat, check=isPositive, message='A forma de pagamento associado à venda está com formato inválido')
+], 'A forma de pagamento associado à venda está com formato inválido')
+
+saleCustomizedProductsSchema = requestListSchema([
+  requestItemField('customized_product_id', type=requestInt, check=isPositive, message='Um dos produtos customizaveis associados foi enviado sem o campo customized_product_id'),
+  requestItemField('customized_product_sale_quantity', type=requestInt, message='Um dos produtos customizaveis associados foi enviado sem o campo customized_product_sale_quantity',
+    check=isPositive, checkMessage='Um dos produtos associados possui quantidade de produtos a venda 0 ou menor')
+], 'Um dos produtos customizaveis associados está com formato inválido', 'Um dos produtos associados foi enviado sem produtos customizados')
+
+saleHasProductsSchema = requestListSchema([
+  requestItemField('product_id', type=requestInt, check=isPositive, message='Um dos produtos associados foi enviado sem o product_id'),
+  requestItemField('customized_products', type=list, items=saleCustomizedProductsSchema, message='Um dos produtos associados foi enviado sem produtos customizados')
+], 'Um dos produtos associados está com formato inválido', 'A venda deve possuir pelo menos um produto associado')
+
+salePutSchema = requestSchema([
+  requestArgument('sale_client_id', location='json', type=int, help='sale client id, required', required=True),
+  requestArgument('sale_employee_id', location='json', type=int, help='sale employee id, required', required=True),
+  requestArgument('sale_payment_method_installments', location='json', type=list, help='sale payment method installments with id and value, required', required=True, items=salePaymentMethodInstallmentsSchema),
+  requestArgument('sale_has_products', location='json', type=list, help='product and its variations list, required', required=True, items=saleHasProductsSchema),
+  requestArgument('sale_total_discount_percentage', location='json', type=float, help='sale total discount percentage float, required and can be 0.0', required=True),
+  requestArgument('sale_total_value', location='json', type=float, help='sale total value float, required', required=True),
+  requestArgument('force_product_addition', location='json', type=str, help='if will add missing products in sale creation, required', required=True)
+])
+
+saleGetSchema = requestSchema([
+  requestArgument('sale_id', location='args', type=int, help='sale id, required', required=True),
+  requestArgument('generate_pdf', location='args', type=str, help='if the expected return is a file')
+])
+
+saleDeleteSchema = requestSchema([
+  requestArgument('sale_id', location='json', type=int, help='sale id, required', required=True)
+])
 
 class SaleApi(Resource):
 
+  @authRequired
   def put(self):
       
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('sale_client_id', location='json', type=int, help='sale client id, required', required=True)
-    argsParser.add_argument('sale_employee_id', location='json', type=int, help='sale employee id, required', required=True)
-    argsParser.add_argument('sale_payment_method_installments', location='json', type=list, help='sale payment method installments with id and value, required', required=True)
-    argsParser.add_argument('sale_has_products', location='json', type=list, help='product and its variations list, required', required=True)
-    argsParser.add_argument('sale_total_discount_percentage', location='json', type=float, help='sale total discount percentage float, required and can be 0.0', required=True)
-    argsParser.add_argument('sale_total_value', location='json', type=float, help='sale total value float, required', required=True)
-    argsParser.add_argument('force_product_addition', location='json', type=str, help='if will add missing products in sale creation, required', required=True)
-    args = argsParser.parse_args()
-
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
+    args = salePutSchema.parse()
+    invalidMessage = salePutSchema.getInvalidMessage(args)
+    if invalidMessage:
+      return invalidMessage, 422
 
     forceProductAddition = args['force_product_addition'].lower() in ['true', '1']
 
@@ -50,21 +147,6 @@ class SaleApi(Resource):
     if not employeeQuery['user_entry_allowed'] or not employeeQuery['employee_active']:
       return 'O funcionario associado à venda não esta habilitado no sistema', 422
 
-    # test payment method installments
-    for salePaymentMethodInstallment in args['sale_payment_method_installments']:
-
-      if not salePaymentMethodInstallment.get('id') or not salePaymentMethodInstallment.get('value'):
-        return 'A forma de pagamento associado à venda está com formato inválido', 422
-
-      payMethodQuery = dbGetSingle(
-        ' SELECT pm.payment_method_name, pmi.payment_method_installment_number '
-        '   FROM tbl_payment_method pm '
-        '   JOIN tbl_payment_method_installment pmi ON pm.payment_method_id = pmi.payment_method_id '
-        '   WHERE pmi.payment_method_installment_id = %s; ', [(salePaymentMethodInstallment['id'])])
-      
-      if not payMethodQuery:
-        return 'A forma de pagamento associado à venda não existe no sistema', 422
-
     # test sale total discount percentage
     if args['sale_total_discount_percentage'] < 0.0:
       return 'O desconto na venda não pode ser menor que 0', 422
@@ -73,13 +155,7 @@ class SaleApi(Resource):
  
     # test sale products
     calculatedSaleValue = 0
-    if len(args['sale_has_products']) == 0:
-      return 'A venda deve possuir pelo menos um produto associado', 422
-
     for product in args['sale_has_products']:
-      if not product.get('product_id'):
-        return 'Um dos produtos associados foi enviado sem o product_id', 422
-      
       productQuery = dbGetSingle(
         ' SELECT p.product_id, p.is_product_active '
         '   FROM tbl_product p '
@@ -90,18 +166,8 @@ class SaleApi(Resource):
       if not productQuery['is_product_active']:
         return 'Um dos produtos associados está inativo', 422
       
-      if not product.get('customized_products') or len(product['customized_products']) == 0:
-        return 'Um dos produtos associados foi enviado sem produtos customizados', 422
-      
       # test customized products
       for customizedProduct in product['customized_products']:
-        if not customizedProduct.get('customized_product_id'):
-          return 'Um dos produtos customizaveis associados foi enviado sem o campo customized_product_id', 422
-        if not customizedProduct.get('customized_product_sale_quantity'):
-          return 'Um dos produtos customizaveis associados foi enviado sem o campo customized_product_sale_quantity', 422
-        if customizedProduct['customized_product_sale_quantity'] <= 0:
-          return 'Um dos produtos associados possui quantidade de produtos a venda 0 ou menor', 422
-
         customProductQuery = dbGetSingle(
           ' SELECT cp.is_customized_product_active, cp.customized_product_price, cp.customized_product_quantity '
           '   FROM tbl_product p '
@@ -126,73 +192,19 @@ class SaleApi(Resource):
     #if ('{:.2f}'.format(calculatedSaleValue-calculatedSaleValue*args['sale_total_discount_percentage'])) != '{:.2f}'.format(args['sale_total_value']):
     #  return 'Preço esperado diferente do preço calculado no sistema', 422
     
-    dbObjectIns = startGetDbObject()
     try:
-      # inserts sale and gets sale id
-      dbExecute(
-        ' INSERT INTO tbl_sale (sale_client_id, sale_employee_id, sale_total_discount_percentage, sale_total_value) VALUES '
-        '   (%s, %s, %s, %s) ',
-        [args['sale_client_id'], args['sale_employee_id'], args['sale_total_discount_percentage'], args['sale_total_value']],
-        True, dbObjectIns)
-      
-      saleIdQuery = dbGetSingle(' SELECT LAST_INSERT_ID() AS sale_id; ', None, True, dbObjectIns)
-      
-      if not saleIdQuery:
-        raise Exception('Exception empty select saleIdQuery after insert from tbl_sale put')
-      
-      # set installments
-      for salePaymentMethodInstallment in args['sale_payment_method_installments']:
-        dbExecute(
-          ' INSERT INTO tbl_sale_has_payment_method_installment (sale_id, payment_method_installment_id, payment_method_value) VALUES (%s, %s, %s); ', 
-          [saleIdQuery['sale_id'], salePaymentMethodInstallment['id'], salePaymentMethodInstallment['value']], True, dbObjectIns)
-      
-      for product in args['sale_has_products']:
-        # set product immutable
-        dbExecute(
-          ' UPDATE tbl_product '
-          '   SET is_product_immutable = TRUE '
-          '   WHERE product_id = %s; ', [(product['product_id'])], True, dbObjectIns)
-        
-        for customizedProduct in product['customized_products']:
-          # set customized product immutable and adjusts its quantity
-          dbExecute(
-            ' UPDATE tbl_customized_product '
-            '   SET is_customized_product_immutable = TRUE, '
-            '   customized_product_quantity = %s '
-            '   WHERE customized_product_id = %s; ',
-            [
-              max(customizedProduct['customized_product_quantity'] - customizedProduct['customized_product_sale_quantity'], 0), 
-              customizedProduct['customized_product_id']
-            ], 
-            True, dbObjectIns)
-          
-          # inserts sale has product
-          dbExecute(
-            ' INSERT INTO tbl_sale_has_product (sale_id, product_id, customized_product_id, sale_has_product_price, sale_has_product_quantity) VALUES '
-            '   (%s, %s, %s, %s, %s); ', 
-            [saleIdQuery['sale_id'], product['product_id'], customizedProduct['customized_product_id'], customizedProduct['customized_product_price'], customizedProduct['customized_product_sale_quantity']],
-            True, dbObjectIns)
-      
+      createSaleInDB(args)
     except Exception as e:
-      dbRollback(dbObjectIns)
       traceback.print_exc()
       return 'Erro ao criar a venda ' + str(e), 500
-    dbCommit(dbObjectIns)
     
     return {}, 201
     
+  @authRequired
   def get(self):
       
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('sale_id', location='args', type=int, help='sale id, required', required=True)
-    argsParser.add_argument('generate_pdf', location='args', type=str, help='if the expected return is a file')
-    args = argsParser.parse_args()
+    args = saleGetSchema.parse()
     
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
-
     # sale
     saleQuery = dbGetSingle(
       ' SELECT * '
@@ -212,7 +224,6 @@ class SaleApi(Resource):
     
     if not saleQuery:
       return 'Venda não encontrada', 404
-    saleQuery['sale_creation_date_time'] = str(saleQuery['sale_creation_date_time'])
     
     # client
     saleQuery['sale_client'] = dbGetSingle(
@@ -255,16 +266,10 @@ class SaleApi(Resource):
     return saleQuery, 200
   
   # sale is never deleted, but it status changes to canceled
+  @authRequired
   def delete(self):
 
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('sale_id', location='json', type=int, help='sale id, required', required=True)
-    args = argsParser.parse_args()
-
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
+    args = saleDeleteSchema.parse()
 
     saleQuery = dbGetSingle(
       ' SELECT * '
@@ -283,58 +288,40 @@ class SaleApi(Resource):
       '   WHERE s.sale_id = %s; ',
       [(args['sale_id'])])
     
-    dbObjectIns = startGetDbObject()
     try:
-      for customProduct in customSaleProducts:
-        customDbProduct = dbGetSingle(
-          ' SELECT * '
-          '   FROM tbl_customized_product cp ' 
-          '   WHERE cp.customized_product_id = %s; ',
-          (customProduct['customized_product_id'],),True, dbObjectIns
-        )
-        if not customDbProduct:
-          raise Exception('Customized product not found while adding quantity to cancel sale')
-        
-        dbExecute(
-          ' UPDATE tbl_customized_product SET '
-          '   customized_product_quantity = %s '
-          '   WHERE customized_product_id = %s; ',
-          [ customDbProduct['customized_product_quantity'] + customProduct['sale_has_product_quantity'], customProduct['customized_product_id']]
-          , True, dbObjectIns)
-
-      dbExecute(' UPDATE tbl_sale SET sale_status = \'Cancelado\' WHERE sale_id = %s; ', [(args['sale_id'])], True, dbObjectIns)
-
+      cancelSaleInDB(args['sale_id'], customSaleProducts)
     except Exception as e:
-      dbRollback(dbObjectIns)
       traceback.print_exc()
       return 'Erro ao cancelar a venda ' + str(e), 500
-    dbCommit(dbObjectIns)
     
     return {}, 204
 
+salesGetSchema = requestSchema([
+  requestArgument('limit', location='args', type=int, help='query limit'),
+  requestArgument('offset', location='args', type=int, help='query offset'),
+  requestArgument('order_by', location='args', type=str, help='query orderby', required=True),
+  requestArgument('order_by_asc', location='args', type=str, help='query orderby ascendant', required=True),
+  requestArgument('sale_id', location='args', type=int, help='sale id'),
+  requestArgument('sale_client_name', location='args', type=str, help='sale client name'),
+  requestArgument('sale_status', location='args', type=str, help='sale status'),
+  requestArgument('sale_creation_date_time_start', location='args', type=str, help='start of sale creation interval'),
+  requestArgument('sale_creation_date_time_end', location='args', type=str, help='end of sale creation interval'),
+  requestArgument('sale_total_value_start', location='args', type=str, help='start value of sale'),
+  requestArgument('sale_total_value_end', location='args', type=str, help='end value of sale'),
+  requestArgument('generate_pdf', location='args', type=str, help='if the expected return is a file')
+])
+
+# tables read by the sales list and its summary
+salesTables = ['tbl_sale', 'tbl_sale_has_payment_method_installment', 'tbl_payment_method', 'tbl_payment_method_installment', 'tbl_client', 'tbl_employee', 'tbl_person']
+
 class SalesApi(Resource):
     
+  @authRequired
+  @versionETag(salesTables)
+  @singleFlight
   def get(self):
       
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('limit', location='args', type=int, help='query limit')
-    argsParser.add_argument('offset', location='args', type=int, help='query offset')
-    argsParser.add_argument('order_by', location='args', type=str, help='query orderby', required=True)
-    argsParser.add_argument('order_by_asc', location='args', type=str, help='query orderby ascendant', required=True)
-    argsParser.add_argument('sale_id', location='args', type=int, help='sale id')
-    argsParser.add_argument('sale_client_name', location='args', type=str, help='sale client name')
-    argsParser.add_argument('sale_status', location='args', type=str, help='sale status')
-    argsParser.add_argument('sale_creation_date_time_start', location='args', type=str, help='start of sale creation interval')
-    argsParser.add_argument('sale_creation_date_time_end', location='args', type=str, help='end of sale creation interval')
-    argsParser.add_argument('sale_total_value_start', location='args', type=str, help='start value of sale')
-    argsParser.add_argument('sale_total_value_end', location='args', type=str, help='end value of sale')
-    argsParser.add_argument('generate_pdf', location='args', type=str, help='if the expected return is a file')
-    args = argsParser.parse_args()
-    
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
+    args = salesGetSchema.parse()
     
     orderByAsc = (args['order_by_asc'] == '1' or args['order_by_asc'].lower() == 'true')
     
@@ -407,8 +394,7 @@ class SalesApi(Resource):
       '	  JOIN tbl_payment_method pm ON pmi.payment_method_id = pm.payment_method_id '
       + geralFilterScryptNoLimit)
 
-    salesSummary = dbGetSingle(sqlScryptNoLimit, geralFilterArgsNoLimit)
-    salesQuery = dbGetAll(sqlScrypt, geralFilterArgs)
+    salesSummary = dbGetSingle(sqlScryptNoLimit, geralFilterArgsNoLimit, cacheTables=salesTables)
 
     # pdf creation
     if args.get('generate_pdf') == 'true' or args.get('generate_pdf') == True:
@@ -453,39 +439,29 @@ class SalesApi(Resource):
       filters.append(appliedOrderStr)
 
       # create and remove the pdf file after(1 minute)
-      pdfPath, pdfName = createSalesReport(filters, salesSummary, salesQuery)
+      pdfPath, pdfName = createSalesReport(filters, salesSummary, dbIterate(sqlScrypt, geralFilterArgs, rowMode='slots'))
       delayedRemoveReport(pdfPath)
 
       # sends
       return send_file(pdfPath, as_attachment=True, download_name=pdfName)
 
+    salesQuery = dbGetAll(sqlScrypt, geralFilterArgs, cacheTables=salesTables)
+
     if not salesSummary or not salesQuery:
       return { 'total_quantity': 0, 'sales': [] }, 200
 
-    for saleRow in salesQuery:
-      saleRow['sale_creation_date_time'] = str(saleRow['sale_creation_date_time'])
-
     return { 'total_quantity': salesSummary['total_quantity'], 'sales': salesQuery, 'summary': salesSummary }, 200
   
 class SaleInfoApi(Resource):
     
+  @authRequired
+  @versionETag(['tbl_sale', 'tbl_payment_method', 'tbl_payment_method_installment'])
   def get(self):
       
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    args = argsParser.parse_args()
-    
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
-    
     query = dbGetSingle(
       ' SELECT AUTO_INCREMENT AS next_sale_id FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s; ',
       [os.getenv('SQL_SCHEMA'), 'tbl_sale'])
     
-    query['payment_methods'] = dbGetAll(
-      ' SELECT pmi.payment_method_installment_id, pm.payment_method_name, pm.payment_method_id, pmi.payment_method_installment_number '
-      '   FROM tbl_payment_method pm '
-      '   JOIN tbl_payment_method_installment pmi ON pm.payment_method_id = pmi.payment_method_id; ')
+    query['payment_methods'] = getReferenceRows('payment_method_installments')
     
     return query, 200
\ No newline at end of file
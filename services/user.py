@@ -3,7 +3,9 @@ from flask_restful import Resource, Api, reqparse
 import traceback
 
 from utils.dbUtils import *
-from services.authentication import isAuthTokenValid
+from utils.requestSchema import requestSchema, requestArgument
+from services.authentication import authRequired, authOptional
+from utils.etag import versionETag
 
 def getAllUsersFromDB(pendingUsers=False):
 
@@ -35,7 +37,7 @@ def getAllUsersFromDB(pendingUsers=False):
       'gender': userRow['user_gender'],
       'mail': userRow['user_mail'],
       'phone_num': userRow['user_phone_num'],
-      'entry_date_time': str(userRow['user_entry_date_time']),
+      'entry_date_time': userRow['user_entry_date_time'],
       'entry_allowed': userRow['user_entry_allowed']
     })
 
@@ -62,12 +64,24 @@ def getUserFromDB(userId):
     'gender': userQuery['user_gender'],
     'mail': userQuery['user_mail'],
     'phone_num': userQuery['user_phone_num'],
-    'entry_date_time': str(userQuery['user_entry_date_time']),
+    'entry_date_time': userQuery['user_entry_date_time'],
     'entry_allowed': userQuery['user_entry_allowed']
   }
 
   return user
 
+@retryTransaction()
+def insertUserInDB(user):
+
+  dbExecute(
+    ' INSERT INTO tbl_person (person_name, person_cpf, person_birth_date, person_gender) VALUES (%s, %s, %s, %s) ',
+    [user['name'], user['cpf'], user['birth_date'], user['gender']])
+  
+  dbExecute(
+    ' INSERT INTO tbl_user (user_id, user_type, user_mail, user_phone_num, user_hash_password) VALUES '
+    ' (LAST_INSERT_ID(), %s, %s, %s, %s); ',
+    [user['type'], user['mail'], user['phone_num'], user['hash_password']])
+
 def createUserInDB(user):
     
   if user == None:
@@ -81,79 +95,93 @@ def createUserInDB(user):
   if userQuery != None:
     return 'Cpf já utilizado!'
 
-  dbObjectIns = startGetDbObject()
   try:
-    dbExecute(
-      ' INSERT INTO tbl_person (person_name, person_cpf, person_birth_date, person_gender) VALUES (%s, %s, %s, %s) ',
-      [user['name'], user['cpf'], user['birth_date'], user['gender']], True, dbObjectIns)
-    
-    dbExecute(
-      ' INSERT INTO tbl_user (user_id, user_type, user_mail, user_phone_num, user_hash_password) VALUES '
-      ' (LAST_INSERT_ID(), %s, %s, %s, %s); ',
-      [user['type'], user['mail'], user['phone_num'], user['hash_password']], True, dbObjectIns)
+    insertUserInDB(user)
   except Exception as e:
-    dbRollback(dbObjectIns)
     traceback.print_exc()
     return 'Erro ao criar o usuario ' + str(e)
-  dbCommit(dbObjectIns)
 
   return 'Usuário criado!'
 
+@retryTransaction()
+def removeUserFromDb(userId):
+
+  sqlScrypt = "DELETE FROM tbl_user WHERE user_id = %s;"
+  dbExecute(sqlScrypt, [(userId)])
+  
+  sqlScrypt = "DELETE FROM tbl_person WHERE person_id = %s;"
+  dbExecute(sqlScrypt, [(userId)])
+
 def deleteUserFromDb(userId):
 
-  dbObjectIns = startGetDbObject()
   try:
-    sqlScrypt = "DELETE FROM tbl_user WHERE user_id = %s;"
-    dbExecute(sqlScrypt, [(userId)], True, dbObjectIns)
-    
-    sqlScrypt = "DELETE FROM tbl_person WHERE person_id = %s;"
-    dbExecute(sqlScrypt, [(userId)], True, dbObjectIns)
+    removeUserFromDb(userId)
   except Exception as e:
-    dbRollback(dbObjectIns)
     traceback.print_exc()
     return 'Erro ao atualizar o usuario ' + str(e)
-  dbCommit(dbObjectIns)
 
   return 'Usuário apagado!'
 
+# allows the user entry and registers it as employee
+@retryTransaction()
+def allowUserInDB(user):
+
+  dbExecute(
+    ' UPDATE tbl_person SET '
+    '   person_name = %s, '
+    '   person_birth_date = %s, '
+    '   person_cpf = %s, '
+    '   person_gender = %s '
+    '   WHERE person_id = %s; ',
+    [user['name'], user['birth_date'], user['cpf'], user['gender'], user['id']])
+
+  dbExecute(
+    ' UPDATE tbl_user SET '
+    '   user_type = %s, '
+    '   user_mail = %s, '
+    '   user_phone_num = %s, '
+    '   user_entry_allowed = %s '
+    '   WHERE user_id = %s; ',
+    [user['type'], user['mail'], user['phone_num'], user['entry_allowed'], user['id']])
+
+  dbExecute(
+    ' INSERT INTO tbl_employee (employee_id, employee_comission) VALUES '
+    ' (%s, %s); ', 
+    [user['id'], 0.03])
+
+userGetSchema = requestSchema([
+  requestArgument('user_id', location='args', type=int, help='id from user, required', required=True)
+])
+
+userPutSchema = requestSchema([
+  requestArgument('user_name', type=str, help='Name of the user, required', required=True),
+  requestArgument('user_type', type=str, help='E for employee, A for administrator, required', required=True),
+  requestArgument('user_birth_date', type=str, help='Birth date format: yyyy-mm-dd, required', required=True),
+  requestArgument('user_cpf', type=str, help='Cpf digits 00000000000 without symbols, required', required=True),
+  requestArgument('user_gender', type=str, help='F for female, M for male, required', required=True),
+  requestArgument('user_mail', type=str, help='Email of the user, used to authentication, required', required=True),
+  requestArgument('user_phone_num', type=str, help='User phone number', required=False),
+  requestArgument('user_hash_password', type=str, help='Hash password, defined by the web application, required', required=True)
+])
+
 class UserApi(Resource):
 
+  @authRequired
   def get(self):
 
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('user_id', location='args', type=int, help='id from user, required', required=True)
-    args = argsParser.parse_args()
+    args = userGetSchema.parse()
         
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
-
     user = getUserFromDB(args['user_id'])
     if user == None:
       abort(404, 'Usuário ' + str(args['user_id']) + ' não econtrado!')
             
     return user, 200
     
+  @authOptional
   def put(self):
         
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication!')
-    argsParser.add_argument('user_name', type=str, help='Name of the user, required', required=True)
-    argsParser.add_argument('user_type', type=str, help='E for employee, A for administrator, required', required=True)
-    argsParser.add_argument('user_birth_date', type=str, help='Birth date format: yyyy-mm-dd, required', required=True)
-    argsParser.add_argument('user_cpf', type=str, help='Cpf digits 00000000000 without symbols, required', required=True)
-    argsParser.add_argument('user_gender', type=str, help='F for female, M for male, required', required=True)
-    argsParser.add_argument('user_mail', type=str, help='Email of the user, used to authentication, required', required=True)
-    argsParser.add_argument('user_phone_num', type=str, help='User phone number', required=False)
-    argsParser.add_argument('user_hash_password', type=str, help='Hash password, defined by the web application, required', required=True)
-    args = argsParser.parse_args()
+    args = userPutSchema.parse()
         
-    if(args['Authorization']):
-      isValid, returnMessage = isAuthTokenValid(args)
-      if not isValid:
-        abort(401, 'Autenticação com o token falhou: ' + returnMessage)
-      
     user = {
       'name': args['user_name'],
       'type': args['user_type'],
@@ -173,33 +201,29 @@ class UserApi(Resource):
   
 class UsersApi(Resource):
 
+  @authRequired
+  @versionETag(['tbl_user', 'tbl_person'])
   def get(self):
 
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    args = argsParser.parse_args()
-    
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
-
     users = getAllUsersFromDB()
 
     return { 'users': users }, 200
 
+userPendingPatchSchema = requestSchema([
+  requestArgument('user_id', location='json', type=int, help='id from user, required', required=True)
+])
+
+userPendingDeleteSchema = requestSchema([
+  requestArgument('user_id', location='json', type=int, help='id from user, required', required=True)
+])
+
 class UserPendingApi(Resource):
 
   # patch to autorize user acess
+  @authRequired
   def patch(self):
        
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('user_id', location='json', type=int, help='id from user, required', required=True)
-    args = argsParser.parse_args()
-
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
+    args = userPendingPatchSchema.parse()
 
     user = getUserFromDB(args['user_id'])
     if user == None:
@@ -214,50 +238,20 @@ class UserPendingApi(Resource):
 
     user['entry_allowed'] = True
 
-    dbObjectIns = startGetDbObject()
     try:
-      dbExecute(
-        ' UPDATE tbl_person SET '
-        '   person_name = %s, '
-        '   person_birth_date = %s, '
-        '   person_cpf = %s, '
-        '   person_gender = %s '
-        '   WHERE person_id = %s; ',
-        [user['name'], user['birth_date'], user['cpf'], user['gender'], user['id']], True, dbObjectIns)
-
-      dbExecute(
-        ' UPDATE tbl_user SET '
-        '   user_type = %s, '
-        '   user_mail = %s, '
-        '   user_phone_num = %s, '
-        '   user_entry_allowed = %s '
-        '   WHERE user_id = %s; ',
-        [user['type'], user['mail'], user['phone_num'], user['entry_allowed'], user['id']], True, dbObjectIns)
-
-      dbExecute(
-        ' INSERT INTO tbl_employee (employee_id, employee_comission) VALUES '
-        ' (%s, %s); ', 
-        [user['id'], 0.03], True, dbObjectIns)
+      allowUserInDB(user)
     except Exception as e:
-      dbRollback(dbObjectIns)
       traceback.print_exc()
       return 'Erro ao permitir o funcionario ' + str(e), 409
-    dbCommit(dbObjectIns)
 
     return {}, 204
 
   # delete to deny user acess
+  @authRequired
   def delete(self):
       
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    argsParser.add_argument('user_id', location='json', type=int, help='id from user, required', required=True)
-    args = argsParser.parse_args()
+    args = userPendingDeleteSchema.parse()
     
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
-
     user = getUserFromDB(args['user_id'])
     
     if user == None:
@@ -274,16 +268,10 @@ class UserPendingApi(Resource):
   
 class UsersPendingApi(Resource):
     
+  @authRequired
+  @versionETag(['tbl_user', 'tbl_person'])
   def get(self):
       
-    argsParser = reqparse.RequestParser()
-    argsParser.add_argument('Authorization', location='headers', type=str, help='Bearer with jwt given by server in user autentication, required', required=True)
-    args = argsParser.parse_args()
-
-    isValid, returnMessage = isAuthTokenValid(args)
-    if not isValid:
-      abort(401, 'Autenticação com o token falhou: ' + returnMessage)
-
     pendingUsers = getAllUsersFromDB(pendingUsers=True)
 
     return { 'users': pendingUsers }, 200
\ No newline at end of file
@@ -0,0 +1,20 @@
+-- indexes for the filters and orderings used by SalesApi, EmployeeSalesApi, ConditionalsApi, EventsApi and ProductsApi
+
+-- sales by date range, optionally by status or employee
+CREATE INDEX idx_sale_creation_date_time ON tbl_sale (sale_creation_date_time);
+CREATE INDEX idx_sale_status_creation_date_time ON tbl_sale (sale_status, sale_creation_date_time);
+CREATE INDEX idx_sale_employee_creation_date_time ON tbl_sale (sale_employee_id, sale_creation_date_time);
+
+-- conditionals by date range
+CREATE INDEX idx_conditional_creation_date_time ON tbl_conditional (conditional_creation_date_time);
+
+-- events ordered by date, optionally by user
+CREATE INDEX idx_event_date_time ON tbl_event (event_date_time);
+CREATE INDEX idx_event_user_date_time ON tbl_event (event_user_id, event_date_time);
+
+-- active product lookups by code and name
+CREATE INDEX idx_product_code_active ON tbl_product (product_code, is_product_active);
+CREATE INDEX idx_product_name_active ON tbl_product (product_name, is_product_active);
+
+-- active variations of a product
+CREATE INDEX idx_customized_product_product_active ON tbl_customized_product (product_id, is_customized_product_active);
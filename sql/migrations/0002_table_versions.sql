@@ -0,0 +1,8 @@
+-- version counters of each table, bumped on writes so every node can drop its cached data
+-- used when TABLE_VERSION_BACKEND is mysql
+
+CREATE TABLE IF NOT EXISTS tbl_table_version (
+  table_name VARCHAR(64) NOT NULL,
+  table_version BIGINT NOT NULL,
+  PRIMARY KEY (table_name)
+);
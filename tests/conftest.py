@@ -0,0 +1,67 @@
+import pytest
+from flask import Flask
+
+import utils.sharedState
+import utils.dbUtils
+from utils.dbUtils import dbObject
+
+# sqlite file of the shared state in a temporary folder, so tests do not see the state of a running server
+@pytest.fixture(autouse=True)
+def sharedStatePath(tmp_path, monkeypatch):
+  monkeypatch.setenv('SHARED_STATE_PATH', str(tmp_path / 'shared_state.sqlite'))
+  monkeypatch.setattr(utils.sharedState, 'globalSharedStateDb', None)
+  monkeypatch.setattr(utils.dbUtils, 'globalTableVersionStore', None)
+  monkeypatch.setattr(utils.dbUtils, 'globalDbResultCache', None)
+
+@pytest.fixture
+def app():
+  return Flask(__name__)
+
+class stubCursor():
+  def __init__(self, stubDb):
+    self.stubDb = stubDb
+    self.rows = []
+    self.rowcount = 0
+
+  def execute(self, sqlScrypt, values=None):
+    self.stubDb.statements.append((sqlScrypt, values))
+    self.rows = self.stubDb.getRows(sqlScrypt, values)
+    self.rowcount = len(self.rows) if self.rows else 1
+
+  def executemany(self, sqlScrypt, values):
+    for rowValues in values:
+      self.execute(sqlScrypt, rowValues)
+
+  def fetchall(self):
+    return [dict(row) for row in self.rows]
+
+  def close(self):
+    pass
+
+class stubConnection():
+  def commit(self):
+    pass
+
+  def rollback(self):
+    pass
+
+  def close(self):
+    pass
+
+# database answering every statement with the rows given by getRows(sqlScrypt, values), recording the statements run
+class stubDatabase():
+  def __init__(self, getRows):
+    self.getRows = getRows
+    self.statements = []
+
+  def startGetDbObject(self, buffered=True, replica=False, dictionary=True):
+    return dbObject(stubConnection(), stubCursor(self), True)
+
+# stubDb(getRows) replaces the connections of the dbUtils helpers with a stubDatabase
+@pytest.fixture
+def stubDb(monkeypatch):
+  def createStubDb(getRows):
+    stubDatabaseIns = stubDatabase(getRows)
+    monkeypatch.setattr(utils.dbUtils, 'startGetDbObject', stubDatabaseIns.startGetDbObject)
+    return stubDatabaseIns
+  return createStubDb
@@ -0,0 +1,56 @@
+import utils.cacheUtils
+from utils.cacheUtils import ttlLruCache, cacheMiss
+
+class fakeClock():
+  def __init__(self):
+    self.now = 100.0
+
+  def __call__(self):
+    return self.now
+
+def test_get_set(monkeypatch):
+  monkeypatch.setattr(utils.cacheUtils, 'monotonic', fakeClock())
+  cache = ttlLruCache(2, 10)
+  assert cache.get('a') is cacheMiss
+  cache.set('a', None)
+  assert cache.get('a') is None
+  assert cache.getStats()['hits'] == 1
+  assert cache.getStats()['misses'] == 1
+
+def test_ttl(monkeypatch):
+  clock = fakeClock()
+  monkeypatch.setattr(utils.cacheUtils, 'monotonic', clock)
+  cache = ttlLruCache(10, 10)
+  cache.set('a', 1)
+  cache.set('b', 2, ttl=20)
+  clock.now += 10
+  assert cache.get('a') is cacheMiss
+  assert cache.get('b') == 2
+  assert cache.getStats()['expired'] == 1
+
+def test_lru_eviction(monkeypatch):
+  monkeypatch.setattr(utils.cacheUtils, 'monotonic', fakeClock())
+  cache = ttlLruCache(2, 10)
+  cache.set('a', 1)
+  cache.set('b', 2)
+  # a becomes the most recently used, b is evicted
+  cache.get('a')
+  cache.set('c', 3)
+  assert cache.get('b') is cacheMiss
+  assert cache.get('a') == 1
+  assert cache.get('c') == 3
+  assert cache.getStats()['evictions'] == 1
+
+def test_invalidation():
+  cache = ttlLruCache(10, 10)
+  for key in [(1, 'a'), (1, 'b'), (2, 'a')]:
+    cache.set(key, True)
+  cache.deleteWhere(lambda key: key[0] == 1)
+  cache.delete((2, 'a'))
+  assert cache.getStats()['size'] == 0
+  assert cache.getStats()['invalidations'] == 3
+
+def test_disabled():
+  cache = ttlLruCache(0, 10)
+  cache.set('a', 1)
+  assert cache.get('a') is cacheMiss
@@ -0,0 +1,52 @@
+import gzip
+import pytest
+from flask import Flask, jsonify
+
+from utils.compression import registerResponseCompression
+from utils.etag import registerETag
+
+@pytest.fixture
+def client(monkeypatch):
+  monkeypatch.setenv('RESPONSE_COMPRESSION_MIN_SIZE', '100')
+  app = Flask(__name__)
+
+  @app.route('/small')
+  def small():
+    return jsonify({ 'a': 1 })
+
+  @app.route('/large')
+  def large():
+    return jsonify({ 'rows': ['row ' + str(row) for row in range(100)] })
+
+  @app.route('/text')
+  def text():
+    return 'a' * 200
+
+  # same order of app.py, compression runs after the etag
+  registerResponseCompression(app)
+  registerETag(app)
+  return app.test_client()
+
+def test_small_body_not_compressed(client):
+  response = client.get('/small', headers={ 'Accept-Encoding': 'gzip' })
+  assert 'Content-Encoding' not in response.headers
+  assert 'Accept-Encoding' in response.vary
+
+def test_gzip(client):
+  plainResponse = client.get('/large')
+  response = client.get('/large', headers={ 'Accept-Encoding': 'gzip' })
+  assert response.headers['Content-Encoding'] == 'gzip'
+  assert gzip.decompress(response.get_data()) == plainResponse.get_data()
+  assert response.get_etag()[0] == plainResponse.get_etag()[0] + '-gzip'
+
+  # the compressed etag matches, the 304 keeps it
+  response = client.get('/large', headers={ 'Accept-Encoding': 'gzip', 'If-None-Match': '"' + response.get_etag()[0] + '"' })
+  assert response.status_code == 304
+  assert response.get_etag()[0] == plainResponse.get_etag()[0] + '-gzip'
+
+def test_identity_encoding(client):
+  response = client.get('/text', headers={ 'Accept-Encoding': 'gzip' })
+  assert response.mimetype == 'text/html'
+  assert response.headers['Content-Encoding'] == 'gzip'
+  response = client.get('/text', headers={ 'Accept-Encoding': 'identity' })
+  assert 'Content-Encoding' not in response.headers
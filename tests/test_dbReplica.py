@@ -0,0 +1,113 @@
+import os
+import pytest
+from mysql import connector
+
+import utils.dbUtils
+from utils.dbUtils import dbGetSingle, dbExecute, setDbRequestUser, getDbPool, getDbReplicaPool
+
+# stubbed primary and replica, each read answers with the name of the server that ran it
+@pytest.fixture
+def replicaDb(stubDb, monkeypatch):
+
+  stubDatabaseIns = stubDb(lambda sqlScrypt, values: [])
+  servers = []
+  startGetStubObject = stubDatabaseIns.startGetDbObject
+
+  def startGetDbObject(buffered=True, replica=False, dictionary=True):
+    if replica and stubDatabaseIns.replicaDown:
+      raise connector.errors.InterfaceError(msg='Can\'t connect to MySQL server', errno=2003)
+    servers.append('replica' if replica else 'primary')
+    return startGetStubObject(buffered, replica, dictionary)
+
+  stubDatabaseIns.replicaDown = False
+  stubDatabaseIns.servers = servers
+  monkeypatch.setattr(utils.dbUtils, 'startGetDbObject', startGetDbObject)
+  monkeypatch.setattr(utils.dbUtils, 'getDbReplicaPool', lambda: object())
+  monkeypatch.setattr(utils.dbUtils, 'globalUserWriteStore', None)
+  return stubDatabaseIns
+
+def readServer(app, method='GET', userId=None, useReplica=None):
+  with app.test_request_context('/', method=method):
+    setDbRequestUser(userId)
+    dbGetSingle(' SELECT 1; ', useReplica=useReplica)
+
+def test_get_reads_replica(app, replicaDb):
+  readServer(app, 'GET')
+  readServer(app, 'POST')
+  assert replicaDb.servers == ['replica', 'primary']
+
+def test_read_override(app, replicaDb):
+  readServer(app, 'GET', useReplica=False)
+  readServer(app, 'POST', useReplica=True)
+  assert replicaDb.servers == ['primary', 'replica']
+
+def test_read_your_writes_across_workers(app, replicaDb, monkeypatch):
+
+  with app.test_request_context('/', method='POST'):
+    setDbRequestUser(1)
+    dbExecute(' UPDATE tbl_sale SET sale_status = %s WHERE sale_id = %s; ', ['Cancelado', 1])
+
+  # another worker only shares the sqlite file
+  monkeypatch.setattr(utils.dbUtils, 'globalUserWriteStore', None)
+  replicaDb.servers.clear()
+  readServer(app, 'GET', userId=1)
+  readServer(app, 'GET', userId=2)
+  assert replicaDb.servers == ['primary', 'replica']
+
+  # after the window the user reads the replica again
+  monkeypatch.setenv('SQL_REPLICA_READ_YOUR_WRITES', '0')
+  replicaDb.servers.clear()
+  readServer(app, 'GET', userId=1)
+  assert replicaDb.servers == ['replica']
+
+def test_replica_fallback(app, replicaDb, capsys):
+  replicaDb.replicaDown = True
+  readServer(app, 'GET')
+  assert replicaDb.servers == ['primary']
+  assert '# Replica read failed, reading from the primary' in capsys.readouterr().out
+
+# two local MySQL instances, like SQL_HOST=127.0.0.1 SQL_PORT=3306 SQL_REPLICA_HOST=127.0.0.1 SQL_REPLICA_PORT=3307
+# they do not need to replicate, each read tells the port of the server that ran it
+mysqlRequired = pytest.mark.skipif(not (os.getenv('SQL_HOST') and os.getenv('SQL_REPLICA_HOST')),
+  reason='needs SQL_HOST and SQL_REPLICA_HOST of two MySQL instances')
+
+@pytest.fixture
+def mysqlDb(monkeypatch):
+  monkeypatch.setattr(utils.dbUtils, 'globalDbPool', None)
+  monkeypatch.setattr(utils.dbUtils, 'globalDbReplicaPool', None)
+  monkeypatch.setattr(utils.dbUtils, 'globalUserWriteStore', None)
+  yield
+  for dbPool in [utils.dbUtils.globalDbPool, utils.dbUtils.globalDbReplicaPool]:
+    if dbPool != None:
+      dbPool.dispose()
+
+def readPort(app, method='GET', userId=None, useReplica=None):
+  with app.test_request_context('/', method=method):
+    setDbRequestUser(userId)
+    return dbGetSingle(' SELECT @@port AS port; ', useReplica=useReplica)['port']
+
+@mysqlRequired
+def test_mysql_routing(app, mysqlDb):
+  primaryPort = dbGetSingle(' SELECT @@port AS port; ', useReplica=False)['port']
+  replicaPort = dbGetSingle(' SELECT @@port AS port; ', useReplica=True)['port']
+  assert getDbReplicaPool() != None and getDbPool() != None
+  assert primaryPort != replicaPort
+
+  assert readPort(app, 'GET') == replicaPort
+  assert readPort(app, 'POST') == primaryPort
+  assert readPort(app, 'GET', useReplica=False) == primaryPort
+  assert readPort(app, 'POST', useReplica=True) == replicaPort
+
+  with app.test_request_context('/', method='POST'):
+    setDbRequestUser(1)
+    dbExecute(' DO SLEEP(0); ')
+  assert readPort(app, 'GET', userId=1) == primaryPort
+  assert readPort(app, 'GET', userId=2) == replicaPort
+
+@mysqlRequired
+def test_mysql_fallback(app, mysqlDb, monkeypatch):
+  primaryPort = dbGetSingle(' SELECT @@port AS port; ', useReplica=False)['port']
+  # nothing listens on port 1
+  monkeypatch.setenv('SQL_REPLICA_PORT', '1')
+  monkeypatch.setenv('SQL_POOL_TIMEOUT', '1')
+  assert readPort(app, 'GET') == primaryPort
@@ -0,0 +1,49 @@
+import pytest
+from flask import Flask, jsonify
+
+from utils.etag import registerETag, versionETag, hashETag
+from utils.dbUtils import bumpTableVersions
+
+@pytest.fixture
+def client():
+  app = Flask(__name__)
+
+  @app.route('/small')
+  def small():
+    return jsonify({ 'a': 1 })
+
+  @app.route('/versioned')
+  @versionETag(['tbl_sale'])
+  def versioned():
+    return jsonify({ 'rows': ['row ' + str(row) for row in range(100)] })
+
+  registerETag(app)
+  return app.test_client()
+
+def test_etag_and_304(client):
+  response = client.get('/small')
+  etag = response.get_etag()[0]
+  assert etag == hashETag(response.get_data())
+  assert response.cache_control.private and response.cache_control.no_cache
+  assert 'Accept-Encoding' in response.vary
+
+  response = client.get('/small', headers={ 'If-None-Match': '"' + etag + '"' })
+  assert response.status_code == 304
+  assert response.get_data() == b''
+
+  response = client.get('/small', headers={ 'If-None-Match': '"other"' })
+  assert response.status_code == 200
+
+def test_version_etag(client):
+  response = client.get('/versioned')
+  etag = response.get_etag()[0]
+  assert response.status_code == 200
+
+  response = client.get('/versioned', headers={ 'If-None-Match': '"' + etag + '"' })
+  assert response.status_code == 304
+
+  # a write to the table changes the etag
+  bumpTableVersions(['tbl_sale'])
+  response = client.get('/versioned', headers={ 'If-None-Match': '"' + etag + '"' })
+  assert response.status_code == 200
+  assert response.get_etag()[0] != etag
@@ -0,0 +1,160 @@
+import pytest
+
+import utils.referenceData
+from utils.dbUtils import dbGetSingle, dbExecute, queryBudget, dbQueryBudgetExceeded, getQueryBudgetViolations, normalizeSqlScrypt
+from services.sale import SaleApi
+from services.product import ProductApi
+
+def test_normalizeSqlScrypt():
+  assert normalizeSqlScrypt(' SELECT *  FROM tbl_sale\n  WHERE sale_id = %s; ') == 'SELECT * FROM tbl_sale WHERE sale_id = ?;'
+  assert normalizeSqlScrypt('SELECT * FROM tbl_sale WHERE sale_id = 12') == normalizeSqlScrypt('SELECT * FROM tbl_sale WHERE sale_id = 7')
+  assert normalizeSqlScrypt("UPDATE tbl_sale SET sale_status = 'Cancelado'") == 'UPDATE tbl_sale SET sale_status = ?'
+  assert normalizeSqlScrypt('SELECT * FROM tbl_sale_2') == 'SELECT * FROM tbl_sale_2'
+
+def test_violations_statement_count():
+  statements = [('SELECT 1', 'a.py:1 f'), ('SELECT * FROM tbl_sale', 'a.py:2 f'), ('SELECT * FROM tbl_client', 'a.py:3 f')]
+  assert getQueryBudgetViolations(statements, maxStatements=3) == []
+  assert getQueryBudgetViolations(statements, maxStatements=2) == ['3 statements for a budget of 2']
+
+def test_violations_repeated_statement():
+  statements = [('SELECT * FROM tbl_sale WHERE sale_id = %s', 'a.py:' + str(line) + ' f') for line in [1, 2, 2]]
+  assert getQueryBudgetViolations(statements, maxRepeats=3) == []
+  violations = getQueryBudgetViolations(statements, maxRepeats=2)
+  assert len(violations) == 1
+  assert violations[0].startswith('"SELECT * FROM tbl_sale WHERE sale_id = ?" ran 3 times for a budget of 2')
+  assert violations[0].endswith('called at a.py:1 f, a.py:2 f')
+
+def test_budget_too_many_statements(app, stubDb):
+  stubDb(lambda sqlScrypt, values: [{ 'id': 1 }])
+  with app.test_request_context('/'):
+    with pytest.raises(dbQueryBudgetExceeded, match='3 statements for a budget of 2'):
+      with queryBudget(maxStatements=2):
+        dbGetSingle(' SELECT * FROM tbl_sale WHERE sale_id = %s; ', [1])
+        dbGetSingle(' SELECT * FROM tbl_client WHERE client_id = %s; ', [1])
+        dbExecute(' UPDATE tbl_sale SET sale_status = %s WHERE sale_id = %s; ', ['Cancelado', 1])
+
+def test_budget_repeated_statement(app, stubDb):
+  stubDb(lambda sqlScrypt, values: [{ 'id': 1 }])
+  with app.test_request_context('/'):
+    with pytest.raises(dbQueryBudgetExceeded, match='ran 3 times for a budget of 2'):
+      with queryBudget(maxRepeats=2):
+        for saleId in [1, 2, 3]:
+          dbGetSingle(' SELECT * FROM tbl_sale WHERE sale_id = %s; ', [saleId])
+
+def test_budget_within_limits(app, stubDb):
+  stubDb(lambda sqlScrypt, values: [{ 'id': 1 }])
+  with app.test_request_context('/'):
+    with queryBudget(maxStatements=2, maxRepeats=1) as statements:
+      dbGetSingle(' SELECT * FROM tbl_sale WHERE sale_id = %s; ', [1])
+      dbGetSingle(' SELECT * FROM tbl_client WHERE client_id = %s; ', [1])
+    assert len(statements) == 2
+
+def test_budget_decorator_and_nesting(stubDb):
+  stubDb(lambda sqlScrypt, values: [{ 'id': 1 }])
+
+  @queryBudget(maxRepeats=1)
+  def getSales():
+    for saleId in [1, 2]:
+      dbGetSingle(' SELECT * FROM tbl_sale WHERE sale_id = %s; ', [saleId])
+
+  # outside a request as well, the inner budget fails first
+  with queryBudget(maxStatements=10) as statements:
+    with pytest.raises(dbQueryBudgetExceeded):
+      getSales()
+  assert len(statements) == 2
+
+def test_budget_logged_only(stubDb, capsys):
+  stubDb(lambda sqlScrypt, values: [{ 'id': 1 }])
+  with queryBudget(maxStatements=0, raiseOnExceed=False):
+    dbGetSingle(' SELECT 1; ')
+  assert '# Warning, query budget exceeded: 1 statements for a budget of 0' in capsys.readouterr().out
+
+def test_budget_keeps_handler_exception(stubDb):
+  stubDb(lambda sqlScrypt, values: [{ 'id': 1 }])
+  with pytest.raises(ZeroDivisionError):
+    with queryBudget(maxStatements=0):
+      dbGetSingle(' SELECT 1; ')
+      1 / 0
+
+class stubReferenceList():
+  def hasId(self, rowId):
+    return True
+
+# fixture rows, every select finds an active row
+saleRow = {
+  'client_id': 1, 'person_name': 'a', 'person_gender': 'F', 'user_type': 'admin', 'user_entry_allowed': 1, 'employee_active': 1, 'employee_id': 1,
+  'product_id': 1, 'is_product_active': 1, 'is_customized_product_active': 1, 'customized_product_price': 10, 'customized_product_quantity': 5,
+  'sale_id': 1, 'sale_status': 'Ativo'
+}
+
+def getSaleRows(sqlScrypt, values):
+  if 'DISTINCT shp.product_id' in sqlScrypt:
+    return [{ 'product_id': 1, 'customized_product_id': customizedProductId, 'sale_has_product_quantity': 1 } for customizedProductId in [1, 2, 3, 4]]
+  return [saleRow]
+
+salePutBody = {
+  'sale_client_id': 1,
+  'sale_employee_id': 1,
+  'sale_payment_method_installments': [{ 'id': 1, 'value': 40 }],
+  'sale_has_products': [
+    { 'product_id': 1, 'customized_products': [{ 'customized_product_id': 1, 'customized_product_sale_quantity': 1 }, { 'customized_product_id': 2, 'customized_product_sale_quantity': 1 }] },
+    { 'product_id': 2, 'customized_products': [{ 'customized_product_id': 3, 'customized_product_sale_quantity': 1 }, { 'customized_product_id': 4, 'customized_product_sale_quantity': 1 }] }
+  ],
+  'sale_total_discount_percentage': 0.0,
+  'sale_total_value': 40.0,
+  'force_product_addition': 'false'
+}
+
+# budgets of the handlers that loop over products and variations, for 2 products with 2 variations each
+# a variation runs each of its statements once, a new query inside the loops exceeds the budget
+
+def test_sale_put_budget(app, stubDb, monkeypatch):
+  stubDb(getSaleRows)
+  monkeypatch.setitem(utils.referenceData.referenceLists, 'payment_method_installments', stubReferenceList())
+  with app.test_request_context('/sale', method='PUT', json=salePutBody):
+    with queryBudget(maxStatements=21, maxRepeats=4):
+      assert SaleApi.put.__wrapped__(SaleApi()) == ({}, 201)
+
+def test_sale_delete_budget(app, stubDb):
+  stubDb(getSaleRows)
+  with app.test_request_context('/sale', method='DELETE', json={ 'sale_id': 1 }):
+    with queryBudget(maxStatements=11, maxRepeats=4):
+      assert SaleApi.delete.__wrapped__(SaleApi()) == ({}, 204)
+
+def getProductRows(sqlScrypt, values):
+  if 'SELECT * FROM tbl_product WHERE product_id = %s' in sqlScrypt:
+    return [{ 'product_id': 1, 'product_code': 'a', 'product_name': 'a', 'product_observations': None, 'is_product_immutable': 0, 'is_product_active': 1 }]
+  if 'SELECT pc.product_collection_id' in sqlScrypt:
+    return [{ 'product_collection_id': 1 }]
+  if 'SELECT pt.product_type_id' in sqlScrypt:
+    return [{ 'product_type_id': 1 }]
+  if 'JOIN tbl_customized_product cp' in sqlScrypt:
+    return [{ 'customized_product_id': sizeId, 'product_id': 1, 'product_color_id': None, 'product_other_id': None, 'product_size_id': sizeId,
+      'is_customized_product_immutable': 0, 'is_customized_product_active': 1 } for sizeId in [1, 2, 3, 4]]
+  return []
+
+productPatchBody = {
+  'product_id': 1,
+  'product_code': 'b',
+  'product_name': 'b',
+  'product_collection_ids': [2],
+  'product_type_ids': [2],
+  'customized_products': [{ 'product_price': 10, 'product_quantity': 1, 'product_size_id': sizeId } for sizeId in [1, 2, 5, 6]]
+}
+
+def test_product_patch_budget(app, stubDb, monkeypatch):
+  stubDb(getProductRows)
+  for listName in ['sizes', 'colors', 'others', 'collections', 'types']:
+    monkeypatch.setitem(utils.referenceData.referenceLists, listName, stubReferenceList())
+  with app.test_request_context('/product', method='PATCH', json=productPatchBody):
+    with queryBudget(maxStatements=17, maxRepeats=2):
+      assert ProductApi.patch.__wrapped__(ProductApi()) == ({}, 204)
+
+def test_handler_per_row_regression(app, stubDb, monkeypatch):
+  stubDb(getSaleRows)
+  monkeypatch.setitem(utils.referenceData.referenceLists, 'payment_method_installments', stubReferenceList())
+  with app.test_request_context('/sale', method='PUT', json=salePutBody):
+    # the variation select runs once per variation, a budget below it catches the loop
+    with pytest.raises(dbQueryBudgetExceeded, match='ran 4 times for a budget of 3'):
+      with queryBudget(maxRepeats=3):
+        SaleApi.put.__wrapped__(SaleApi())
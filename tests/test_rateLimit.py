@@ -0,0 +1,42 @@
+import pytest
+
+from utils.rateLimit import consumeBucket, createTokenBucketLimiter
+
+def test_bucket_burst_and_refill():
+  # capacity 3, one attempt each 2 seconds
+  tokens, updated = None, None
+  for now in [0, 0, 0]:
+    allowed, retryAfter, tokens = consumeBucket(tokens, updated, 3, 0.5, now)
+    updated = now
+    assert allowed and retryAfter == 0
+
+  allowed, retryAfter, tokens = consumeBucket(tokens, updated, 3, 0.5, 0)
+  assert not allowed
+  assert retryAfter == pytest.approx(2)
+
+  allowed, retryAfter, tokens = consumeBucket(tokens, 0, 3, 0.5, 1)
+  assert not allowed
+  assert retryAfter == pytest.approx(1)
+
+  allowed, retryAfter, tokens = consumeBucket(tokens, 1, 3, 0.5, 2)
+  assert allowed
+  assert tokens == pytest.approx(0)
+
+def test_bucket_capacity():
+  allowed, retryAfter, tokens = consumeBucket(0, 0, 3, 0.5, 1000)
+  assert allowed
+  assert tokens == pytest.approx(2)
+
+@pytest.mark.parametrize('backend', ['memory', 'shared'])
+def test_limiter(backend):
+  limiter = createTokenBucketLimiter(backend, 'test', 2, 0.001)
+  assert limiter.consume('a') == (True, 0)
+  assert limiter.consume('a') == (True, 0)
+  allowed, retryAfter = limiter.consume('a')
+  assert not allowed and retryAfter > 0
+  assert limiter.consume('b') == (True, 0)
+
+def test_limiter_disabled():
+  limiter = createTokenBucketLimiter('memory', 'test', 0, 1)
+  for attempt in range(5):
+    assert limiter.consume('a') == (True, 0)
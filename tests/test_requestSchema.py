@@ -0,0 +1,97 @@
+import json
+import pytest
+from flask import Flask
+from flask_restful import reqparse
+from werkzeug.exceptions import HTTPException
+
+from utils.requestSchema import requestSchema, requestArgument, requestListSchema, requestItemField, requestInt, requestFloat, isPositive
+from services.sale import saleCustomizedProductsSchema
+from services.product import productCustomizedProductsSchema
+
+app = Flask(__name__)
+
+arguments = [
+  dict(name='sale_client_id', location='json', type=int, help='sale client id, required', required=True),
+  dict(name='sale_description', location='json', type=str, help='sale description'),
+  dict(name='limit', location='args', type=int, help='query limit'),
+  dict(name='name', type=str, help='name')
+]
+
+schema = requestSchema([requestArgument(**argument) for argument in arguments])
+
+def getParser():
+  parser = reqparse.RequestParser()
+  for argument in arguments:
+    parser.add_argument(argument['name'], **dict([(key, value) for key, value in argument.items() if key != 'name']))
+  return parser
+
+# (result, status, error data) of a parse
+def runParse(parse):
+  try:
+    return (dict(parse()), 200, None)
+  except HTTPException as e:
+    return (None, e.code, getattr(e, 'data', None))
+
+@pytest.mark.parametrize('path, data, contentType', [
+  ('/', json.dumps({ 'sale_client_id': 1, 'sale_description': 'a' }), 'application/json'),
+  ('/?limit=10&limit=20&name=a&name=b', json.dumps({ 'sale_client_id': 1 }), 'application/json'),
+  ('/', json.dumps({}), 'application/json'),
+  ('/', json.dumps({ 'sale_client_id': None }), 'application/json'),
+  ('/', json.dumps({ 'sale_client_id': 'a' }), 'application/json'),
+  ('/?limit=a', json.dumps({ 'sale_client_id': 1 }), 'application/json'),
+  ('/', 'sale_client_id=1&name=a', 'application/x-www-form-urlencoded'),
+  ('/', 'not json', 'text/plain')
+])
+def test_parity_with_reqparse(path, data, contentType):
+  with app.test_request_context(path, method='POST', data=data, content_type=contentType):
+    assert runParse(schema.parse) == runParse(getParser().parse_args)
+
+def test_requestInt():
+  assert requestInt(2) == 2
+  assert requestInt(2.0) == 2
+  assert requestInt('3') == 3
+  for value in [2.5, True, False, 'a', '2.5']:
+    with pytest.raises(ValueError):
+      requestInt(value)
+  with pytest.raises(TypeError):
+    requestInt([])
+
+def test_requestFloat():
+  assert requestFloat(2) == 2.0
+  assert requestFloat('2.5') == 2.5
+  with pytest.raises(ValueError):
+    requestFloat(True)
+
+def test_list_schema_rejects_truncation():
+  for quantity in [2.5, True]:
+    items = [{ 'customized_product_id': 1, 'customized_product_sale_quantity': quantity }]
+    assert saleCustomizedProductsSchema.getInvalidMessage(items) == 'Um dos produtos customizaveis associados foi enviado sem o campo customized_product_sale_quantity'
+    assert items[0]['customized_product_sale_quantity'] == quantity
+
+def test_list_schema_converts_in_place():
+  items = [{ 'customized_product_id': '1', 'customized_product_sale_quantity': 2.0 }]
+  assert saleCustomizedProductsSchema.getInvalidMessage(items) == None
+  assert items == [{ 'customized_product_id': 1, 'customized_product_sale_quantity': 2 }]
+
+def test_list_schema_falsy_missing():
+  # quantity 0 is missing, as the falsy check the handlers had
+  items = [{ 'customized_product_id': 1, 'customized_product_sale_quantity': 0 }]
+  assert saleCustomizedProductsSchema.getInvalidMessage(items) == 'Um dos produtos customizaveis associados foi enviado sem o campo customized_product_sale_quantity'
+  items = [{ 'customized_product_id': 1, 'customized_product_sale_quantity': -1 }]
+  assert saleCustomizedProductsSchema.getInvalidMessage(items) == 'Um dos produtos associados possui quantidade de produtos a venda 0 ou menor'
+
+def test_list_schema_falsy_allowed():
+  quantitySchema = requestListSchema([
+    requestItemField('quantity', type=requestInt, falsyMissing=False, message='invalid quantity')
+  ], 'invalid item')
+  assert quantitySchema.getInvalidMessage([{ 'quantity': 0 }]) == None
+  assert quantitySchema.getInvalidMessage([{ 'quantity': None }]) == 'invalid quantity'
+  assert quantitySchema.getInvalidMessage([{}]) == 'invalid quantity'
+
+def test_list_schema_format():
+  assert saleCustomizedProductsSchema.getInvalidMessage([]) == 'Um dos produtos associados foi enviado sem produtos customizados'
+  assert saleCustomizedProductsSchema.getInvalidMessage({ 'a': 1 }) == 'Um dos produtos customizaveis associados está com formato inválido'
+  assert saleCustomizedProductsSchema.getInvalidMessage([1]) == 'Um dos produtos customizaveis associados está com formato inválido'
+  positiveSchema = requestListSchema([requestItemField('id', type=requestInt, check=isPositive, message='invalid id')], 'invalid item')
+  assert positiveSchema.getInvalidMessage([{ 'id': -1 }]) == 'invalid id'
+  assert productCustomizedProductsSchema.getInvalidMessage([{ 'product_price': 1, 'product_quantity': -1, 'product_size_id': 1 }]) == 'Quantidade do produto inválida para uma das variações'
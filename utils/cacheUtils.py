@@ -0,0 +1,131 @@
+from threading import Lock, Thread
+from time import monotonic
+from datetime import datetime, timezone
+from collections import OrderedDict
+
+# returned by get when the key is not cached or expired, None can be a cached value
+cacheMiss = object()
+
+# in process cache bounded by maxSize entries(least recently used are evicted) and by ttl seconds per entry
+class ttlLruCache():
+  def __init__(self, maxSize, ttl):
+    self.maxSize = maxSize
+    self.ttl = ttl
+    self.lock = Lock()
+    # key -> (value, expiration time)
+    self.entries = OrderedDict()
+
+    self.stats = {
+      'hits': 0,
+      'misses': 0,
+      'evictions': 0,
+      'expired': 0,
+      'invalidations': 0
+    }
+
+  def isEnabled(self):
+    return self.maxSize > 0 and self.ttl > 0
+
+  def get(self, key):
+
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry == None:
+        self.stats['misses'] += 1
+        return cacheMiss
+
+      if monotonic() >= entry[1]:
+        del self.entries[key]
+        self.stats['expired'] += 1
+        self.stats['misses'] += 1
+        return cacheMiss
+
+      self.entries.move_to_end(key)
+      self.stats['hits'] += 1
+      return entry[0]
+
+  # ttl overrides the cache ttl for this entry
+  def set(self, key, value, ttl=None):
+
+    if not self.isEnabled():
+      return
+
+    with self.lock:
+      self.entries[key] = (value, monotonic() + (ttl if ttl != None else self.ttl))
+      self.entries.move_to_end(key)
+
+      while len(self.entries) > self.maxSize:
+        self.entries.popitem(last=False)
+        self.stats['evictions'] += 1
+
+  def delete(self, key):
+    with self.lock:
+      if self.entries.pop(key, None) != None:
+        self.stats['invalidations'] += 1
+
+  # removes every entry whose key matches, used when the key is composed(like user id and date)
+  def deleteWhere(self, keyMatches):
+    with self.lock:
+      for key in [key for key in self.entries if keyMatches(key)]:
+        del self.entries[key]
+        self.stats['invalidations'] += 1
+
+  def clear(self):
+    with self.lock:
+      self.stats['invalidations'] += len(self.entries)
+      self.entries.clear()
+
+  def getStats(self):
+    with self.lock:
+      stats = dict(self.stats)
+      stats['size'] = len(self.entries)
+      stats['max_size'] = self.maxSize
+      stats['ttl'] = self.ttl
+      return stats
+
+# value served right away, reloaded by a background thread when older than maxAge seconds or when its version changes
+# only the first load, or every load when maxAge is 0, is done by the caller
+class staleWhileRevalidate():
+  def __init__(self, name, loadFunction, maxAge):
+    self.name = name
+    self.loadFunction = loadFunction
+    self.maxAge = maxAge
+    self.lock = Lock()
+    # (value, load monotonic time, load date time, version)
+    self.loaded = None
+    self.refreshing = False
+
+  # (value, utc date time it was loaded)
+  def get(self, version=None):
+
+    loaded = self.loaded
+    if loaded == None or self.maxAge <= 0:
+      loaded = self.load(version)
+    elif monotonic() - loaded[1] >= self.maxAge or loaded[3] != version:
+      self.startRefresh(version)
+
+    return (loaded[0], loaded[2])
+
+  def load(self, version):
+    loaded = (self.loadFunction(), monotonic(), datetime.now(timezone.utc).replace(microsecond=0), version)
+    self.loaded = loaded
+    return loaded
+
+  def startRefresh(self, version):
+
+    with self.lock:
+      if self.refreshing:
+        return
+      self.refreshing = True
+
+    Thread(target=self.refresh, args=(version,), daemon=True).start()
+
+  def refresh(self, version):
+    try:
+      self.load(version)
+    except Exception as e:
+      # the old value keeps being served, the next request tries again
+      print('# Failed to refresh ' + self.name + ': ' + str(e))
+    finally:
+      with self.lock:
+        self.refreshing = False
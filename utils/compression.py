@@ -0,0 +1,87 @@
+from flask import request
+import zlib
+import os
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+compressibleMimetypes = ('application/json', 'text/html', 'text/plain', 'text/csv')
+
+# same interface for gzip and brotli stream compressors
+class responseCompressor():
+  def __init__(self, encoding):
+    self.encoding = encoding
+    if encoding == 'br':
+      self.compressor = brotli.Compressor(quality=int(os.getenv('RESPONSE_COMPRESSION_BROTLI_QUALITY', '4')))
+    else:
+      # wbits 31 writes the gzip header and trailer
+      self.compressor = zlib.compressobj(int(os.getenv('RESPONSE_COMPRESSION_GZIP_LEVEL', '6')), zlib.DEFLATED, 31)
+
+  def compress(self, data):
+    if self.encoding == 'br':
+      return self.compressor.process(data)
+    return self.compressor.compress(data)
+
+  def finish(self):
+    if self.encoding == 'br':
+      return self.compressor.finish()
+    return self.compressor.flush()
+
+def getResponseEncoding():
+
+  encodings = ['br', 'gzip'] if brotli != None else ['gzip']
+  return request.accept_encodings.best_match(encodings)
+
+def compressStream(chunks, compressor):
+
+  for chunk in chunks:
+    if isinstance(chunk, str):
+      chunk = chunk.encode()
+    compressedChunk = compressor.compress(chunk)
+    if compressedChunk:
+      yield compressedChunk
+  yield compressor.finish()
+
+# compresses json and text responses when the client accepts gzip or brotli(when installed)
+# send_file responses(pdf reports) use direct passthrough and are not compressed
+def compressResponse(response):
+
+  if (response.direct_passthrough or response.status_code < 200 or response.status_code in (204, 304) or
+    request.method == 'HEAD' or 'Content-Encoding' in response.headers or response.mimetype not in compressibleMimetypes):
+    return response
+
+  # the body depends on the header even when this one is not compressed
+  response.vary.add('Accept-Encoding')
+
+  encoding = getResponseEncoding()
+  if not encoding:
+    return response
+
+  compressor = responseCompressor(encoding)
+
+  if response.is_streamed:
+    # chunks are compressed as they are produced, without a content length
+    response.response = compressStream(response.response, compressor)
+    response.headers.pop('Content-Length', None)
+  else:
+    responseData = response.get_data()
+    if len(responseData) < int(os.getenv('RESPONSE_COMPRESSION_MIN_SIZE', '1024')):
+      return response
+    response.set_data(compressor.compress(responseData) + compressor.finish())
+
+  response.headers['Content-Encoding'] = encoding
+
+  # a strong etag identifies the bytes sent, so each encoding has its own
+  etag, weak = response.get_etag()
+  if etag:
+    response.set_etag(etag + '-' + encoding, weak)
+
+  return response
+
+# RESPONSE_COMPRESSION false disables it, like when a proxy in front already compresses
+def registerResponseCompression(app):
+
+  if os.getenv('RESPONSE_COMPRESSION', 'true').lower() in ['true', '1']:
+    app.after_request(compressResponse)
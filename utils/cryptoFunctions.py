@@ -1,13 +1,17 @@
 from Crypto.PublicKey import RSA
+from cryptography.hazmat.primitives.serialization import load_pem_private_key, load_pem_public_key
 from pathlib import Path
 
 private_key = None
 public_key = None
+# parsed once, so jwt encode and decode do not parse the pem strings on every call
+private_key_obj = None
+public_key_obj = None
 
 # load or create and load keys
 def loadGenerateKeys():
 
-  global private_key, public_key
+  global private_key, public_key, private_key_obj, public_key_obj
 
   print('# Loading keys')
 
@@ -34,6 +38,9 @@ def loadGenerateKeys():
   private_key = open(privatek_path).read()
   public_key = open(publick_path).read()
 
+  private_key_obj = load_pem_private_key(private_key.encode(), password=None)
+  public_key_obj = load_pem_public_key(public_key.encode())
+
 def getPrivateK():
 
   global private_key
@@ -50,4 +57,22 @@ def getPublicK():
   if not public_key:
     loadGenerateKeys()
 
-  return public_key
\ No newline at end of file
+  return public_key
+
+def getPrivateKObj():
+
+  global private_key_obj
+
+  if not private_key_obj:
+    loadGenerateKeys()
+
+  return private_key_obj
+
+def getPublicKObj():
+
+  global public_key_obj
+
+  if not public_key_obj:
+    loadGenerateKeys()
+
+  return public_key_obj
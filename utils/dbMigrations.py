@@ -0,0 +1,112 @@
+from mysql import connector
+import traceback
+import os
+import re
+
+from utils.dbUtils import *
+
+# migrations are sql/migrations/<version>_<name>.sql files, applied once in version order
+migrationsDir = './sql/migrations'
+migrationFilePattern = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+# index or column already created by a migration interrupted before being registered
+dbMigrationIgnoredErrnos = (1060, 1061)
+
+def getMigrationFiles():
+
+  migrations = []
+  for fileName in os.listdir(migrationsDir):
+    fileMatch = migrationFilePattern.match(fileName)
+    if fileMatch:
+      migrations.append((int(fileMatch.group(1)), fileMatch.group(2), fileName))
+
+  return sorted(migrations)
+
+# splits a migration in its statements, removing -- comments
+def getMigrationStatements(fileName):
+
+  sqlScrypt = getSqlScrypt('migrations/' + fileName[:-len('.sql')])
+  sqlScrypt = '\n'.join([line for line in sqlScrypt.split('\n') if not line.strip().startswith('--')])
+  return [statement.strip() for statement in sqlScrypt.split(';') if statement.strip()]
+
+def dbCreateMigrationTable(dbObjectIns):
+
+  dbExecute(
+    ' CREATE TABLE IF NOT EXISTS tbl_schema_migration( '
+    '   migration_version INT NOT NULL, '
+    '   migration_name VARCHAR(100) NOT NULL, '
+    '   migration_date_time DATETIME DEFAULT NOW() NOT NULL, '
+    '   PRIMARY KEY (migration_version) '
+    ' ); ', None, True, dbObjectIns)
+
+def dbGetAppliedMigrations(dbObjectIns):
+
+  appliedQuery = dbGetAll(' SELECT migration_version FROM tbl_schema_migration; ', None, True, dbObjectIns)
+  return set([applied['migration_version'] for applied in appliedQuery])
+
+# applies pending migrations, a mysql named lock keeps gunicorn workers starting together from running them twice
+def dbRunMigrations():
+
+  migrations = getMigrationFiles()
+  dbObjectIns = startGetDbObject()
+  appliedCount = 0
+
+  try:
+    lockQuery = dbGetSingle(' SELECT GET_LOCK(\'schema_migration\', %s) AS migration_lock; ', [60], True, dbObjectIns)
+    if not lockQuery or lockQuery['migration_lock'] != 1:
+      raise Exception('Could not get the schema_migration lock')
+
+    try:
+      dbCreateMigrationTable(dbObjectIns)
+      appliedMigrations = dbGetAppliedMigrations(dbObjectIns)
+
+      for version, name, fileName in migrations:
+        if version in appliedMigrations:
+          continue
+
+        print('# Applying migration ' + fileName)
+        for statement in getMigrationStatements(fileName):
+          try:
+            dbExecute(statement, None, True, dbObjectIns)
+          except connector.Error as e:
+            if e.errno not in dbMigrationIgnoredErrnos:
+              raise
+            print('\tAlready applied, skipping: ' + str(e))
+
+        dbExecute(
+          ' INSERT INTO tbl_schema_migration (migration_version, migration_name) VALUES (%s, %s); ',
+          [version, name], True, dbObjectIns)
+        # ddl statements are commited by mysql itself, this commits the registration
+        dbObjectIns.dbConnection.commit()
+        appliedCount += 1
+
+    finally:
+      # a failed release must not hide the migration error, the lock also ends with the connection
+      try:
+        dbGetSingle(' SELECT RELEASE_LOCK(\'schema_migration\') AS migration_lock; ', None, True, dbObjectIns)
+      except Exception as e:
+        print('# Error releasing the schema_migration lock: ' + str(e))
+
+  except Exception as e:
+    dbRollback(dbObjectIns)
+    print('# Error applying migrations: ' + str(e))
+    traceback.print_exc()
+    return False
+
+  dbCommit(dbObjectIns)
+  print('# Migrations up to date, ' + str(appliedCount) + ' applied')
+  return True
+
+# versions and names of each migration file and if it was applied
+def dbGetMigrationsStatus():
+
+  dbObjectIns = startGetDbObject()
+  try:
+    dbCreateMigrationTable(dbObjectIns)
+    appliedMigrations = dbGetAppliedMigrations(dbObjectIns)
+  except Exception:
+    dbRollback(dbObjectIns)
+    raise
+  dbCommit(dbObjectIns)
+
+  return [(version, name, version in appliedMigrations) for version, name, fileName in getMigrationFiles()]
@@ -0,0 +1,195 @@
+from mysql import connector
+from mysql.connector import errors
+from threading import Condition, Lock
+from time import monotonic
+from collections import deque
+import os
+
+from utils.dbStatementCache import dbStatementCache
+
+# pooled engine used by utils/dbUtils, one instance per process(gunicorn worker)
+class dbConnectionPool():
+  def __init__(self, connectionArgs, poolSize=5, maxOverflow=10, idleTimeout=300, prePing=True, checkoutTimeout=30, statementCacheSize=0):
+    self.connectionArgs = connectionArgs
+    self.poolSize = poolSize
+    self.maxOverflow = maxOverflow
+    self.idleTimeout = idleTimeout
+    self.prePing = prePing
+    self.checkoutTimeout = checkoutTimeout
+    # prepared statements kept per connection, 0 disables them
+    self.statementCacheSize = statementCacheSize
+
+    self.condition = Condition()
+    self.pid = os.getpid()
+    # idle connections as (connection, last release time), most recent at the right
+    self.idleConnections = deque()
+    self.checkedOut = 0
+
+    self.stats = {
+      'created': 0,
+      'closed': 0,
+      'checkouts': 0,
+      'waits': 0,
+      'wait_time_ms': 0.0,
+      'timeouts': 0,
+      'reconnects': 0,
+      'idle_expired': 0,
+      'leaked': 0
+    }
+    # updated by connections in use, outside the pool condition
+    self.statementStatsLock = Lock()
+    self.statementStats = {
+      'hits': 0,
+      'misses': 0,
+      'evictions': 0
+    }
+
+  def createConnection(self):
+    dbConnection = connector.connect(**self.connectionArgs)
+    if self.statementCacheSize > 0:
+      dbConnection.dbStatementCache = dbStatementCache(dbConnection, self.statementCacheSize, self.countStatement)
+    self.countPoolStat('created')
+    return dbConnection
+
+  def closeConnection(self, dbConnection):
+    self.countPoolStat('closed')
+    try:
+      dbConnection.close()
+    except errors.Error:
+      pass
+
+  # after a fork the parent sockets can not be used, forgets them without sending COM_QUIT
+  def checkForkedProcess(self):
+    if self.pid != os.getpid():
+      self.pid = os.getpid()
+      self.idleConnections = deque()
+      self.checkedOut = 0
+
+  # gets a connection, waiting up to checkoutTimeout when size plus overflow is exhausted
+  def getConnection(self):
+
+    dbConnection = None
+    lastUsed = None
+
+    with self.condition:
+      self.checkForkedProcess()
+
+      waitStart = None
+      while not self.idleConnections and self.checkedOut >= self.poolSize + self.maxOverflow:
+        if waitStart == None:
+          waitStart = monotonic()
+          self.stats['waits'] += 1
+
+        remaining = self.checkoutTimeout - (monotonic() - waitStart)
+        if remaining <= 0:
+          self.stats['timeouts'] += 1
+          raise errors.PoolError('Connection pool exhausted, no connection released in ' + str(self.checkoutTimeout) + ' seconds')
+        self.condition.wait(remaining)
+
+      if waitStart != None:
+        self.stats['wait_time_ms'] += (monotonic() - waitStart) * 1000
+
+      if self.idleConnections:
+        dbConnection, lastUsed = self.idleConnections.pop()
+
+      self.checkedOut += 1
+      self.stats['checkouts'] += 1
+
+    # connection creation and pings are done outside the lock
+    try:
+      if dbConnection != None and monotonic() - lastUsed > self.idleTimeout:
+        self.countPoolStat('idle_expired')
+        self.closeConnection(dbConnection)
+        dbConnection = None
+
+      if dbConnection != None and self.prePing:
+        dbConnection = self.pingConnection(dbConnection)
+
+      if dbConnection == None:
+        dbConnection = self.createConnection()
+
+    except Exception:
+      with self.condition:
+        self.checkedOut -= 1
+        self.condition.notify()
+      raise
+
+    return dbConnection
+
+  # checks if the connection is alive, reconnecting it when the server has gone away
+  def pingConnection(self, dbConnection):
+    try:
+      dbConnection.ping(reconnect=False)
+      return dbConnection
+    except errors.Error:
+      self.countPoolStat('reconnects')
+      self.closeConnection(dbConnection)
+      return None
+
+  # returns a connection to the pool, overflow connections and discarded ones are closed
+  def releaseConnection(self, dbConnection, discard=False):
+
+    if not discard:
+      try:
+        if dbConnection.unread_result:
+          dbConnection.consume_results()
+        if dbConnection.in_transaction:
+          dbConnection.rollback()
+      except errors.Error:
+        discard = True
+
+    with self.condition:
+      # connection from the parent process after a fork, only forgets it
+      if self.pid != os.getpid():
+        self.checkForkedProcess()
+        return
+
+      self.checkedOut = max(self.checkedOut - 1, 0)
+
+      if not discard and len(self.idleConnections) < self.poolSize:
+        self.idleConnections.append((dbConnection, monotonic()))
+        dbConnection = None
+
+      self.condition.notify()
+
+    if dbConnection != None:
+      self.closeConnection(dbConnection)
+
+  # counters updated outside getConnection and releaseConnection critical sections
+  def countPoolStat(self, name):
+    with self.condition:
+      self.stats[name] += 1
+
+  # connections not released by their owner, found on request teardown
+  def countLeak(self):
+    self.countPoolStat('leaked')
+
+  def countStatement(self, name):
+    with self.statementStatsLock:
+      self.statementStats[name] += 1
+
+  def getStats(self):
+    with self.statementStatsLock:
+      statementStats = dict(self.statementStats)
+
+    with self.condition:
+      stats = dict(self.stats)
+      stats['statement_cache_size'] = self.statementCacheSize
+      stats['statement_hits'] = statementStats['hits']
+      stats['statement_misses'] = statementStats['misses']
+      stats['statement_evictions'] = statementStats['evictions']
+      stats['pool_size'] = self.poolSize
+      stats['max_overflow'] = self.maxOverflow
+      stats['idle'] = len(self.idleConnections)
+      stats['checked_out'] = self.checkedOut
+      stats['overflow'] = max(self.checkedOut + len(self.idleConnections) - self.poolSize, 0)
+      return stats
+
+  # closes every idle connection, checked out ones are closed when released
+  def dispose(self):
+    with self.condition:
+      idleConnections = self.idleConnections
+      self.idleConnections = deque()
+
+    for dbConnection, lastUsed in idleConnections:
+      self.closeConnection(dbConnection)
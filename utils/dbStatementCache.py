@@ -0,0 +1,60 @@
+from mysql.connector import errors
+from collections import OrderedDict
+
+# server side prepared statements of one pooled connection, keyed by the sql text
+# the least recently used statement is deallocated when maxSize is exceeded
+class dbStatementCache():
+  def __init__(self, dbConnection, maxSize, countStatement):
+    self.dbConnection = dbConnection
+    self.maxSize = maxSize
+    # pool callback receiving 'hits', 'misses' or 'evictions'
+    self.countStatement = countStatement
+    # sql text -> (sql text object given to the cursor, prepared cursor)
+    self.statements = OrderedDict()
+
+  # the cursor only skips the prepare when it receives the same sql object used before
+  def getStatement(self, sqlScrypt):
+
+    statement = self.statements.get(sqlScrypt)
+    if statement != None:
+      self.statements.move_to_end(sqlScrypt)
+      self.countStatement('hits')
+      return statement
+
+    self.countStatement('misses')
+    statement = (sqlScrypt, self.dbConnection.cursor(prepared=True, dictionary=True))
+    self.statements[sqlScrypt] = statement
+
+    while len(self.statements) > self.maxSize:
+      evictedSql, evictedStatement = self.statements.popitem(last=False)
+      self.countStatement('evictions')
+      self.closeCursor(evictedStatement[1])
+
+    return statement
+
+  # executes and returns the prepared cursor, its rows must be fully fetched before the next statement
+  def execute(self, sqlScrypt, values, many=False):
+
+    statementSql, dbCursor = self.getStatement(sqlScrypt)
+    try:
+      if many:
+        dbCursor.executemany(statementSql, values)
+      else:
+        dbCursor.execute(statementSql, values)
+    except Exception:
+      # failed statements are prepared again on the next use
+      self.discard(sqlScrypt)
+      raise
+
+    return dbCursor
+
+  def discard(self, sqlScrypt):
+    statement = self.statements.pop(sqlScrypt, None)
+    if statement != None:
+      self.closeCursor(statement[1])
+
+  def closeCursor(self, dbCursor):
+    try:
+      dbCursor.close()
+    except errors.Error:
+      pass
@@ -1,6 +1,31 @@
+from flask import g, has_app_context, has_request_context, request
 from mysql import connector
+from threading import Lock, local
+from contextlib import contextmanager, ContextDecorator
+from functools import wraps
+from time import sleep, perf_counter, time
+from datetime import date
+from decimal import Decimal
+from functools import lru_cache
+import random
+import json
+import re
+import sys
 import os
 
+from utils.dbPool import dbConnectionPool
+from utils.sharedState import getSharedStateDb
+from utils.cacheUtils import ttlLruCache, cacheMiss
+
+globalDbPool = None
+globalDbReplicaPool = None
+globalDbPoolLock = Lock()
+globalUserWriteStore = None
+# active transaction of threads running outside a flask context, like the patches scripts
+globalDbThreadScope = local()
+globalTableVersionStore = None
+globalDbResultCache = None
+
 def dbCheckCreateMySqlSchemaTables():
 
   dbConnection = connector.connect(
@@ -36,19 +61,262 @@ def dbCheckCreateMySqlSchemaTables():
   dbCursor.close()
   dbConnection.close()
 
-def startGetDbObject():
+# the replica connection variables(SQL_REPLICA_HOST, ...) default to the primary ones
+def createDbPool(envPrefix):
 
-  dbConnection = connector.connect(
-    host = os.getenv('SQL_HOST'),
-    port = os.getenv('SQL_PORT'),
-    user = os.getenv('SQL_USER'),
-    passwd = os.getenv('SQL_PASSWORD'),
-    database = os.getenv('SQL_SCHEMA'),
-    auth_plugin = 'mysql_native_password')
+  return dbConnectionPool(
+    {
+      'host': os.getenv(envPrefix + 'HOST', os.getenv('SQL_HOST')),
+      'port': os.getenv(envPrefix + 'PORT', os.getenv('SQL_PORT')),
+      'user': os.getenv(envPrefix + 'USER', os.getenv('SQL_USER')),
+      'passwd': os.getenv(envPrefix + 'PASSWORD', os.getenv('SQL_PASSWORD')),
+      'database': os.getenv(envPrefix + 'SCHEMA', os.getenv('SQL_SCHEMA')),
+      'auth_plugin': 'mysql_native_password'
+    },
+    poolSize = int(os.getenv('SQL_POOL_SIZE', '5')),
+    maxOverflow = int(os.getenv('SQL_POOL_MAX_OVERFLOW', '10')),
+    idleTimeout = float(os.getenv('SQL_POOL_IDLE_TIMEOUT', '300')),
+    prePing = os.getenv('SQL_POOL_PRE_PING', 'true').lower() in ['true', '1'],
+    checkoutTimeout = float(os.getenv('SQL_POOL_TIMEOUT', '30')),
+    statementCacheSize = int(os.getenv('SQL_STATEMENT_CACHE_SIZE', '64')))
 
-  dbCursor = dbConnection.cursor(buffered=True, dictionary=True)
+def getDbPool():
+
+  global globalDbPool
+
+  if globalDbPool == None:
+    with globalDbPoolLock:
+      if globalDbPool == None:
+        globalDbPool = createDbPool('SQL_')
+
+  return globalDbPool
+
+# None when SQL_REPLICA_HOST is not set, every read then goes to the primary
+def getDbReplicaPool():
+
+  global globalDbReplicaPool
+
+  if globalDbReplicaPool == None and os.getenv('SQL_REPLICA_HOST'):
+    with globalDbPoolLock:
+      if globalDbReplicaPool == None:
+        globalDbReplicaPool = createDbPool('SQL_REPLICA_')
+
+  return globalDbReplicaPool
+
+# pool and prepared statement cache statistics, used to size SQL_POOL_SIZE, SQL_POOL_MAX_OVERFLOW and SQL_STATEMENT_CACHE_SIZE per gunicorn worker
+def getDbPoolStats(replica=False):
+
+  dbPool = getDbReplicaPool() if replica else getDbPool()
+  if dbPool == None:
+    return None
+  return dbPool.getStats()
+
+# buffered=False gives an unbuffered cursor, its rows must be read before the next statement
+def startGetDbObject(buffered=True, replica=False, dictionary=True):
+
+  dbPool = getDbReplicaPool() if replica else getDbPool()
+  dbConnection = dbPool.getConnection()
+
+  try:
+    dbCursor = dbConnection.cursor(buffered=buffered, dictionary=dictionary)
+  except Exception:
+    dbPool.releaseConnection(dbConnection, discard=True)
+    raise
+
+  dbObjectIns = dbObject(dbConnection, dbCursor, True, dbPool)
+  dbObjectIns.dbOpenedAt = getDbCallerLocation()
+
+  # connections opened during a request are accounted to be checked on its teardown
+  if has_app_context():
+    if 'dbOpenedObjects' not in g:
+      g.dbOpenedObjects = []
+    g.dbOpenedObjects.append(dbObjectIns)
+
+  return dbObjectIns
+
+# returns file:line of the first caller outside this module
+def getDbCallerLocation():
+
+  frame = sys._getframe(1)
+  while frame and frame.f_code.co_filename == __file__:
+    frame = frame.f_back
+
+  if not frame:
+    return 'unknown'
+  return os.path.relpath(frame.f_code.co_filename) + ':' + str(frame.f_lineno) + ' ' + frame.f_code.co_name
+
+# one connection per flask request(and one to the replica), reused by every helper outside a transaction and released on teardown
+def getRequestDbObject(replica=False):
+
+  if not has_app_context():
+    return None
+
+  requestKey = 'dbReplicaObjectIns' if replica else 'dbObjectIns'
+  dbObjectIns = g.get(requestKey)
+  if dbObjectIns == None or dbObjectIns.dbClosed:
+    dbObjectIns = startGetDbObject(replica=replica)
+    setattr(g, requestKey, dbObjectIns)
+
+  return dbObjectIns
+
+def dbTeardownAppContext(exception=None):
+
+  for requestKey in ['dbObjectIns', 'dbReplicaObjectIns']:
+    dbObjectIns = g.pop(requestKey, None)
+    if dbObjectIns != None and not dbObjectIns.dbClosed:
+      dbObjectIns.dbTransactionDone = True
+      closeDbObject(dbObjectIns)
+
+  # any other connection still open here was leaked by the request, the pending transaction is rolled back
+  for dbOpenedObject in g.pop('dbOpenedObjects', []):
+    if not dbOpenedObject.dbClosed:
+      print('# Warning, database connection opened at ' + dbOpenedObject.dbOpenedAt + ' still open at request teardown, rolling back and releasing it')
+      dbOpenedObject.dbPool.countLeak()
+      dbRollback(dbOpenedObject)
+
+# collapses whitespace and literals so the same statement with other values is aggregated together
+@lru_cache(maxsize=512)
+def normalizeSqlScrypt(sqlScrypt):
+
+  sqlScrypt = re.sub(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"", '?', sqlScrypt)
+  sqlScrypt = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sqlScrypt)
+  sqlScrypt = re.sub(r'%s', '?', sqlScrypt)
+  return re.sub(r'\s+', ' ', sqlScrypt).strip()
+
+# statements run by the dbUtils helpers during a request, aggregated on its end
+def recordDbStatement(sqlScrypt, startTime, rowCount):
+
+  queryBudgets = getattr(globalDbThreadScope, 'dbQueryBudgets', None)
+  if not queryBudgets and not has_app_context():
+    return
+
+  durationMs = (perf_counter() - startTime) * 1000
+  caller = getDbCallerLocation()
+
+  if queryBudgets:
+    for budgetStatements in queryBudgets:
+      budgetStatements.append((sqlScrypt, caller))
+
+  if has_app_context():
+    if 'dbStatements' not in g:
+      g.dbStatements = []
+    g.dbStatements.append((sqlScrypt, durationMs, rowCount, caller))
+
+class dbQueryBudgetExceeded(Exception):
+  pass
+
+# statements given as (sql, caller), returns a description of each budget exceeded
+def getQueryBudgetViolations(statements, maxStatements=None, maxRepeats=None):
+
+  violations = []
+
+  if maxStatements != None and len(statements) > maxStatements:
+    violations.append(str(len(statements)) + ' statements for a budget of ' + str(maxStatements))
+
+  if maxRepeats != None:
+    repeatedStatements = {}
+    for sqlScrypt, caller in statements:
+      repeatedStatements.setdefault(normalizeSqlScrypt(sqlScrypt), []).append(caller)
+
+    for normalizedSql, callers in repeatedStatements.items():
+      if len(callers) > maxRepeats:
+        violations.append('"' + normalizedSql + '" ran ' + str(len(callers)) + ' times for a budget of ' + str(maxRepeats) + 
+          ', called at ' + ', '.join(sorted(set(callers))))
+
+  return violations
+
+# with queryBudget(maxStatements=10, maxRepeats=2): or @queryBudget(...), used in tests to catch queries run in per row loops
+# raises dbQueryBudgetExceeded when the block runs more than maxStatements or the same normalized statement more than maxRepeats times
+class queryBudget(ContextDecorator):
+  def __init__(self, maxStatements=None, maxRepeats=None, raiseOnExceed=True):
+    self.maxStatements = maxStatements
+    self.maxRepeats = maxRepeats
+    # when False the violations are only logged, for staging
+    self.raiseOnExceed = raiseOnExceed
+
+  # the statements are kept per thread, so a decorated handler can run in many threads at once
+  def __enter__(self):
+    if getattr(globalDbThreadScope, 'dbQueryBudgets', None) == None:
+      globalDbThreadScope.dbQueryBudgets = []
+    statements = []
+    globalDbThreadScope.dbQueryBudgets.append(statements)
+    return statements
+
+  def __exit__(self, excType, excValue, traceback):
+    statements = globalDbThreadScope.dbQueryBudgets.pop()
+    if excType != None:
+      return False
+
+    violations = getQueryBudgetViolations(statements, self.maxStatements, self.maxRepeats)
+    if violations:
+      if self.raiseOnExceed:
+        raise dbQueryBudgetExceeded('Query budget exceeded: ' + '; '.join(violations))
+      print('# Warning, query budget exceeded: ' + '; '.join(violations))
+    return False
+
+def getRequestDbStatementsSummary():
+
+  statements = {}
+  totalDurationMs = 0
+
+  for sqlScrypt, durationMs, rowCount, caller in g.get('dbStatements', []):
+    totalDurationMs += durationMs
+    normalizedSql = normalizeSqlScrypt(sqlScrypt)
+    statement = statements.get(normalizedSql)
+    if statement == None:
+      statement = { 'statement': normalizedSql, 'count': 0, 'duration_ms': 0, 'rows': 0, 'callers': [] }
+      statements[normalizedSql] = statement
+
+    statement['count'] += 1
+    statement['duration_ms'] += durationMs
+    statement['rows'] += max(rowCount, 0)
+    if caller not in statement['callers']:
+      statement['callers'].append(caller)
+
+  statements = sorted(statements.values(), key=lambda statement: statement['duration_ms'], reverse=True)
+  for statement in statements:
+    statement['duration_ms'] = round(statement['duration_ms'], 3)
+
+  return {
+    'count': len(g.get('dbStatements', [])),
+    'duration_ms': round(totalDurationMs, 3),
+    'statements': statements
+  }
 
-  return dbObject(dbConnection, dbCursor, True)
+# exposes the request database time as Server-Timing when SQL_SERVER_TIMING is set, not meant for production clients
+# the detailed statements go to a log line when SYS_DEBUG is set
+def dbAfterRequest(response):
+
+  summary = getRequestDbStatementsSummary()
+  if os.getenv('SQL_SERVER_TIMING', '').lower() in ['true', '1']:
+    response.headers.add('Server-Timing', 'db;dur=' + str(summary['duration_ms']) + ';desc="' + str(summary['count']) + ' queries"')
+
+  if os.getenv('SYS_DEBUG', '').lower() in ['true', '1']:
+    print(json.dumps({
+      'method': request.method,
+      'path': request.path,
+      'status': response.status_code,
+      'db_queries': summary['count'],
+      'db_duration_ms': summary['duration_ms'],
+      'db_statements': summary['statements']
+    }))
+
+  # request wide budget for staging, only logged
+  maxStatements = os.getenv('SQL_QUERY_BUDGET_STATEMENTS')
+  maxRepeats = os.getenv('SQL_QUERY_BUDGET_REPEATS')
+  if maxStatements or maxRepeats:
+    violations = getQueryBudgetViolations(
+      [(sqlScrypt, caller) for sqlScrypt, durationMs, rowCount, caller in g.get('dbStatements', [])],
+      int(maxStatements) if maxStatements else None,
+      int(maxRepeats) if maxRepeats else None)
+    if violations:
+      print('# Warning, query budget exceeded on ' + request.method + ' ' + request.path + ': ' + '; '.join(violations))
+
+  return response
+
+def registerDbRequestLifecycle(app):
+  app.after_request(dbAfterRequest)
+  app.teardown_appcontext(dbTeardownAppContext)
 
 def closeDbObject(dbObjectIns):
 
@@ -60,8 +328,16 @@ def closeDbObject(dbObjectIns):
     print("# Warning, closing connection withot a commit or rollback, forced a commit to close the connection")
     dbObjectIns.dbConnection.commit()
 
-  dbObjectIns.dbCursor.close()
-  dbObjectIns.dbConnection.close()
+  try:
+    dbObjectIns.dbCursor.close()
+  except connector.Error:
+    dbObjectIns.dbDiscard = True
+
+  if dbObjectIns.dbPool != None:
+    dbObjectIns.dbPool.releaseConnection(dbObjectIns.dbConnection, discard=dbObjectIns.dbDiscard)
+  else:
+    dbObjectIns.dbConnection.close()
+  dbObjectIns.dbClosed = True
 
 def dbRollback(dbObjectIns):
 
@@ -70,7 +346,12 @@ def dbRollback(dbObjectIns):
     return
   
   dbObjectIns.dbTransactionDone = True
-  dbObjectIns.dbConnection.rollback()
+  try:
+    dbObjectIns.dbConnection.rollback()
+  except connector.Error as e:
+    # a connection that can not rollback is not returned to the pool
+    print('# Failed to rollback, discarding connection: ' + str(e))
+    dbObjectIns.dbDiscard = True
   closeDbObject(dbObjectIns)
 
 def dbCommit(dbObjectIns):
@@ -80,98 +361,676 @@ def dbCommit(dbObjectIns):
     return
   
   dbObjectIns.dbTransactionDone = True
-  dbObjectIns.dbConnection.commit()
+  try:
+    dbObjectIns.dbConnection.commit()
+  except Exception:
+    dbObjectIns.dbDiscard = True
+    closeDbObject(dbObjectIns)
+    raise
   closeDbObject(dbObjectIns)
+  bumpTableVersions(dbObjectIns.dbWrittenTables)
 
-def dbExecute(sqlScrypt, values=None, transactionMode=False, dbObjectIns=None):
+def getCurrentTransaction():
 
-  if transactionMode:
-    if not dbObjectIns:
-      print('# Error during transaction, db instance cannot be null')
-      return
-    elif not isinstance(dbObjectIns, dbObject):
-      print("# Error during transaction, db instance not a db class object")
-      return
-    dbObjectIns.dbTransactionDone = False
-    
-  if not transactionMode:
-    dbObjectIns = startGetDbObject()
-    dbObjectIns.dbConnection.commit()
-      
-  if values != None:
+  if has_app_context():
+    return g.get('dbTransaction')
+  return getattr(globalDbThreadScope, 'dbTransaction', None)
+
+def setCurrentTransaction(dbObjectIns):
+
+  if has_app_context():
+    g.dbTransaction = dbObjectIns
+  else:
+    globalDbThreadScope.dbTransaction = dbObjectIns
+
+# with transaction() as tx: every dbUtils helper called inside the block joins the transaction
+# nested blocks use savepoints, so an exception only undoes the inner block
+@contextmanager
+def transaction():
+
+  currentTransaction = getCurrentTransaction()
+
+  if currentTransaction != None:
+    currentTransaction.dbSavepointDepth += 1
+    savepointName = 'sp_' + str(currentTransaction.dbSavepointDepth)
+    try:
+      dbCursorExecute(currentTransaction, 'SAVEPOINT ' + savepointName, None)
+      try:
+        yield currentTransaction
+      except BaseException:
+        try:
+          dbCursorExecute(currentTransaction, 'ROLLBACK TO SAVEPOINT ' + savepointName, None)
+        except connector.Error:
+          # a deadlock rolls back the whole transaction and its savepoints, the outer block handles it
+          pass
+        raise
+      dbCursorExecute(currentTransaction, 'RELEASE SAVEPOINT ' + savepointName, None)
+    finally:
+      currentTransaction.dbSavepointDepth -= 1
+    return
+
+  dbObjectIns = startGetDbObject()
+  dbObjectIns.dbTransactionDone = False
+  setCurrentTransaction(dbObjectIns)
+  try:
+    yield dbObjectIns
+  except BaseException:
+    setCurrentTransaction(None)
+    dbRollback(dbObjectIns)
+    raise
+  setCurrentTransaction(None)
+  dbCommit(dbObjectIns)
+  markDbWrite()
+
+# deadlock and lock wait timeout, both safe to retry in a new transaction
+dbRetryTransactionErrnos = (1213, 1205)
+
+# runs the decorated function inside transaction(), retrying it on deadlock or lock wait timeout with bounded backoff
+# when called inside another transaction the error is raised so the outermost one is retried
+def retryTransaction(maxAttempts=None, baseDelay=None, maxDelay=None):
+
+  def decorator(function):
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+
+      attempts = maxAttempts if maxAttempts != None else int(os.getenv('SQL_TRANSACTION_RETRIES', '3'))
+      firstDelay = baseDelay if baseDelay != None else float(os.getenv('SQL_TRANSACTION_RETRY_DELAY', '0.05'))
+      lastDelay = maxDelay if maxDelay != None else float(os.getenv('SQL_TRANSACTION_RETRY_MAX_DELAY', '1'))
+
+      attempt = 1
+      while True:
+        try:
+          with transaction():
+            return function(*args, **kwargs)
+        except connector.Error as e:
+          if e.errno not in dbRetryTransactionErrnos or attempt >= attempts or getCurrentTransaction() != None:
+            raise
+
+          delay = min(firstDelay * 2 ** (attempt - 1), lastDelay) * random.uniform(0.5, 1)
+          print('# Transaction ' + function.__name__ + ' failed with error ' + str(e.errno) + ', retry ' + str(attempt) + ' in ' + '{:.3f}'.format(delay) + 's')
+          sleep(delay)
+          attempt += 1
+
+    return wrapper
+
+  return decorator
+
+# mysql client errors for a connection closed by the server(gone away, lost during query, lost connection)
+dbLostConnectionErrnos = (2006, 2013, 2055)
+
+def isDbConnectionLost(e):
+  return isinstance(e, connector.Error) and e.errno in dbLostConnectionErrnos
+
+# the user of the request, set after its authentication, used to send their reads to the primary after a write
+def setDbRequestUser(userId):
+  if has_app_context():
+    g.dbUserId = userId
+
+def getReadYourWritesWindow():
+  return float(os.getenv('SQL_REPLICA_READ_YOUR_WRITES', '5'))
+
+# last write time of each user in the sqlite file shared by the workers of the node
+# their reads go to the primary during SQL_REPLICA_READ_YOUR_WRITES seconds after it, whatever worker serves them
+class sharedUserWriteStore():
+  def __init__(self):
+    self.writeCount = 0
+
+    getSharedStateDb().execute(
+      ' CREATE TABLE IF NOT EXISTS tbl_user_write( '
+      '   user_id TEXT NOT NULL PRIMARY KEY, '
+      '   write_time REAL NOT NULL '
+      ' ); ')
+
+  def setWriteTime(self, userId, writeTime):
+
+    getSharedStateDb().execute(
+      ' INSERT INTO tbl_user_write (user_id, write_time) VALUES (?, ?) '
+      ' ON CONFLICT(user_id) DO UPDATE SET write_time = excluded.write_time; ',
+      [str(userId), writeTime])
+
+    # forgets writes older than the window
+    self.writeCount += 1
+    if self.writeCount % 1000 == 0:
+      getSharedStateDb().execute('DELETE FROM tbl_user_write WHERE write_time < ?; ', [writeTime - getReadYourWritesWindow()])
+
+  def getWriteTime(self, userId):
+    writeRow = getSharedStateDb().execute('SELECT write_time FROM tbl_user_write WHERE user_id = ?; ', [str(userId)]).fetchone()
+    return writeRow[0] if writeRow else None
+
+def getUserWriteStore():
+
+  global globalUserWriteStore
+
+  if globalUserWriteStore == None:
+    globalUserWriteStore = sharedUserWriteStore()
+  return globalUserWriteStore
+
+def markDbWrite():
+
+  if not has_app_context():
+    return
+
+  g.dbWrote = True
+  userId = g.get('dbUserId')
+  # without a replica every read already goes to the primary
+  if userId == None or getDbReplicaPool() == None:
+    return
+
+  try:
+    getUserWriteStore().setWriteTime(userId, time())
+  except Exception as e:
+    # the write is already commited, the next requests of the user may read the replica before it has the write
+    print('# Failed to record the write of user ' + str(userId) + ': ' + str(e))
+
+def hasRecentDbWrite():
+
+  if g.get('dbWrote'):
+    return True
+
+  userId = g.get('dbUserId')
+  if userId == None:
+    return False
+
+  # read once per request, the writes of the request itself set dbWrote
+  if 'dbUserWriteTime' not in g:
+    try:
+      g.dbUserWriteTime = getUserWriteStore().getWriteTime(userId)
+    except Exception as e:
+      print('# Failed to read the last write of user ' + str(userId) + ', reading from the primary: ' + str(e))
+      return True
+
+  writeTime = g.dbUserWriteTime
+  return writeTime != None and time() - writeTime < getReadYourWritesWindow()
+
+# useReplica None routes reads of GET requests to the replica, except after a recent write of the same user
+# True or False forces the replica or the primary, without a replica configured everything goes to the primary
+def isDbReplicaRead(useReplica=None):
+
+  if useReplica == False or getDbReplicaPool() == None:
+    return False
+  if useReplica == True:
+    return True
+
+  if not has_request_context() or request.method not in ['GET', 'HEAD']:
+    return False
+  return not hasRecentDbWrite()
+
+# connection errors that make a replica read be done in the primary
+dbReplicaFallbackErrnos = (2002, 2003, 2005) + dbLostConnectionErrnos
+
+def dbRunRead(runFunction, useReplica=None):
+
+  if isDbReplicaRead(useReplica):
+    try:
+      return dbRunNoTransaction(runFunction, dbLostConnectionErrnos, True)
+    except connector.Error as e:
+      if not isinstance(e, connector.errors.PoolError) and e.errno not in dbReplicaFallbackErrnos:
+        raise
+      print('# Replica read failed, reading from the primary: ' + str(e))
+
+  return dbRunNoTransaction(runFunction, dbLostConnectionErrnos)
+
+# runs a function outside a transaction, in the request connection or in a pooled one outside requests
+# reads are retried once when the connection was lost, writes only when the server had gone away before the statement
+def dbRunNoTransaction(runFunction, retryErrnos=(), replica=False):
+
+  retried = False
+  while True:
+    dbObjectIns = getRequestDbObject(replica)
+    requestScoped = dbObjectIns != None
+    if not requestScoped:
+      dbObjectIns = startGetDbObject(replica=replica)
+
+    try:
+      result = runFunction(dbObjectIns)
+      # commits even reads so the next statement sees a fresh snapshot
+      dbObjectIns.dbConnection.commit()
+    except Exception as e:
+      if requestScoped and not isDbConnectionLost(e):
+        try:
+          dbObjectIns.dbConnection.rollback()
+        except connector.Error:
+          dbObjectIns.dbTransactionDone = True
+          dbObjectIns.dbDiscard = True
+          closeDbObject(dbObjectIns)
+      else:
+        dbObjectIns.dbTransactionDone = True
+        dbObjectIns.dbDiscard = isDbConnectionLost(e)
+        closeDbObject(dbObjectIns)
+
+      if not retried and isinstance(e, connector.Error) and e.errno in retryErrnos:
+        print('# Database connection lost, retrying with a new connection: ' + str(e))
+        retried = True
+        continue
+      raise
+
+    if not requestScoped:
+      dbObjectIns.dbTransactionDone = True
+      closeDbObject(dbObjectIns)
+    return result
+
+# table written by an insert, update, delete or replace statement
+dbWriteTablePattern = re.compile(r'^\s*(?:INSERT\s+(?:IGNORE\s+)?INTO|REPLACE\s+(?:INTO\s+)?|UPDATE\s+(?:IGNORE\s+)?|DELETE\s+FROM)\s*`?(\w+)`?', re.IGNORECASE)
+
+# tables written by triggers of create_mt_schema
+dbTriggerWrittenTables = {
+  'tbl_employee': ('tbl_event',)
+}
+
+@lru_cache(maxsize=1024)
+def getDbWrittenTables(sqlScrypt):
+
+  tableMatch = dbWriteTablePattern.match(sqlScrypt)
+  if not tableMatch:
+    return ()
+
+  tableName = tableMatch.group(1).lower()
+  return (tableName,) + dbTriggerWrittenTables.get(tableName, ())
+
+# pseudo table whose version changes only when the counters are reset, see versionETag
+tableVersionEpochName = '_epoch'
+
+# version counters by table name in the sqlite file shared by the workers of the node
+class sharedTableVersionStore():
+  def __init__(self):
+    getSharedStateDb().execute(
+      ' CREATE TABLE IF NOT EXISTS tbl_table_version( '
+      '   table_name TEXT NOT NULL PRIMARY KEY, '
+      '   table_version INTEGER NOT NULL '
+      ' ); ')
+    # a new file starts the counters again from 0, the random epoch tells it apart from the previous one
+    getSharedStateDb().execute(
+      'INSERT OR IGNORE INTO tbl_table_version (table_name, table_version) VALUES (?, ?); ',
+      [tableVersionEpochName, random.getrandbits(62)])
+
+  def bumpVersions(self, tableNames):
+    with getSharedStateDb().transaction() as sharedConnection:
+      sharedConnection.executemany(
+        ' INSERT INTO tbl_table_version (table_name, table_version) VALUES (?, 1) '
+        ' ON CONFLICT(table_name) DO UPDATE SET table_version = table_version + 1; ',
+        [[tableName] for tableName in tableNames])
+
+  def getVersions(self):
+    return dict(getSharedStateDb().execute('SELECT table_name, table_version FROM tbl_table_version; ').fetchall())
+
+# version counters in tbl_table_version(sql/migrations), shared by every node using the database
+class dbTableVersionStore():
+
+  def bumpVersions(self, tableNames):
+
+    def run(dbObjectIns):
+      startTime = perf_counter()
+      sqlScrypt = (
+        ' INSERT INTO tbl_table_version (table_name, table_version) VALUES ' + ', '.join(['(%s, 1)'] * len(tableNames)) +
+        ' ON DUPLICATE KEY UPDATE table_version = table_version + 1; ')
+      dbCursor = dbCursorExecute(dbObjectIns, sqlScrypt, list(tableNames))
+      recordDbStatement(sqlScrypt, startTime, dbCursor.rowcount)
+
+    dbRunNoTransaction(run, (2006,))
+
+  def getVersions(self):
+    versionsQuery = dbGetAll(' SELECT table_name, table_version FROM tbl_table_version; ', useReplica=False)
+    return dict([(versionRow['table_name'], versionRow['table_version']) for versionRow in versionsQuery])
+
+tableVersionStoreTypes = {
+  'shared': sharedTableVersionStore,
+  'mysql': dbTableVersionStore
+}
+
+# TABLE_VERSION_BACKEND shared(default) for a single node, mysql when more nodes use the same database
+def getTableVersionStore():
+
+  global globalTableVersionStore
+
+  if globalTableVersionStore == None:
+    storeType = os.getenv('TABLE_VERSION_BACKEND', 'shared').lower()
+    if storeType not in tableVersionStoreTypes:
+      raise Exception('Invalid TABLE_VERSION_BACKEND ' + storeType + ', expected one of ' + ', '.join(tableVersionStoreTypes))
+    globalTableVersionStore = tableVersionStoreTypes[storeType]()
+  return globalTableVersionStore
+
+# tells every worker that cached data of the tables is outdated
+def bumpTableVersions(tableNames):
+
+  tableNames = sorted(set(tableNames))
+  if not tableNames:
+    return
+
+  try:
+    getTableVersionStore().bumpVersions(tableNames)
+  except Exception as e:
+    # the write is already commited, caches of these tables may be stale until their ttl
+    print('# Failed to bump table versions of ' + ', '.join(tableNames) + ': ' + str(e))
+
+  if has_app_context():
+    g.pop('dbTableVersions', None)
+
+  # entries of the old versions are never read again, they are freed now instead of waiting the ttl
+  if globalDbResultCache != None:
+    writtenTableNames = set(tableNames)
+    globalDbResultCache.deleteWhere(lambda cacheKey: not writtenTableNames.isdisjoint(cacheKey[3]))
+
+# versions of the given tables, to be compared with the ones read when the cached data was loaded
+# the versions are read once per request, tables never written have version 0
+def getTableVersions(tableNames):
+
+  tableVersions = g.get('dbTableVersions') if has_app_context() else None
+  if tableVersions == None:
+    tableVersions = getTableVersionStore().getVersions()
+    if has_app_context():
+      g.dbTableVersions = tableVersions
+
+  return tuple([tableVersions.get(tableName, 0) for tableName in tableNames])
+
+# DB_RESULT_CACHE_SIZE entries for up to DB_RESULT_CACHE_TTL seconds, 0 disables the result cache
+def getDbResultCache():
+
+  global globalDbResultCache
+
+  if globalDbResultCache == None:
+    globalDbResultCache = ttlLruCache(int(os.getenv('DB_RESULT_CACHE_SIZE', '256')), float(os.getenv('DB_RESULT_CACHE_TTL', '30')))
+  return globalDbResultCache
+
+dbSqlLiteralOrSpacePattern = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")|\s+")
+
+# collapses whitespace outside literals, the same statement built with other spacing shares the cache entry
+@lru_cache(maxsize=512)
+def normalizeCachedSqlScrypt(sqlScrypt):
+  return dbSqlLiteralOrSpacePattern.sub(lambda match: match.group(1) or ' ', sqlScrypt).strip()
+
+def copyDbRow(row):
+
+  if isinstance(row, dict):
+    return dict(row)
+  if isinstance(row, dbRow):
+    return type(row)([getattr(row, column) for column in row.__slots__])
+  return row
+
+# cached rows are shared by the requests, each caller gets its own copy to change
+def copyDbResult(result):
+
+  if isinstance(result, list):
+    return [copyDbRow(row) for row in result]
+  return copyDbRow(result)
+
+# result of a read cached by its statement, values and the versions of the tables it depends on
+# a write to any of those tables changes the key in every worker, cacheTtl overrides the ttl and 0 skips the cache
+def dbCachedRead(readFunction, sqlScrypt, values, resultKind, cacheTables, cacheTtl=None):
+
+  resultCache = getDbResultCache()
+  if not resultCache.isEnabled() or cacheTtl == 0:
+    return readFunction()
+
+  cacheTables = tuple(cacheTables)
+  cacheKey = (normalizeCachedSqlScrypt(sqlScrypt), tuple(values) if values else (), resultKind, cacheTables, getTableVersions(cacheTables))
+  try:
+    hash(cacheKey)
+  except TypeError:
+    return readFunction()
+
+  result = resultCache.get(cacheKey)
+  if result is cacheMiss:
+    result = readFunction()
+    # large results would take the memory of many small ones
+    if not isinstance(result, list) or len(result) <= int(os.getenv('DB_RESULT_CACHE_MAX_ROWS', '1000')):
+      resultCache.set(cacheKey, result, cacheTtl)
+
+  return copyDbResult(result)
+
+def dbCheckTransactionObject(dbObjectIns):
+
+  if not dbObjectIns:
+    print('# Error during transaction, db instance cannot be null')
+    return False
+  elif not isinstance(dbObjectIns, dbObject):
+    print("# Error during transaction, db instance not a db class object")
+    return False
+  
+  dbObjectIns.dbTransactionDone = False
+  return True
+
+# statements with values run as prepared statements cached in the pooled connection, returns the cursor used
+def dbCursorExecute(dbObjectIns, sqlScrypt, values, many=False):
+
+  statementCache = getattr(dbObjectIns.dbConnection, 'dbStatementCache', None)
+  if values != None and statementCache != None:
+    return statementCache.execute(sqlScrypt, values, many)
+
+  if many:
+    dbObjectIns.dbCursor.executemany(sqlScrypt, values)
+  elif values != None:
     dbObjectIns.dbCursor.execute(sqlScrypt, values)
   else:
     dbObjectIns.dbCursor.execute(sqlScrypt)
-  
-  if not transactionMode:
-    dbCommit(dbObjectIns)
+  return dbObjectIns.dbCursor
+
+def dbExecute(sqlScrypt, values=None, transactionMode=False, dbObjectIns=None):
+
+  def run(dbObjectIns):
+    startTime = perf_counter()
+    dbCursor = dbCursorExecute(dbObjectIns, sqlScrypt, values)
+    recordDbStatement(sqlScrypt, startTime, dbCursor.rowcount)
+
+  if not transactionMode and getCurrentTransaction() != None:
+    transactionMode, dbObjectIns = True, getCurrentTransaction()
+
+  if transactionMode:
+    if dbCheckTransactionObject(dbObjectIns):
+      run(dbObjectIns)
+      # versions are bumped by the commit
+      dbObjectIns.dbWrittenTables.update(getDbWrittenTables(sqlScrypt))
+    return
+
+  dbRunNoTransaction(run, (2006,))
+  markDbWrite()
+  bumpTableVersions(getDbWrittenTables(sqlScrypt))
 
 def dbExecuteMany(sqlScrypt, values=None, transactionMode=False, dbObjectIns=None):
 
+  def run(dbObjectIns):
+    startTime = perf_counter()
+    dbCursor = dbCursorExecute(dbObjectIns, sqlScrypt, values, True)
+    recordDbStatement(sqlScrypt, startTime, dbCursor.rowcount)
+
+  if not transactionMode and getCurrentTransaction() != None:
+    transactionMode, dbObjectIns = True, getCurrentTransaction()
+
   if transactionMode:
-    if not dbObjectIns:
-      print('# Error during transaction, db instance cannot be null')
-      return
-    elif not isinstance(dbObjectIns, dbObject):
-      print("# Error during transaction, db instance not a db class object")
-      return
-    dbObjectIns.dbTransactionDone = False
-    
-  if not transactionMode:
-    dbObjectIns = startGetDbObject()
-    dbObjectIns.dbConnection.commit()
-  
-  if values != None:
-    dbObjectIns.dbCursor.executemany(sqlScrypt, values)
-  else:
-    dbObjectIns.dbCursor.executemany(sqlScrypt)
-  
-  if not transactionMode:
-    dbCommit(dbObjectIns)
+    if dbCheckTransactionObject(dbObjectIns):
+      run(dbObjectIns)
+      # versions are bumped by the commit
+      dbObjectIns.dbWrittenTables.update(getDbWrittenTables(sqlScrypt))
+    return
+
+  dbRunNoTransaction(run, (2006,))
+  markDbWrite()
+  bumpTableVersions(getDbWrittenTables(sqlScrypt))
 
-def dbGetSingle(sqlScrypt, values=None, transactionMode=False, dbObjectIns=None):
+# cacheTables opts in the result cache with the tables the statement reads, see dbCachedRead
+def dbGetSingle(sqlScrypt, values=None, transactionMode=False, dbObjectIns=None, useReplica=None, cacheTables=None, cacheTtl=None):
+
+  def run(dbObjectIns):
+    startTime = perf_counter()
+    # prepared cursors are unbuffered, the remaining rows are read so the connection is free
+    rows = dbCursorExecute(dbObjectIns, sqlScrypt, values).fetchall()
+    recordDbStatement(sqlScrypt, startTime, len(rows))
+    return rows[0] if rows else None
+
+  if not transactionMode and getCurrentTransaction() != None:
+    transactionMode, dbObjectIns = True, getCurrentTransaction()
 
   if transactionMode:
-    if not dbObjectIns:
-      print('# Error during transaction, db instance cannot be null')
-      return
-    elif not isinstance(dbObjectIns, dbObject):
-      print("# Error during transaction, db instance not a db class object")
-      return
-    dbObjectIns.dbTransactionDone = False
-    
-  if not transactionMode:
-    dbObjectIns = startGetDbObject()
-    dbObjectIns.dbConnection.commit()
-  
-  if values != None:
-    dbObjectIns.dbCursor.execute(sqlScrypt, values)
-  else:
-    dbObjectIns.dbCursor.execute(sqlScrypt)
+    if dbCheckTransactionObject(dbObjectIns):
+      return run(dbObjectIns)
+    return
+
+  if cacheTables != None:
+    # a lagging replica would cache old rows with the new versions, cached reads use the primary unless told
+    return dbCachedRead(lambda: dbRunRead(run, useReplica == True), sqlScrypt, values, 'single', cacheTables, cacheTtl)
+
+  return dbRunRead(run, useReplica)
+
+# rowMode 'slots' or 'tuple' returns compact rows, see dbRow
+# cacheTables opts in the result cache with the tables the statement reads, see dbCachedRead
+def dbGetAll(sqlScrypt, values=None, transactionMode=False, dbObjectIns=None, useReplica=None, rowMode=None, cacheTables=None, cacheTtl=None):
 
-  return dbObjectIns.dbCursor.fetchone()
+  def run(dbObjectIns):
+    startTime = perf_counter()
+    if rowMode != None:
+      rows = dbFetchCompactRows(dbObjectIns, sqlScrypt, values, rowMode)
+    else:
+      rows = dbCursorExecute(dbObjectIns, sqlScrypt, values).fetchall()
+    recordDbStatement(sqlScrypt, startTime, len(rows))
+    return rows
 
-def dbGetAll(sqlScrypt, values=None, transactionMode=False, dbObjectIns=None):
+  if not transactionMode and getCurrentTransaction() != None:
+    transactionMode, dbObjectIns = True, getCurrentTransaction()
 
   if transactionMode:
-    if not dbObjectIns:
-      print('# Error during transaction, db instance cannot be null')
-      return
-    elif not isinstance(dbObjectIns, dbObject):
-      print("# Error during transaction, db instance not a db class object")
-      return
-    dbObjectIns.dbTransactionDone = False
-    
-  if not transactionMode:
-    dbObjectIns = startGetDbObject()
-    dbObjectIns.dbConnection.commit()
-  
-  if values != None:
-    dbObjectIns.dbCursor.execute(sqlScrypt, values)
+    if dbCheckTransactionObject(dbObjectIns):
+      return run(dbObjectIns)
+    return
+
+  if cacheTables != None:
+    return dbCachedRead(lambda: dbRunRead(run, useReplica == True), sqlScrypt, values, rowMode, cacheTables, cacheTtl)
+
+  return dbRunRead(run, useReplica)
+
+# compact row read like a dict(row['column'], row.get('column')), one subclass with __slots__ is created per column set
+# uses far less memory than dicts in large fetches, converted to dict only at the json boundary(dbJsonDefault)
+class dbRow():
+  __slots__ = ()
+
+  def __init__(self, values):
+    for column, value in zip(self.__slots__, values):
+      setattr(self, column, value)
+
+  def __getitem__(self, column):
+    try:
+      return getattr(self, column)
+    except AttributeError:
+      raise KeyError(column)
+
+  def __setitem__(self, column, value):
+    setattr(self, column, value)
+
+  def __contains__(self, column):
+    return column in self.__slots__
+
+  def __repr__(self):
+    return repr(self.toDict())
+
+  def get(self, column, default=None):
+    return getattr(self, column, default)
+
+  def keys(self):
+    return self.__slots__
+
+  def toDict(self):
+    return {column: getattr(self, column) for column in self.__slots__}
+
+# None when the columns can not be slots(repeated names or expressions without alias), dicts are used then
+@lru_cache(maxsize=256)
+def getDbRowClass(columnNames):
+
+  if len(set(columnNames)) != len(columnNames) or not all(column.isidentifier() for column in columnNames):
+    return None
+  return type('dbRow', (dbRow,), {'__slots__': columnNames})
+
+# rowMode 'tuple' keeps the cursor tuples, 'slots' builds dbRow objects
+def getCompactRows(rows, columnNames, rowMode):
+
+  if rowMode == 'tuple':
+    return rows
+
+  rowClass = getDbRowClass(tuple(columnNames))
+  if rowClass == None:
+    return [dict(zip(columnNames, row)) for row in rows]
+  return [rowClass(row) for row in rows]
+
+def dbFetchCompactRows(dbObjectIns, sqlScrypt, values, rowMode):
+
+  dbCursor = dbObjectIns.dbConnection.cursor(buffered=True)
+  try:
+    if values != None:
+      dbCursor.execute(sqlScrypt, values)
+    else:
+      dbCursor.execute(sqlScrypt)
+    return getCompactRows(dbCursor.fetchall(), dbCursor.column_names, rowMode)
+  finally:
+    dbCursor.close()
+
+# json default of the api, dbRow objects become dicts only when the response is serialized
+def dbJsonDefault(value):
+
+  if isinstance(value, dbRow):
+    return value.toDict()
+  # datetime is a date subclass
+  if isinstance(value, date):
+    return str(value)
+  # SUM and AVG of integer columns
+  if isinstance(value, Decimal):
+    return float(value)
+  raise TypeError('Object of type ' + type(value).__name__ + ' is not JSON serializable')
+
+# generator over large results, rows are read from the server in batches of batchSize with an unbuffered cursor
+# outside a transaction it uses its own pooled connection, so other queries can run while the rows are consumed
+def dbIterate(sqlScrypt, values=None, batchSize=None, useReplica=None, rowMode=None):
+
+  if batchSize == None:
+    batchSize = int(os.getenv('SQL_ITERATE_BATCH_SIZE', '500'))
+
+  currentTransaction = getCurrentTransaction()
+  if currentTransaction != None:
+    dbObjectIns = None
+    dbConnection = currentTransaction.dbConnection
+    dbCursor = dbConnection.cursor(dictionary=rowMode == None)
   else:
-    dbObjectIns.dbCursor.execute(sqlScrypt)
+    dbObjectIns = startGetDbObject(buffered=False, replica=isDbReplicaRead(useReplica), dictionary=rowMode == None)
+    dbConnection = dbObjectIns.dbConnection
+    dbCursor = dbObjectIns.dbCursor
+
+  # time spent by the consumer between batches is not accounted
+  dbTime = 0
+  rowCount = 0
+  try:
+    startTime = perf_counter()
+    if values != None:
+      dbCursor.execute(sqlScrypt, values)
+    else:
+      dbCursor.execute(sqlScrypt)
+
+    while True:
+      rows = dbCursor.fetchmany(batchSize)
+      dbTime += perf_counter() - startTime
+      if not rows:
+        break
+      rowCount += len(rows)
+      if rowMode != None:
+        rows = getCompactRows(rows, dbCursor.column_names, rowMode)
+      yield from rows
+      startTime = perf_counter()
+
+  finally:
+    recordDbStatement(sqlScrypt, perf_counter() - dbTime, rowCount)
+    # rows left by a consumer that stopped early are read and dropped so the connection can run other statements
+    dbDiscard = False
+    try:
+      if dbConnection.unread_result:
+        dbConnection.consume_results()
+    except connector.Error:
+      dbDiscard = True
 
-  return dbObjectIns.dbCursor.fetchall()
+    if dbObjectIns != None:
+      dbObjectIns.dbTransactionDone = True
+      dbObjectIns.dbDiscard = dbObjectIns.dbDiscard or dbDiscard
+      closeDbObject(dbObjectIns)
+    else:
+      try:
+        dbCursor.close()
+      except connector.Error:
+        pass
 
 def dbGetSqlFilterScrypt(argsObj, groupByCollumns=None, orderByCollumns=None, orderByAsc=True, limitValue=None, offsetValue=None, initialSqlJunctionClause=' WHERE ', filterEnding=';', getFilterWithoutLimits=False):
 
@@ -259,7 +1118,15 @@ def dbCreate(dbConnection, dbCursor):
   dbCursor.close()
 
 class dbObject():
-  def __init__(self, dbConnection, dbCursor, dbTransactionDone):
+  def __init__(self, dbConnection, dbCursor, dbTransactionDone, dbPool=None):
     self.dbConnection = dbConnection
     self.dbCursor = dbCursor
-    self.dbTransactionDone = dbTransactionDone
\ No newline at end of file
+    self.dbTransactionDone = dbTransactionDone
+    self.dbPool = dbPool
+    # when True the connection is closed instead of returned to the pool
+    self.dbDiscard = False
+    self.dbClosed = False
+    self.dbOpenedAt = None
+    self.dbSavepointDepth = 0
+    # tables written in the transaction, their versions are bumped on commit
+    self.dbWrittenTables = set()
\ No newline at end of file
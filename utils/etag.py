@@ -0,0 +1,83 @@
+from flask import g, request, Response
+from functools import wraps
+import hashlib
+import os
+
+from utils.dbUtils import getTableVersions, tableVersionEpochName
+
+# suffixes compressResponse adds to the etag of compressed bodies
+etagEncodings = ('gzip', 'br')
+
+def hashETag(data):
+  return hashlib.sha256(data).hexdigest()[:32]
+
+# etag the client already has for this representation, None when it has an outdated one or none
+def getMatchedETag(etag):
+
+  ifNoneMatch = request.if_none_match
+  if not ifNoneMatch:
+    return None
+
+  for candidateETag in [etag] + [etag + '-' + encoding for encoding in etagEncodings]:
+    if ifNoneMatch.contains_weak(candidateETag):
+      return candidateETag
+  return None
+
+def setETagHeaders(response, etag):
+
+  response.set_etag(etag)
+  # responses are per authenticated user and always revalidated, a match costs only the 304
+  response.cache_control.private = True
+  response.cache_control.no_cache = True
+  response.vary.add('Accept-Encoding')
+
+# for GET handlers whose response depends only on the query string and the given tables
+# the etag comes from the table versions, a match answers 304 before any query or serialization
+# placed below authRequired, the 304 is only given to authenticated requests
+def versionETag(tableNames):
+
+  tableNames = list(tableNames) + [tableVersionEpochName]
+
+  def decorator(function):
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+
+      if os.getenv('ETAG_TABLE_VERSIONS', 'true').lower() not in ['true', '1']:
+        return function(*args, **kwargs)
+
+      # versions are read before the data, a write done in between only makes the next request miss
+      etag = hashETag((request.full_path + repr(getTableVersions(tableNames))).encode())
+      matchedETag = getMatchedETag(etag)
+      if matchedETag:
+        response = Response(status=304)
+        setETagHeaders(response, matchedETag)
+        return response
+
+      g.versionETag = etag
+      return function(*args, **kwargs)
+    return wrapper
+  return decorator
+
+# strong etag on every json GET response, from versionETag or the hash of the body
+# the body hash still needs the query and the serialization, it saves the transfer only
+def setResponseETag(response):
+
+  if (request.method not in ('GET', 'HEAD') or response.status_code != 200 or response.direct_passthrough or
+    response.is_streamed or response.mimetype != 'application/json' or response.get_etag()[0]):
+    return response
+
+  etag = g.get('versionETag')
+  if not etag:
+    etag = hashETag(response.get_data())
+  setETagHeaders(response, etag)
+
+  matchedETag = getMatchedETag(etag)
+  if matchedETag:
+    response.set_etag(matchedETag)
+    response.status_code = 304
+    response.set_data(b'')
+
+  return response
+
+def registerETag(app):
+  app.after_request(setResponseETag)
@@ -10,6 +10,7 @@ from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
 from reportlab.lib import colors
 from reportlab.pdfgen import canvas
 from threading import Thread
+from itertools import chain
 from time import sleep
 from utils.utils import toBRCurrency
 
@@ -55,6 +56,19 @@ def threadDelayedRemoveReport(filePath):
 
 ##### General functions #####
 
+# reports receive row lists or row generators(dbIterate), returns None when there are no rows
+def getReportRows(rows):
+
+  if rows == None:
+    return None
+
+  rows = iter(rows)
+  firstRow = next(rows, None)
+  if firstRow == None:
+    return None
+
+  return chain([firstRow], rows)
+
 # get used personalized and common styles
 def getPersonalizedStyles():
 
@@ -344,7 +358,7 @@ def getConditionalClientTable2(conditionalQuery):
 def getConditionalTable(conditionalQuery):
 
   styles = getPersonalizedStyles()
-  creationDate = datetime.datetime.strptime(conditionalQuery['conditional_creation_date_time'], '%Y-%m-%d %H:%M:%S').strftime("%d/%m/%Y %H:%M:%S")
+  creationDate = conditionalQuery['conditional_creation_date_time'].strftime("%d/%m/%Y %H:%M:%S")
 
   data = [
     ['Código', 'Data e hora', 'Status'],
@@ -535,7 +549,7 @@ def getSaleTable(saleQuery):
   
   styles = getPersonalizedStyles()
   saleRawValue = saleQuery['sale_total_value']/(1-saleQuery['sale_total_discount_percentage'])
-  creationDate = datetime.datetime.strptime(saleQuery['sale_creation_date_time'], '%Y-%m-%d %H:%M:%S').strftime("%d/%m/%Y %H:%M:%S")
+  creationDate = saleQuery['sale_creation_date_time'].strftime("%d/%m/%Y %H:%M:%S")
 
   payments = ''
   paymentMethodNames = saleQuery['payment_method_names'].split(',')
@@ -599,7 +613,8 @@ def createClientsReport(filters, clientsQuery):
   elems.append(getFilterTable(filters))
 
   # if not find clients, append not find message
-  if not clientsQuery or len(clientsQuery) == 0:
+  clientsQuery = getReportRows(clientsQuery)
+  if not clientsQuery:
     elems.append(Spacer(1, 4*mm))
     elems.append(getTitle('Não foram encontrados clientes com estes filtros', 'Title_CENTER')),
   
@@ -654,7 +669,8 @@ def createConditionalsReport(filters, conditionalsSummary, conditionalsQuery):
   elems.append(getFilterTable(filters))
 
   # if not find conditionals, append not find message
-  if not conditionalsSummary or not conditionalsQuery or len(conditionalsQuery) == 0:
+  conditionalsQuery = getReportRows(conditionalsQuery)
+  if not conditionalsSummary or not conditionalsQuery:
     elems.append(Spacer(1, 4*mm))
     elems.append(getTitle('Não foram encontradas condicionais com estes filtros', 'Title_CENTER'))
   
@@ -685,7 +701,8 @@ def createProductsReport(filters, productsQuery):
   elems.append(getFilterTable(filters))
 
   # if not find products, append not find message
-  if not productsQuery or len(productsQuery) == 0:
+  productsQuery = getReportRows(productsQuery)
+  if not productsQuery:
     elems.append(Spacer(1, 4*mm))
     elems.append(getTitle('Não foram encontrados produtos com estes filtros', 'Title_CENTER')),
   
@@ -740,7 +757,8 @@ def createSalesReport(filters, salesSummary, salesQuery):
   elems.append(getFilterTable(filters))
 
   # if not find sales, append not find message
-  if not salesSummary or not salesQuery or len(salesQuery) == 0:
+  salesQuery = getReportRows(salesQuery)
+  if not salesSummary or not salesQuery:
     elems.append(Spacer(1, 4*mm))
     elems.append(getTitle('Não foram encontradas vendas com estes filtros', 'Title_CENTER'))
   
@@ -0,0 +1,39 @@
+from flask import make_response
+import json
+
+from utils.dbUtils import dbJsonDefault
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+# datetime and date are given to dbJsonDefault to keep the str() format the front end reads, 'yyyy-mm-dd hh:mm:ss'
+orjsonOptions = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS if orjson != None else 0
+
+# response body as bytes, ended by a new line like flask_restful output_json
+def dumpsJson(data):
+
+  if orjson != None:
+    try:
+      return orjson.dumps(data, default=dbJsonDefault, option=orjsonOptions) + b'\n'
+    except orjson.JSONEncodeError:
+      # values orjson does not take, like integers over 64 bits
+      pass
+
+  return (json.dumps(data, default=dbJsonDefault) + '\n').encode()
+
+def outputJson(data, code, headers=None):
+
+  response = make_response(dumpsJson(data), code)
+  response.headers.extend(headers or {})
+  return response
+
+# without orjson installed flask_restful keeps serializing with the json module and RESTFUL_JSON
+def registerJsonRepresentation(api):
+
+  if orjson == None:
+    print('# orjson not installed, using the json module for responses')
+    return
+
+  api.representations['application/json'] = outputJson
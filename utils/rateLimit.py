@@ -0,0 +1,101 @@
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+from utils.sharedState import getSharedStateDb
+
+# token bucket per key: up to capacity attempts in a burst, refilled by refillRate attempts per second
+# consume returns (allowed, seconds until the next attempt is allowed)
+def consumeBucket(bucketTokens, bucketUpdated, capacity, refillRate, now):
+
+  if bucketTokens == None:
+    bucketTokens = capacity
+  else:
+    bucketTokens = min(capacity, bucketTokens + (now - bucketUpdated) * refillRate)
+
+  if bucketTokens >= 1:
+    return (True, 0, bucketTokens - 1)
+  return (False, (1 - bucketTokens) / refillRate, bucketTokens)
+
+# buckets in the process memory, each gunicorn worker has its own limit
+class tokenBucketLimiter():
+  def __init__(self, capacity, refillRate, maxKeys=10000):
+    self.capacity = capacity
+    self.refillRate = refillRate
+    self.maxKeys = maxKeys
+    self.lock = Lock()
+    # key -> (tokens, last update time)
+    self.buckets = OrderedDict()
+
+  def isEnabled(self):
+    return self.capacity > 0 and self.refillRate > 0
+
+  def consume(self, bucketKey):
+
+    if not self.isEnabled():
+      return (True, 0)
+
+    with self.lock:
+      now = time()
+      bucketTokens, bucketUpdated = self.buckets.get(bucketKey, (None, None))
+      allowed, retryAfter, bucketTokens = consumeBucket(bucketTokens, bucketUpdated, self.capacity, self.refillRate, now)
+
+      self.buckets[bucketKey] = (bucketTokens, now)
+      self.buckets.move_to_end(bucketKey)
+      # the least recently used buckets are the ones most likely to be full again
+      while len(self.buckets) > self.maxKeys:
+        self.buckets.popitem(last=False)
+
+    return (allowed, retryAfter)
+
+# buckets in the sqlite file shared by the workers of a single node, the limit holds across workers
+class sharedTokenBucketLimiter():
+  def __init__(self, name, capacity, refillRate):
+    self.name = name
+    self.capacity = capacity
+    self.refillRate = refillRate
+    self.consumeCount = 0
+
+    getSharedStateDb().execute(
+      ' CREATE TABLE IF NOT EXISTS tbl_rate_bucket( '
+      '   bucket_key TEXT NOT NULL PRIMARY KEY, '
+      '   bucket_tokens REAL NOT NULL, '
+      '   bucket_updated REAL NOT NULL '
+      ' ); ')
+
+  def isEnabled(self):
+    return self.capacity > 0 and self.refillRate > 0
+
+  def consume(self, bucketKey):
+
+    if not self.isEnabled():
+      return (True, 0)
+
+    bucketKey = self.name + ':' + bucketKey
+    with getSharedStateDb().transaction() as sharedConnection:
+      now = time()
+      bucketRow = sharedConnection.execute('SELECT bucket_tokens, bucket_updated FROM tbl_rate_bucket WHERE bucket_key = ?; ', [bucketKey]).fetchone()
+      allowed, retryAfter, bucketTokens = consumeBucket(bucketRow[0] if bucketRow else None, bucketRow[1] if bucketRow else None, self.capacity, self.refillRate, now)
+
+      sharedConnection.execute(
+        ' INSERT INTO tbl_rate_bucket (bucket_key, bucket_tokens, bucket_updated) VALUES (?, ?, ?) '
+        ' ON CONFLICT(bucket_key) DO UPDATE SET bucket_tokens = excluded.bucket_tokens, bucket_updated = excluded.bucket_updated; ',
+        [bucketKey, bucketTokens, now])
+
+      # buckets untouched for a full refill are the same as missing ones
+      self.consumeCount += 1
+      if self.consumeCount % 1000 == 0:
+        sharedConnection.execute(
+          'DELETE FROM tbl_rate_bucket WHERE bucket_key LIKE ? AND bucket_updated < ?; ',
+          [self.name + ':%', now - self.capacity / self.refillRate])
+
+    return (allowed, retryAfter)
+
+# backend is memory or shared
+def createTokenBucketLimiter(backend, name, capacity, refillRate):
+
+  if backend == 'memory':
+    return tokenBucketLimiter(capacity, refillRate)
+  if backend == 'shared':
+    return sharedTokenBucketLimiter(name, capacity, refillRate)
+  raise Exception('Invalid rate limit backend ' + backend + ', expected memory or shared')
@@ -0,0 +1,85 @@
+from utils.dbUtils import dbGetAll, getTableVersions
+
+# rows of a small table cached by the worker with the versions of the tables they were read from, indexed by id
+# any write to the tables reloads the rows on the next use, callers must not change them
+class referenceList():
+  def __init__(self, tableNames, sqlScrypt, idColumn, nameColumn=None):
+    self.tableNames = tableNames
+    self.sqlScrypt = sqlScrypt
+    self.idColumn = idColumn
+    self.nameColumn = nameColumn
+    # (table versions, rows, rows by id)
+    self.loaded = None
+
+  def load(self):
+
+    # the versions are read before the rows, a write done in between only makes the next use reload them
+    tableVersions = getTableVersions(self.tableNames)
+    loaded = self.loaded
+    if loaded == None or loaded[0] != tableVersions:
+      # a lagging replica would keep old rows with the new versions until the next write, they are read from the primary
+      rows = dbGetAll(self.sqlScrypt, useReplica=False) or []
+      loaded = (tableVersions, rows, dict([(row[self.idColumn], row) for row in rows]))
+      self.loaded = loaded
+
+    return loaded
+
+  def getRows(self):
+    return self.load()[1]
+
+  # ids are integers in every reference table, ids sent as text are found as well
+  def getRow(self, rowId):
+    try:
+      rowId = int(rowId)
+    except (TypeError, ValueError):
+      return None
+    return self.load()[2].get(rowId)
+
+  def hasId(self, rowId):
+    return self.getRow(rowId) != None
+
+  # the id itself when it does not exist
+  def getName(self, rowId):
+    row = self.getRow(rowId)
+    return row[self.nameColumn] if row != None else rowId
+
+# product collections, types, colors, others and sizes are registered by services/product.py from its product info loader
+referenceLists = {
+  'payment_methods': referenceList(['tbl_payment_method'],
+    ' SELECT * FROM tbl_payment_method; ',
+    'payment_method_id', 'payment_method_name'),
+  'payment_method_installments': referenceList(['tbl_payment_method', 'tbl_payment_method_installment'],
+    ' SELECT pmi.payment_method_installment_id, pm.payment_method_name, pm.payment_method_id, pmi.payment_method_installment_number '
+    '   FROM tbl_payment_method pm '
+    '   JOIN tbl_payment_method_installment pmi ON pm.payment_method_id = pmi.payment_method_id; ',
+    'payment_method_installment_id'),
+  'event_names': referenceList(['tbl_event_name'],
+    ' SELECT event_name_id, event_name FROM tbl_event_name; ',
+    'event_name_id', 'event_name')
+}
+
+# anything with load, getRows, hasId and getName, like referenceList
+def registerReferenceList(listName, referenceListIns):
+  referenceLists[listName] = referenceListIns
+
+def getReferenceRows(listName):
+  return referenceLists[listName].getRows()
+
+def isReferenceId(listName, rowId):
+  return referenceLists[listName].hasId(rowId)
+
+def getReferenceName(listName, rowId):
+  return referenceLists[listName].getName(rowId)
+
+# check of requestItemField, the id exists in the reference list
+def referenceIdValidator(listName):
+  return lambda rowId: isReferenceId(listName, rowId)
+
+# reads every list once when the worker starts, failures only delay the load to the first use
+def loadReferenceData():
+
+  for listName, referenceListIns in referenceLists.items():
+    try:
+      referenceListIns.load()
+    except Exception as e:
+      print('# Failed to load reference data ' + listName + ': ' + str(e))
@@ -0,0 +1,187 @@
+from flask import request
+from flask_restful import abort as restfulAbort
+from flask_restful.reqparse import Namespace
+from werkzeug.datastructures import MultiDict
+
+# same names reqparse uses in its missing parameter message
+requestLocationNames = {
+  'json': 'the JSON body',
+  'form': 'the post body',
+  'args': 'the query string',
+  'values': 'the post body or the query string',
+  'headers': 'the HTTP headers',
+  'cookies': 'the request\'s cookies',
+  'files': 'an uploaded file'
+}
+
+def isPositive(value):
+  return value > 0
+
+def isNotNegative(value):
+  return value >= 0
+
+# type of integer item fields, bools and numbers with a fractional part are invalid instead of truncated
+def requestInt(value):
+  if isinstance(value, bool):
+    raise ValueError('Invalid integer ' + str(value))
+  if isinstance(value, float):
+    if not value.is_integer():
+      raise ValueError('Invalid integer ' + str(value))
+    return int(value)
+  return int(value)
+
+# type of decimal item fields, bools are invalid
+def requestFloat(value):
+  if isinstance(value, bool):
+    raise ValueError('Invalid number ' + str(value))
+  return float(value)
+
+# request argument declared once at module level, same parameters and behavior of reqparse add_argument
+# items validates each element of a list argument, see requestListSchema
+class requestArgument():
+  def __init__(self, name, location=('json', 'values'), type=str, help=None, required=False, default=None, items=None):
+    self.name = name
+    self.location = location
+    self.type = type
+    self.help = help
+    self.required = required
+    self.default = default
+    self.items = items
+
+    if isinstance(location, str):
+      locationName = requestLocationNames.get(location, location)
+    else:
+      locationName = ' or '.join([requestLocationNames.get(itemLocation, itemLocation) for itemLocation in location])
+    self.missingMessage = 'Missing required parameter in ' + locationName
+
+  def abortInvalid(self, errorMessage):
+    restfulAbort(400, message={self.name: self.help.format(error_msg=errorMessage) if self.help else errorMessage})
+
+  def parse(self, source):
+
+    if self.name not in source:
+      if self.required:
+        self.abortInvalid(self.missingMessage)
+      return self.default
+
+    values = source.getlist(self.name) if hasattr(source, 'getlist') else [source.get(self.name)]
+    if not values:
+      if self.required:
+        self.abortInvalid(self.missingMessage)
+      return self.default
+
+    results = []
+    for value in values:
+      if value != None:
+        try:
+          value = self.type(value)
+        except Exception as e:
+          self.abortInvalid(str(e))
+      results.append(value)
+
+    return results[0]
+
+# request arguments checked by one call, aborting with 400 and the argument help as reqparse does
+class requestSchema():
+  def __init__(self, arguments):
+    self.arguments = arguments
+    self.itemArguments = [argument for argument in arguments if argument.items != None]
+
+  # each location is read from the request once, in the order of the first argument using it
+  def getSources(self):
+
+    sources = {}
+    for argument in self.arguments:
+      if argument.location in sources:
+        continue
+
+      if isinstance(argument.location, str):
+        source = getattr(request, argument.location, MultiDict())
+        if callable(source):
+          source = source()
+        sources[argument.location] = source if source is not None else MultiDict()
+      else:
+        source = MultiDict()
+        for location in argument.location:
+          locationValues = getattr(request, location, None)
+          if callable(locationValues):
+            locationValues = locationValues()
+          if locationValues is not None:
+            source.update(locationValues)
+        sources[argument.location] = source
+
+    return sources
+
+  def parse(self):
+
+    sources = self.getSources()
+    args = Namespace()
+    for argument in self.arguments:
+      args[argument.name] = argument.parse(sources[argument.location])
+    return args
+
+  # message of the first invalid element of the list arguments, None when every one is valid
+  def getInvalidMessage(self, args):
+
+    for argument in self.itemArguments:
+      invalidMessage = argument.items.getInvalidMessage(args.get(argument.name))
+      if invalidMessage:
+        return invalidMessage
+    return None
+
+# field of the json objects inside a list argument
+# values are converted by type in place, None type keeps the value as sent
+# falsy values(0, '', [], False) are missing unless falsyMissing is False, then only None is
+class requestItemField():
+  def __init__(self, name, type=None, message=None, required=True, check=None, checkMessage=None, items=None, falsyMissing=True):
+    self.name = name
+    self.type = type
+    self.message = message
+    self.required = required
+    self.check = check
+    self.checkMessage = checkMessage if checkMessage else message
+    self.items = items
+    self.falsyMissing = falsyMissing
+
+# list of json objects, each validated by its fields, returning the message used in the 422 response
+class requestListSchema():
+  def __init__(self, fields, invalidMessage, emptyMessage=None):
+    self.fields = fields
+    self.invalidMessage = invalidMessage
+    # when given the list must have at least one element
+    self.emptyMessage = emptyMessage
+
+  def getInvalidMessage(self, items):
+
+    if not items:
+      return self.emptyMessage
+    if not isinstance(items, list):
+      return self.invalidMessage
+
+    for item in items:
+      if not isinstance(item, dict):
+        return self.invalidMessage
+
+      for field in self.fields:
+        value = item.get(field.name)
+        if value is None or (field.falsyMissing and not value):
+          if field.required:
+            return field.message
+          continue
+
+        if field.type != None:
+          try:
+            value = field.type(value)
+          except (TypeError, ValueError):
+            return field.message
+          item[field.name] = value
+
+        if field.check != None and not field.check(value):
+          return field.checkMessage
+
+        if field.items != None:
+          invalidMessage = field.items.getInvalidMessage(value)
+          if invalidMessage:
+            return invalidMessage
+
+    return None
@@ -0,0 +1,87 @@
+from threading import Lock
+import os
+
+from utils.sharedState import getSharedStateDb
+from utils.dbUtils import *
+
+globalSessionStore = None
+
+# every store keeps one token date time per user, formatted as %Y-%m-%d %H:%M:%S
+
+# tbl_auth_token in mysql, the default store
+class dbSessionStore():
+
+  def getToken(self, tokenUserId):
+    # the token is written on login, a lagging replica would not have it yet
+    authTokenQuery = dbGetSingle('SELECT token_date_time FROM tbl_auth_token WHERE token_user_id = %s; ', [(tokenUserId)], useReplica=False)
+    if not authTokenQuery:
+      return None
+    return authTokenQuery['token_date_time'].strftime("%Y-%m-%d %H:%M:%S")
+
+  # one round trip for login and token refresh, the user has a single token row
+  def setToken(self, tokenUserId, tokenDateTime):
+    dbExecute(
+      ' INSERT INTO tbl_auth_token (token_user_id, token_date_time) VALUES (%s, %s) '
+      ' ON DUPLICATE KEY UPDATE token_date_time = VALUES(token_date_time); ',
+      [tokenUserId, tokenDateTime])
+
+  def deleteToken(self, tokenUserId):
+    dbExecute('DELETE FROM tbl_auth_token WHERE token_user_id = %s; ', [(tokenUserId)])
+
+# tokens in the process memory, only for a single worker, sessions are lost on restart
+class memorySessionStore():
+  def __init__(self):
+    self.lock = Lock()
+    self.tokens = {}
+
+  def getToken(self, tokenUserId):
+    with self.lock:
+      return self.tokens.get(tokenUserId)
+
+  def setToken(self, tokenUserId, tokenDateTime):
+    with self.lock:
+      self.tokens[tokenUserId] = tokenDateTime
+
+  def deleteToken(self, tokenUserId):
+    with self.lock:
+      self.tokens.pop(tokenUserId, None)
+
+# tokens in the sqlite file shared by the workers of a single node
+class sharedSessionStore():
+  def __init__(self):
+    getSharedStateDb().execute(
+      ' CREATE TABLE IF NOT EXISTS tbl_auth_token( '
+      '   token_user_id INTEGER NOT NULL PRIMARY KEY, '
+      '   token_date_time TEXT NOT NULL '
+      ' ); ')
+
+  def getToken(self, tokenUserId):
+    tokenRow = getSharedStateDb().execute('SELECT token_date_time FROM tbl_auth_token WHERE token_user_id = ?; ', [tokenUserId]).fetchone()
+    return tokenRow[0] if tokenRow else None
+
+  def setToken(self, tokenUserId, tokenDateTime):
+    getSharedStateDb().execute(
+      ' INSERT INTO tbl_auth_token (token_user_id, token_date_time) VALUES (?, ?) '
+      ' ON CONFLICT(token_user_id) DO UPDATE SET token_date_time = excluded.token_date_time; ',
+      [tokenUserId, tokenDateTime])
+
+  def deleteToken(self, tokenUserId):
+    getSharedStateDb().execute('DELETE FROM tbl_auth_token WHERE token_user_id = ?; ', [tokenUserId])
+
+sessionStoreTypes = {
+  'mysql': dbSessionStore,
+  'memory': memorySessionStore,
+  'shared': sharedSessionStore
+}
+
+# AUTH_SESSION_STORE selects mysql(default), memory or shared
+def getSessionStore():
+
+  global globalSessionStore
+
+  if globalSessionStore == None:
+    storeType = os.getenv('AUTH_SESSION_STORE', 'mysql').lower()
+    if storeType not in sessionStoreTypes:
+      raise Exception('Invalid AUTH_SESSION_STORE ' + storeType + ', expected one of ' + ', '.join(sessionStoreTypes))
+    globalSessionStore = sessionStoreTypes[storeType]()
+  return globalSessionStore
@@ -0,0 +1,55 @@
+from contextlib import contextmanager
+from threading import local
+import tempfile
+import sqlite3
+import os
+
+globalSharedStateDb = None
+
+# sqlite file shared by the gunicorn workers of one node, for state that can not diverge between workers
+# each thread of each process has its own sqlite connection, writes are serialized by sqlite itself
+class sharedStateDb():
+  def __init__(self, path, timeout=5):
+    self.path = path
+    self.timeout = timeout
+    self.threadScope = local()
+
+  def getConnection(self):
+
+    sharedConnection = getattr(self.threadScope, 'sharedConnection', None)
+    # connections opened before a fork are not used by the child
+    if sharedConnection != None and self.threadScope.pid == os.getpid():
+      return sharedConnection
+
+    sharedConnection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+    sharedConnection.execute('PRAGMA journal_mode=WAL;')
+    sharedConnection.execute('PRAGMA synchronous=NORMAL;')
+    self.threadScope.sharedConnection = sharedConnection
+    self.threadScope.pid = os.getpid()
+    return sharedConnection
+
+  def execute(self, sqlScrypt, values=()):
+    return self.getConnection().execute(sqlScrypt, values)
+
+  # read and write done atomically, the write lock is taken at the begin
+  @contextmanager
+  def transaction(self):
+
+    sharedConnection = self.getConnection()
+    sharedConnection.execute('BEGIN IMMEDIATE;')
+    try:
+      yield sharedConnection
+    except Exception:
+      sharedConnection.execute('ROLLBACK;')
+      raise
+    sharedConnection.execute('COMMIT;')
+
+def getSharedStateDb():
+
+  global globalSharedStateDb
+
+  if globalSharedStateDb == None:
+    globalSharedStateDb = sharedStateDb(
+      os.getenv('SHARED_STATE_PATH', os.path.join(tempfile.gettempdir(), 'gestaomt_shared_state.sqlite')),
+      float(os.getenv('SHARED_STATE_TIMEOUT', '5')))
+  return globalSharedStateDb
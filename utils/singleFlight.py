@@ -0,0 +1,203 @@
+from flask import g, request, Response
+from functools import wraps
+from threading import Lock, Event
+from time import time, sleep
+from urllib.parse import urlencode
+import os
+
+from utils.sharedState import getSharedStateDb
+from utils.jsonUtils import dumpsJson
+
+globalSingleFlightGroup = None
+globalSingleFlightGroupLock = Lock()
+
+# handler result as ('data', data, status) or ('body', json bytes, status), None when it can not be shared(files, custom headers)
+def getShareableResult(result):
+
+  if isinstance(result, Response):
+    return None
+  if isinstance(result, tuple):
+    if len(result) > 2:
+      return None
+    return ('data', result[0], result[1] if len(result) > 1 else 200)
+  return ('data', result, 200)
+
+# each caller gets its own response object, the data is only read by the serialization
+def getHandlerResult(sharedResult):
+
+  kind, value, status = sharedResult
+  if kind == 'body':
+    return Response(value, status=status, mimetype='application/json')
+  return value, status
+
+# leases and results in the sqlite file shared by the workers of a single node
+# the worker holding the lease runs the handler, the others poll until its result is written
+class sharedFlightBackend():
+  def __init__(self, leaseTime, pollInterval):
+    self.leaseTime = leaseTime
+    self.pollInterval = pollInterval
+    self.acquireCount = 0
+
+    getSharedStateDb().execute(
+      ' CREATE TABLE IF NOT EXISTS tbl_single_flight( '
+      '   flight_key TEXT NOT NULL PRIMARY KEY, '
+      '   flight_expires REAL NOT NULL, '
+      '   flight_body BLOB, '
+      '   flight_status INTEGER '
+      ' ); ')
+
+  # True when this worker got the lease, False when another one is running the same flight
+  def acquire(self, flightKey):
+
+    with getSharedStateDb().transaction() as sharedConnection:
+      now = time()
+      flightRow = sharedConnection.execute('SELECT flight_expires, flight_body FROM tbl_single_flight WHERE flight_key = ?; ', [flightKey]).fetchone()
+      # a finished flight is not reused, its result is only for the workers that were waiting on it
+      if flightRow and flightRow[1] == None and flightRow[0] > now:
+        return False
+
+      sharedConnection.execute(
+        ' INSERT INTO tbl_single_flight (flight_key, flight_expires, flight_body, flight_status) VALUES (?, ?, NULL, NULL) '
+        ' ON CONFLICT(flight_key) DO UPDATE SET flight_expires = excluded.flight_expires, flight_body = NULL, flight_status = NULL; ',
+        [flightKey, now + self.leaseTime])
+
+      self.acquireCount += 1
+      if self.acquireCount % 1000 == 0:
+        sharedConnection.execute('DELETE FROM tbl_single_flight WHERE flight_expires < ?; ', [now])
+
+    return True
+
+  # the result stays while the waiting workers poll it
+  def complete(self, flightKey, body, status):
+    getSharedStateDb().execute(
+      'UPDATE tbl_single_flight SET flight_body = ?, flight_status = ?, flight_expires = ? WHERE flight_key = ?; ',
+      [body, status, time() + max(self.pollInterval * 10, 1), flightKey])
+
+  # the waiting workers run the handler themselves
+  def abandon(self, flightKey):
+    getSharedStateDb().execute('DELETE FROM tbl_single_flight WHERE flight_key = ? AND flight_body IS NULL; ', [flightKey])
+
+  # (body, status) of the flight run by another worker, None when it failed or its lease ended
+  def wait(self, flightKey):
+
+    deadline = time() + self.leaseTime
+    while time() < deadline:
+      sleep(self.pollInterval)
+      flightRow = getSharedStateDb().execute(
+        'SELECT flight_expires, flight_body, flight_status FROM tbl_single_flight WHERE flight_key = ?; ', [flightKey]).fetchone()
+      if flightRow == None:
+        return None
+      if flightRow[1] != None:
+        return (bytes(flightRow[1]), flightRow[2])
+      if flightRow[0] <= time():
+        return None
+    return None
+
+# handler running in this worker, the threads with the same key wait on done
+class localFlight():
+  def __init__(self):
+    self.done = Event()
+    # result of getShareableResult, None makes the waiting threads run the handler themselves
+    self.sharedResult = None
+
+# concurrent calls with the same key run the handler once, the other callers get its result
+class singleFlightGroup():
+  def __init__(self, waitTimeout, sharedBackend=None):
+    self.waitTimeout = waitTimeout
+    self.sharedBackend = sharedBackend
+    self.lock = Lock()
+    self.flights = {}
+
+  def run(self, flightKey, function):
+
+    with self.lock:
+      flight = self.flights.get(flightKey)
+      isLeader = flight == None
+      if isLeader:
+        flight = localFlight()
+        self.flights[flightKey] = flight
+
+    if not isLeader:
+      if flight.done.wait(self.waitTimeout) and flight.sharedResult != None:
+        return getHandlerResult(flight.sharedResult)
+      return function()
+
+    try:
+      result, flight.sharedResult = self.runLeader(flightKey, function)
+      return result
+    finally:
+      with self.lock:
+        self.flights.pop(flightKey, None)
+      flight.done.set()
+
+  # (handler result, shareable result) of the leader thread of this worker
+  def runLeader(self, flightKey, function):
+
+    if self.sharedBackend == None:
+      result = function()
+      return (result, getShareableResult(result))
+
+    try:
+      acquired = self.sharedBackend.acquire(flightKey)
+    except Exception as e:
+      print('# Single flight lease failed, running alone: ' + str(e))
+      result = function()
+      return (result, getShareableResult(result))
+
+    if not acquired:
+      sharedBody = self.sharedBackend.wait(flightKey)
+      if sharedBody != None:
+        sharedResult = ('body', sharedBody[0], sharedBody[1])
+        return (getHandlerResult(sharedResult), sharedResult)
+      result = function()
+      return (result, getShareableResult(result))
+
+    try:
+      result = function()
+    except Exception:
+      self.sharedBackend.abandon(flightKey)
+      raise
+
+    sharedResult = getShareableResult(result)
+    if sharedResult == None:
+      self.sharedBackend.abandon(flightKey)
+      return (result, None)
+
+    # serialized once for every worker, the leader responds with the same bytes
+    sharedResult = ('body', dumpsJson(sharedResult[1]), sharedResult[2])
+    self.sharedBackend.complete(flightKey, sharedResult[1], sharedResult[2])
+    return (getHandlerResult(sharedResult), sharedResult)
+
+# SINGLE_FLIGHT_BACKEND memory(default) coalesces the threads of a worker, shared also the workers of the node, off disables it
+def getSingleFlightGroup():
+
+  global globalSingleFlightGroup
+
+  with globalSingleFlightGroupLock:
+    if globalSingleFlightGroup == None:
+      backend = os.getenv('SINGLE_FLIGHT_BACKEND', 'memory').lower()
+      waitTimeout = float(os.getenv('SINGLE_FLIGHT_WAIT', '30'))
+      if backend == 'off':
+        globalSingleFlightGroup = False
+      elif backend == 'memory':
+        globalSingleFlightGroup = singleFlightGroup(waitTimeout)
+      elif backend == 'shared':
+        globalSingleFlightGroup = singleFlightGroup(waitTimeout,
+          sharedFlightBackend(waitTimeout, float(os.getenv('SINGLE_FLIGHT_POLL_INTERVAL', '0.05'))))
+      else:
+        raise Exception('Invalid SINGLE_FLIGHT_BACKEND ' + backend + ', expected memory, shared or off')
+  return globalSingleFlightGroup
+
+# for expensive GET handlers whose response depends only on the query string
+# the key takes the versionETag of the request when there is one, so a flight never spans a write to its tables
+def singleFlight(function):
+  @wraps(function)
+  def wrapper(*args, **kwargs):
+
+    group = getSingleFlightGroup()
+    if not group:
+      return function(*args, **kwargs)
+
+    flightKey = request.path + '?' + (g.get('versionETag') or urlencode(sorted(request.args.items(multi=True))))
+    return group.run(flightKey, lambda: function(*args, **kwargs))
+  return wrapper